@@ -0,0 +1,358 @@
+'''
+Created on 18/10/2014
+
+@author: gerard
+'''
+
+# End-to-end benchmark of the C-Lab SFAWrap Aggregate Manager.
+# The ClabDriver is driven directly (without the SFA XML-RPC server and credentials) against the
+# local mock controller (mock_controller.py) at several testbed sizes. For every AM operation
+# (GetVersion, ListResources, Allocate, Describe, Provision, Status, Renew, PerformOperationalAction,
+# Delete) it records the wall time, the number of controller requests, the bytes transferred by the
+# controller and the peak memory of the process into a JSON file that can be kept as a baseline.
+# A second command compares a new run against the baseline and flags the regressions beyond a threshold.
+#
+# Usage (from the root of the package, with SFA and CONFINE-ORM installed):
+#     python benchmark/bench_am.py run --sizes 10x5x20,100x20x200 --output baseline.json
+#     python benchmark/bench_am.py run --sizes 10x5x20,100x20x200 --output new.json
+#     python benchmark/bench_am.py compare baseline.json new.json --threshold 0.2
+#     python benchmark/bench_am.py run --budgets ListResources:10,Describe:25,Status:25
+#
+# The configuration of the driver is read from the sfa_config file of the package, with the
+# C-Lab URL, user and group of the mock controller. The aggregate cache is disabled unless
+# --cache is given, so the measures reflect the work done for every call.
+# If budgets of controller requests per AM method are given (--budgets or call_budgets of the sfa_config
+# file), run also checks calls <= budget for every AM call (call budget check) and fails otherwise.
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import platform
+from ConfigParser import RawConfigParser
+from optparse import OptionParser
+
+from mock_controller import MockController
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Default testbed sizes (nodes x slices x slivers)
+DEFAULT_SIZES = '10x5x20,100x20x200'
+
+# Number of nodes of the slice allocated by the benchmark
+DEFAULT_ALLOCATED_NODES = 5
+
+# Metrics compared against the baseline
+COMPARED_METRICS = ('wall_time', 'controller_calls', 'bytes', 'peak_memory_kb')
+
+# AM operations, in the order they are executed
+OPERATIONS = ('GetVersion', 'ListResources', 'Allocate', 'Describe', 'Provision', 'Status',
+              'Renew', 'PerformOperationalAction', 'Delete')
+
+
+#################
+# CONFIGURATION #
+#################
+
+class BenchmarkConfig:
+    '''
+    SFA configuration of the benchmark: the values of an sfa_config file
+    (section [sfa_clab], key url --> SFA_CLAB_URL) plus the given overrides
+    '''
+
+    def __init__(self, path, **overrides):
+        parser = RawConfigParser()
+        parser.read(path)
+        for section in parser.sections():
+            prefix = 'SFA' if section == 'sfa' else section.upper()
+            for (key, value) in parser.items(section):
+                setattr(self, '%s_%s'%(prefix, key.upper()), self.parse_value(value))
+        for (name, value) in overrides.items():
+            setattr(self, name, value)
+
+    def parse_value(self, value):
+        if value.lower() in ['true', 'false']:
+            return value.lower() == 'true'
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+
+class BenchmarkApi:
+    '''
+    Minimal stand-in of the SFA server api given to the driver (only the configuration is used)
+    '''
+
+    def __init__(self, config):
+        self.config = config
+
+
+##########
+# RUNNER #
+##########
+
+def parse_sizes(sizes):
+    '''
+    Parse the testbed sizes, e.g. '10x5x20,100x20x200' --> [(10, 5, 20), (100, 20, 200)]
+    '''
+    return [tuple(int(value) for value in size.split('x')) for size in sizes.split(',') if size]
+
+
+def request_rspec(authority, node_names):
+    '''
+    Request RSpec (GENI v3) of a sliver in each of the given nodes
+    '''
+    from sfa.clab.clab_xrn import hostname_to_urn
+    nodes = ''.join(['<node client_id="%s" component_id="%s" exclusive="false"><sliver_type name="RD_sliver"/></node>'
+                     %(name, hostname_to_urn(authority, name)) for name in node_names])
+    return '<?xml version="1.0"?><rspec type="request" xmlns="http://www.geni.net/resources/rspec/3">%s</rspec>'%nodes
+
+
+def peak_memory_kb():
+    '''
+    Peak resident memory of the process (KB). It is the maximum reached so far by the process,
+    so the value of an operation is the peak reached during that operation or before it.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes in Mac OS X, kilobytes in Linux
+    return peak / 1024 if platform.system() == 'Darwin' else peak
+
+
+def measure(controller, name, call, repeat=1):
+    '''
+    Execute an AM operation and measure it
+
+    :param controller: mock controller used by the driver
+    :type MockController
+
+    :param name: name of the AM operation
+    :type string
+
+    :param call: function without arguments that executes the operation
+    :type function
+
+    :param repeat: number of executions (the best wall time is kept; the controller requests
+        and bytes are those of one execution)
+    :type int
+
+    :returns measures of the operation and result of the last execution
+    :rtype tuple (dict, object)
+    '''
+    from sfa.clab.clab_metrics import call_budget
+
+    result = None
+    measures = {'wall_time': None, 'controller_calls': None, 'bytes': None, 'peak_memory_kb': None, 'error': None,
+                'budget': None, 'budget_calls': None}
+    for i in range(repeat):
+        controller.reset_stats()
+        previous_report = call_budget.last_report(name)
+        start = time.time()
+        try:
+            result = call()
+        except Exception, e:
+            measures['error'] = '%s: %s'%(e.__class__.__name__, e)
+        wall_time = time.time() - start
+        if measures['wall_time'] is None or wall_time < measures['wall_time']:
+            measures['wall_time'] = wall_time
+        measures['controller_calls'] = controller.stats['requests']
+        measures['bytes'] = controller.stats['bytes']
+        measures['peak_memory_kb'] = peak_memory_kb()
+        # controller requests of the AM call checked against its budget (call budget check)
+        report = call_budget.last_report(name)
+        if report is not None and report is not previous_report and report['budget'] is not None:
+            measures['budget'] = report['budget']
+            measures['budget_calls'] = max(report['calls'], measures['budget_calls'])
+        if measures['error']:
+            break
+    over_budget = measures['budget'] is not None and measures['budget_calls'] > measures['budget']
+    print "  %-26s %8.3fs %6d calls %10d bytes%s%s"%(name, measures['wall_time'], measures['controller_calls'], measures['bytes'],
+                                                    '  OVER BUDGET %s/%s'%(measures['budget_calls'], measures['budget']) if over_budget else '',
+                                                    '  ERROR %s'%measures['error'] if measures['error'] else '')
+    return measures, result
+
+
+def run_size(size, options):
+    '''
+    Run all the AM operations against a mock controller with a testbed of the given size
+
+    :param size: (nodes, slices, slivers)
+    :type tuple
+
+    :returns measures of each AM operation
+    :rtype dict
+    '''
+    from sfa.util.xrn import hrn_to_urn
+    from sfa.clab.clab_driver import ClabDriver
+    from sfa.clab.clab_index import clab_index
+    from sfa.clab.clab_xrn import clear_translation_caches
+
+    n_nodes, n_slices, n_slivers = size
+    controller = MockController(nodes=n_nodes, slices=n_slices, slivers=n_slivers, latency=options.latency).start()
+    exp_data_dir = tempfile.mkdtemp(prefix='clab_bench')
+    try:
+        config = BenchmarkConfig(options.config, SFA_CLAB_URL=controller.base_uri + '/', SFA_CLAB_USER='vct',
+                                 SFA_CLAB_PASSWORD='vct', SFA_CLAB_GROUP='vct', SFA_CLAB_WARM_START=False,
+                                 SFA_AGGREGATE_CACHING=options.cache, SFA_CLAB_TEMP_DIR_EXP_DATA=exp_data_dir + '/')
+        # budget of controller requests per AM method (--budgets or call_budgets of the sfa_config file)
+        budgets = options.budgets if options.budgets is not None else getattr(config, 'SFA_CLAB_CALL_BUDGETS', '')
+        config.SFA_CLAB_CALL_BUDGETS = budgets or ''
+        config.SFA_CLAB_CALL_BUDGET_CHECK = 'warn' if budgets else 'off'
+        # the aggregate cache, the index and the URN translations are process-wide:
+        # new ones for each testbed (the mock controller of each size has a different port)
+        if ClabDriver.cache is not None:
+            ClabDriver.cache.stop_sweeper()
+            ClabDriver.cache = None
+        clab_index.clear()
+        clear_translation_caches()
+        driver = ClabDriver(BenchmarkApi(config))
+        authority = config.SFA_INTERFACE_HRN
+        slice_urn = hrn_to_urn('%s.benchmark'%authority, 'slice')
+        node_names = sorted(controller.testbed.entities['nodes'].values(), key=lambda node: node['id'])
+        node_names = [node['name'] for node in node_names[:options.allocated_nodes]]
+        rspec_version = {'type': 'GENI', 'version': '3'}
+        expiration = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 7*24*3600))
+
+        calls = {
+            'GetVersion': lambda: driver.aggregate_version(),
+            'ListResources': lambda: driver.list_resources(None, {'geni_rspec_version': dict(rspec_version)}),
+            'Allocate': lambda: driver.allocate(slice_urn, request_rspec(authority, node_names), expiration, {}),
+            'Describe': lambda: driver.describe([slice_urn], None, {'geni_rspec_version': dict(rspec_version)}),
+            'Provision': lambda: driver.provision([slice_urn], {'geni_rspec_version': dict(rspec_version), 'geni_users': []}),
+            'Status': lambda: driver.status([slice_urn], {}),
+            'Renew': lambda: driver.renew([slice_urn], expiration, {}),
+            'PerformOperationalAction': lambda: driver.perform_operational_action([slice_urn], 'geni_start', {}),
+            'Delete': lambda: driver.delete([slice_urn], {}),
+        }
+        # operations that modify the testbed are executed once
+        read_only = ['GetVersion', 'ListResources', 'Describe', 'Status']
+        results = {}
+        for name in OPERATIONS:
+            repeat = options.repeat if name in read_only else 1
+            results[name], result = measure(controller, name, calls[name], repeat)
+        return results
+    finally:
+        controller.stop()
+        shutil.rmtree(exp_data_dir, ignore_errors=True)
+
+
+def run(options):
+    '''
+    Run the benchmark at all the testbed sizes and write the results (JSON)
+    '''
+    report = {'meta': {'time': time.time(), 'python': platform.python_version(), 'host': platform.node(),
+                       'latency': options.latency, 'repeat': options.repeat, 'cache': options.cache,
+                       'allocated_nodes': options.allocated_nodes},
+              'results': {}}
+    for size in parse_sizes(options.sizes):
+        name = 'x'.join([str(value) for value in size])
+        print "Testbed %s (nodes x slices x slivers)"%name
+        report['results'][name] = run_size(size, options)
+    output = open(options.output, 'w')
+    try:
+        json.dump(report, output, indent=1, sort_keys=True)
+    finally:
+        output.close()
+    print "Results written to %s"%options.output
+    # assert calls <= budget for each AM method with a budget
+    over_budget = [(size, operation, measures['budget_calls'], measures['budget'])
+                   for (size, results) in sorted(report['results'].items())
+                   for (operation, measures) in sorted(results.items())
+                   if measures['budget'] is not None and measures['budget_calls'] > measures['budget']]
+    for (size, operation, calls, budget) in over_budget:
+        print "OVER BUDGET %s %s: %s controller requests (budget %s)"%(size, operation, calls, budget)
+    return 1 if over_budget else 0
+
+
+###########
+# COMPARE #
+###########
+
+def compare(baseline, current, threshold, min_wall_time=0.01):
+    '''
+    Compare the results of a run against the baseline
+
+    :param baseline: results of the baseline run
+    :type dict
+
+    :param current: results of the new run
+    :type dict
+
+    :param threshold: relative increase considered a regression (e.g. 0.2 = 20%)
+    :type float
+
+    :param min_wall_time: wall time differences below this value (seconds) are ignored (noise)
+    :type float
+
+    :returns list of regressions (size, operation, metric, baseline value, current value)
+        and list of new errors (size, operation, error)
+    :rtype tuple (list, list)
+    '''
+    regressions = []
+    errors = []
+    for (size, operations) in sorted(current['results'].items()):
+        for (operation, measures) in sorted(operations.items()):
+            base = baseline['results'].get(size, {}).get(operation)
+            if base is None:
+                continue
+            if measures.get('error') and not base.get('error'):
+                errors.append((size, operation, measures['error']))
+                continue
+            for metric in COMPARED_METRICS:
+                old, new = base.get(metric), measures.get(metric)
+                if old is None or new is None:
+                    continue
+                if metric == 'wall_time' and new - old < min_wall_time:
+                    continue
+                if new > old * (1 + threshold):
+                    regressions.append((size, operation, metric, old, new))
+    return regressions, errors
+
+
+def compare_files(baseline_path, current_path, threshold):
+    '''
+    Compare two result files and print the regressions
+
+    :returns exit status (1 if there are regressions or new errors)
+    :rtype int
+    '''
+    baseline = json.load(open(baseline_path))
+    current = json.load(open(current_path))
+    regressions, errors = compare(baseline, current, threshold)
+    for (size, operation, metric, old, new) in regressions:
+        print "REGRESSION %s %s %s: %s --> %s (%+.0f%%)"%(size, operation, metric, old, new,
+                                                       100.0 * (new - old) / old if old else float('inf'))
+    for (size, operation, error) in errors:
+        print "NEW ERROR %s %s: %s"%(size, operation, error)
+    if not regressions and not errors:
+        print "No regressions over %.0f%%"%(threshold * 100)
+        return 0
+    return 1
+
+
+def main():
+    parser = OptionParser(usage='%prog run [options]\n       %prog compare BASELINE CURRENT [--threshold T]')
+    parser.add_option('--sizes', default=DEFAULT_SIZES, help='testbed sizes: NODESxSLICESxSLIVERS,... (default %default)')
+    parser.add_option('--output', default='bench_am.json', help='results file (default %default)')
+    parser.add_option('--config', default=os.path.join(PACKAGE_DIR, 'sfa_config'), help='sfa_config file (default %default)')
+    parser.add_option('--latency', type='float', default=0.0, help='latency of the mock controller per request (seconds)')
+    parser.add_option('--repeat', type='int', default=3, help='executions of the read-only operations (best time kept)')
+    parser.add_option('--allocated-nodes', type='int', default=DEFAULT_ALLOCATED_NODES, help='slivers allocated by Allocate')
+    parser.add_option('--cache', action='store_true', default=False, help='enable the aggregate cache')
+    parser.add_option('--budgets', default=None,
+                      help='budget of controller requests per AM method METHOD:CALLS,... checked in run (default: call_budgets of the sfa_config file)')
+    parser.add_option('--threshold', type='float', default=0.2, help='regression threshold for compare (default %default)')
+    options, args = parser.parse_args()
+    if args[:1] == ['run']:
+        return run(options)
+    if args[:1] == ['compare'] and len(args) == 3:
+        return compare_files(args[1], args[2], options.threshold)
+    parser.print_usage()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
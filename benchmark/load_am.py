@@ -0,0 +1,313 @@
+'''
+Created on 19/10/2014
+
+@author: gerard
+'''
+
+# Concurrent load generator for the C-Lab SFAWrap Aggregate Manager.
+# A configurable mix of AM calls (e.g. 70% Status, 20% ListResources, 10% Allocate/Delete) is sent
+# to the ClabDriver from many threads at a target rate, against the local mock controller.
+# The calls are scheduled at the target rate regardless of how fast they are served (open loop), so
+# the latency includes the time waiting for a free worker: lock contention and pool exhaustion show up
+# as growing latencies. Throughput, latency percentiles and error rate are reported over time
+# (every interval) and per AM method at the end.
+#
+# Usage (from the root of the package, with SFA and CONFINE-ORM installed):
+#     python benchmark/load_am.py --threads 16 --rate 20 --duration 60 \
+#         --mix Status:70,ListResources:20,Allocate:5,Delete:5 --nodes 100 --slices 20 --slivers 200
+#
+# Status and Describe target the slices of the synthetic testbed. Allocate creates a new slice with
+# one sliver, and Delete removes one of the slices created by Allocate (it is skipped if there is none).
+# By default all the calls share one ClabDriver; --driver-per-call creates a new one for every call,
+# as the SFA server does for every incoming request (the driver prints its configuration each time).
+
+import os
+import sys
+import json
+import time
+import Queue
+import random
+import shutil
+import tempfile
+import threading
+from optparse import OptionParser
+
+from mock_controller import MockController
+from bench_am import BenchmarkConfig, BenchmarkApi, request_rspec, PACKAGE_DIR
+
+# Default mix of AM calls (method:weight)
+DEFAULT_MIX = 'Status:70,ListResources:20,Allocate:5,Delete:5'
+
+# AM methods that can be part of the mix
+MIX_METHODS = ('GetVersion', 'ListResources', 'Describe', 'Status', 'Allocate', 'Delete')
+
+
+def parse_mix(mix):
+    '''
+    Parse the mix of AM calls, e.g. 'Status:70,ListResources:30' --> [('Status', 70.0), ('ListResources', 30.0)]
+    '''
+    parsed = []
+    for item in mix.split(','):
+        if not item:
+            continue
+        method, weight = item.split(':')
+        if method not in MIX_METHODS:
+            raise ValueError('Unsupported AM method in the mix: %s (supported: %s)'%(method, ', '.join(MIX_METHODS)))
+        parsed.append((method, float(weight)))
+    return parsed
+
+
+def choose(mix, rnd):
+    '''
+    Choose an AM method of the mix according to the weights
+    '''
+    point = rnd.random() * sum([weight for (method, weight) in mix])
+    for (method, weight) in mix:
+        point -= weight
+        if point < 0:
+            return method
+    return mix[-1][0]
+
+
+class LoadGenerator:
+    '''
+    Sends the mix of AM calls to the driver from a pool of worker threads at the target rate
+    and collects the outcome of every call.
+    '''
+
+    def __init__(self, api, controller, mix, threads, rate, duration, interval, seed=0, driver_per_call=False):
+        from sfa.util.xrn import hrn_to_urn
+        from sfa.clab.clab_driver import ClabDriver
+        self.api = api
+        self.driver_class = ClabDriver
+        self.driver = ClabDriver(api)
+        self.driver_per_call = driver_per_call
+        self.controller = controller
+        self.mix = mix
+        self.threads = threads
+        self.rate = rate
+        self.duration = duration
+        self.interval = interval
+        self.rnd = random.Random(seed)
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        # (method, scheduled time, start time, end time, error)
+        self.samples = []
+        self.skipped = 0
+        self.authority = api.config.SFA_INTERFACE_HRN
+        self.slice_urns = [entity['name'] for entity in controller.testbed.entities['slices'].values()]
+        self.node_names = [entity['name'] for entity in controller.testbed.entities['nodes'].values()]
+        self.allocated = []
+        self.allocations = 0
+        self.hrn_to_urn = hrn_to_urn
+        self.rspec_version = {'type': 'GENI', 'version': '3'}
+
+    def call(self, method):
+        '''
+        Execute an AM call of the mix
+
+        :returns False if the call was skipped
+        :rtype boolean
+        '''
+        driver = self.driver_class(self.api) if self.driver_per_call else self.driver
+        if method == 'GetVersion':
+            driver.aggregate_version()
+        elif method == 'ListResources':
+            driver.list_resources(None, {'geni_rspec_version': dict(self.rspec_version)})
+        elif method in ['Describe', 'Status']:
+            slice_urn = self.rnd.choice(self.slice_urns)
+            if method == 'Describe':
+                driver.describe([slice_urn], None, {'geni_rspec_version': dict(self.rspec_version)})
+            else:
+                driver.status([slice_urn], {})
+        elif method == 'Allocate':
+            with self.lock:
+                self.allocations += 1
+                slice_urn = self.hrn_to_urn('%s.load%d'%(self.authority, self.allocations), 'slice')
+            expiration = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 24*3600))
+            driver.allocate(slice_urn, request_rspec(self.authority, [self.rnd.choice(self.node_names)]), expiration, {})
+            with self.lock:
+                self.allocated.append(slice_urn)
+        elif method == 'Delete':
+            with self.lock:
+                if not self.allocated:
+                    return False
+                slice_urn = self.allocated.pop(0)
+            driver.delete([slice_urn], {})
+        return True
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            method, scheduled = item
+            start = time.time()
+            error = None
+            try:
+                done = self.call(method)
+            except Exception, e:
+                done = True
+                error = '%s: %s'%(e.__class__.__name__, e)
+            end = time.time()
+            with self.lock:
+                if done:
+                    self.samples.append((method, scheduled, start, end, error))
+                else:
+                    self.skipped += 1
+
+    def run(self):
+        '''
+        Schedule the calls at the target rate (as fast as the workers take them if the rate is 0)
+        during the given duration, and wait for the calls in progress
+        '''
+        workers = [threading.Thread(target=self.worker, name='load-worker-%d'%i) for i in range(self.threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        self.start = time.time()
+        sent = 0
+        while True:
+            now = time.time()
+            if now - self.start >= self.duration:
+                break
+            if self.rate:
+                scheduled = self.start + sent / float(self.rate)
+                if scheduled > now:
+                    time.sleep(min(scheduled - now, 0.05))
+                    continue
+            else:
+                # closed loop: keep one call waiting per worker
+                if self.queue.qsize() >= self.threads:
+                    time.sleep(0.001)
+                    continue
+                scheduled = now
+            self.queue.put((choose(self.mix, self.rnd), scheduled))
+            sent += 1
+        for worker in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+        self.end = time.time()
+
+    def summarize(self, samples, elapsed):
+        '''
+        Throughput, latency percentiles and error rate of a set of calls
+        '''
+        from sfa.clab.clab_metrics import LatencyHistogram
+        latency = LatencyHistogram(max_samples=max(len(samples), 1))
+        service = LatencyHistogram(max_samples=max(len(samples), 1))
+        errors = 0
+        for (method, scheduled, start, end, error) in samples:
+            latency.add(end - scheduled)
+            service.add(end - start)
+            if error:
+                errors += 1
+        latency_summary = latency.summary()
+        return {'calls': len(samples), 'throughput': len(samples) / elapsed if elapsed else 0.0,
+                'errors': errors, 'error_rate': float(errors) / len(samples) if samples else 0.0,
+                'latency_p50': latency_summary['p50'], 'latency_p95': latency_summary['p95'],
+                'latency_p99': latency_summary['p99'], 'latency_max': latency_summary['max'],
+                'service_avg': service.summary()['avg']}
+
+    def report(self):
+        '''
+        Report over time (per interval, by completion time) and per AM method
+
+        :returns report
+        :rtype dict
+        '''
+        # every interval of the run is reported, also the ones without completed calls (e.g. a stall)
+        elapsed = self.end - self.start
+        intervals = [[] for index in range(int(elapsed / self.interval) + 1)]
+        for sample in self.samples:
+            index = int((sample[3] - self.start) / self.interval)
+            intervals[min(max(index, 0), len(intervals) - 1)].append(sample)
+        timeline = []
+        for (index, samples) in enumerate(intervals):
+            # the last interval is usually partial: throughput over its actual length
+            length = min(float(self.interval), elapsed - index * self.interval)
+            if length <= 0 and not samples:
+                continue
+            summary = self.summarize(samples, length)
+            summary['time'] = index * self.interval
+            timeline.append(summary)
+        methods = {}
+        for (method, weight) in self.mix:
+            methods[method] = self.summarize([sample for sample in self.samples if sample[0] == method], self.end - self.start)
+        errors = {}
+        for sample in self.samples:
+            if sample[4]:
+                errors[sample[4]] = errors.get(sample[4], 0) + 1
+        return {'total': self.summarize(self.samples, self.end - self.start), 'timeline': timeline,
+                'methods': methods, 'skipped': self.skipped, 'errors': errors}
+
+
+def print_report(report):
+    line = "%-14s %8s %10s %8s %10s %10s %10s"
+    print line%('time', 'calls', 'calls/s', 'errors', 'p50 (s)', 'p95 (s)', 'p99 (s)')
+    for summary in report['timeline']:
+        print line%(summary['time'], summary['calls'], '%.1f'%summary['throughput'], '%.1f%%'%(100 * summary['error_rate']),
+                    '%.3f'%summary['latency_p50'], '%.3f'%summary['latency_p95'], '%.3f'%summary['latency_p99'])
+    print
+    print line%('method', 'calls', 'calls/s', 'errors', 'p50 (s)', 'p95 (s)', 'p99 (s)')
+    for (name, summary) in sorted(report['methods'].items()) + [('TOTAL', report['total'])]:
+        print line%(name[:14], summary['calls'], '%.1f'%summary['throughput'], '%.1f%%'%(100 * summary['error_rate']),
+                    '%.3f'%summary['latency_p50'], '%.3f'%summary['latency_p95'], '%.3f'%summary['latency_p99'])
+    if report['skipped']:
+        print "Skipped calls (Delete without allocated slices): %s"%report['skipped']
+    for (error, count) in sorted(report['errors'].items(), key=lambda item: -item[1])[:10]:
+        print "ERROR x%d: %s"%(count, error)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--mix', default=DEFAULT_MIX, help='mix of AM calls METHOD:WEIGHT,... (default %default)')
+    parser.add_option('--threads', type='int', default=16, help='worker threads (default %default)')
+    parser.add_option('--rate', type='float', default=20, help='target rate in calls/s, 0 for as fast as possible (default %default)')
+    parser.add_option('--duration', type='float', default=60, help='duration of the load in seconds (default %default)')
+    parser.add_option('--interval', type='float', default=5, help='reporting interval in seconds (default %default)')
+    parser.add_option('--nodes', type='int', default=100, help='nodes of the synthetic testbed (default %default)')
+    parser.add_option('--slices', type='int', default=20, help='slices of the synthetic testbed (default %default)')
+    parser.add_option('--slivers', type='int', default=200, help='slivers of the synthetic testbed (default %default)')
+    parser.add_option('--latency', type='float', default=0.01, help='latency of the mock controller per request (default %default)')
+    parser.add_option('--jitter', type='float', default=0.0, help='max random latency of the mock controller per request')
+    parser.add_option('--error-rate', type='float', default=0.0, help='ratio of controller requests failing with error 500')
+    parser.add_option('--config', default=os.path.join(PACKAGE_DIR, 'sfa_config'), help='sfa_config file (default %default)')
+    parser.add_option('--cache', action='store_true', default=False, help='enable the aggregate cache')
+    parser.add_option('--driver-per-call', action='store_true', default=False, help='create a new driver for every call')
+    parser.add_option('--seed', type='int', default=0, help='seed of the random choices')
+    parser.add_option('--output', default=None, help='write the report to this JSON file')
+    options, args = parser.parse_args()
+
+    mix = parse_mix(options.mix)
+    controller = MockController(nodes=options.nodes, slices=options.slices, slivers=options.slivers,
+                                latency=options.latency, jitter=options.jitter, error_rate=options.error_rate,
+                                seed=options.seed).start()
+    exp_data_dir = tempfile.mkdtemp(prefix='clab_load')
+    try:
+        config = BenchmarkConfig(options.config, SFA_CLAB_URL=controller.base_uri + '/', SFA_CLAB_USER='vct',
+                                 SFA_CLAB_PASSWORD='vct', SFA_CLAB_GROUP='vct', SFA_CLAB_WARM_START=False,
+                                 SFA_AGGREGATE_CACHING=options.cache, SFA_CLAB_TEMP_DIR_EXP_DATA=exp_data_dir + '/')
+        generator = LoadGenerator(BenchmarkApi(config), controller, mix, options.threads, options.rate, options.duration,
+                                  options.interval, options.seed, options.driver_per_call)
+        print "Load: %s with %d threads at %s calls/s during %ss"%(options.mix, options.threads, options.rate or 'max', options.duration)
+        generator.run()
+        report = generator.report()
+        report['options'] = dict(vars(options))
+        report['controller'] = dict(controller.stats)
+        print_report(report)
+        if options.output:
+            output = open(options.output, 'w')
+            try:
+                json.dump(report, output, indent=1, sort_keys=True)
+            finally:
+                output.close()
+        return 1 if report['total']['errors'] else 0
+    finally:
+        controller.stop()
+        shutil.rmtree(exp_data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
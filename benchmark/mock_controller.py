@@ -0,0 +1,397 @@
+'''
+Created on 18/10/2014
+
+@author: gerard
+'''
+
+# Local stand-in for the CONFINE controller REST API used by the C-Lab SFAWrap.
+# It implements the endpoints used by ClabShell through the CONFINE-ORM library:
+# base resource with Link headers, login (get-auth-token), the collections of nodes, slices,
+# slivers, users, groups, islands and templates (list, filter, retrieve, create, update, delete),
+# the state links, the ctl upload (exp-data), renew and reboot operations.
+# The testbed is seeded from a synthetic generator (N nodes, M slices, K slivers) and it offers
+# configurable per-request latency and error injection (random ratio of the requests, optionally
+# restricted to the paths matching a regular expression).
+#
+# Usage:
+#     python mock_controller.py --port 8000 --nodes 50 --slices 10 --slivers 100 --latency 0.01
+#     (then configure SFA_CLAB_URL = http://localhost:8000/api/)
+# or, from a benchmark or test:
+#     controller = MockController(nodes=50, slices=10, slivers=100, latency=0.01).start()
+#     ... config.SFA_CLAB_URL = controller.base_uri + '/' ...
+#     controller.stop()
+
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+
+REL_PREFIX = 'http://confine-project.eu/rel/'
+
+COLLECTIONS = ['nodes', 'slices', 'slivers', 'users', 'groups', 'islands', 'templates']
+
+# Relation name (server/xxx-list) of each collection
+COLLECTION_RELATIONS = dict([(collection, 'server/%s-list'%collection[:-1]) for collection in COLLECTIONS])
+
+
+class MockTestbed:
+    '''
+    In-memory testbed data of the mock controller
+    '''
+
+    def __init__(self, base_uri, nodes=10, slices=5, slivers=20, seed=0):
+        self.base_uri = base_uri.rstrip('/')
+        self.lock = threading.RLock()
+        self.entities = dict([(collection, {}) for collection in COLLECTIONS])
+        self.next_id = dict([(collection, 1) for collection in COLLECTIONS])
+        self.uploads = 0
+        self.generate(nodes, slices, slivers, random.Random(seed))
+
+    def uri(self, collection, id):
+        return '%s/%s/%s'%(self.base_uri, collection, id)
+
+    def ref(self, collection, id):
+        return {'uri': self.uri(collection, id)}
+
+    def new_id(self, collection):
+        id = self.next_id[collection]
+        self.next_id[collection] += 1
+        return id
+
+    def add(self, collection, entity):
+        entity['uri'] = self.uri(collection, entity['id'])
+        self.entities[collection][unicode(entity['id'])] = entity
+        return entity
+
+    def generate(self, n_nodes, n_slices, n_slivers, rnd):
+        '''
+        Synthetic generator of the testbed: one group (with the SFAWrap user), a few islands,
+        the templates, N nodes, M slices and K slivers (at most one sliver per slice and node).
+        '''
+        group = self.add('groups', {'id': self.new_id('groups'), 'name': 'vct', 'description': '',
+                                    'user_roles': [], 'slices': [], 'nodes': []})
+        user = self.add('users', {'id': self.new_id('users'), 'name': 'vct', 'description': '', 'is_active': True,
+                                  'auth_tokens': ['ssh-rsa AAAA vct@mock'], 'group_roles': [
+                                  {'group': self.ref('groups', group['id']), 'is_admin': True,
+                                   'is_technician': True, 'is_researcher': True}]})
+        group['user_roles'].append({'user': self.ref('users', user['id']), 'is_admin': True,
+                                    'is_technician': True, 'is_researcher': True})
+        islands = [self.add('islands', {'id': self.new_id('islands'), 'name': 'island%d'%i, 'description': ''})
+                   for i in range(max(1, n_nodes/20))]
+        for name, type in [('Debian Squeeze', 'debian'), ('OpenWRT', 'openwrt')]:
+            self.add('templates', {'id': self.new_id('templates'), 'name': name, 'type': type,
+                                   'description': '%s template'%name, 'is_active': True, 'image_uri': '',
+                                   'node_archs': ['i686', 'x86_64']})
+        for i in range(n_nodes):
+            self.create('nodes', {'name': 'node%d'%i, 'description': '', 'arch': rnd.choice(['i686', 'x86_64']),
+                                  'group': self.ref('groups', group['id']),
+                                  'island': self.ref('islands', rnd.choice(islands)['id']),
+                                  'set_state': 'production', 'properties': {}})
+        for i in range(n_slices):
+            self.create('slices', {'name': 'urn:publicid:IDN+mock+slice+slice%d'%i, 'description': '',
+                                   'group': self.ref('groups', group['id']), 'set_state': 'register',
+                                   'properties': {}})
+        node_ids = sorted(self.entities['nodes'].keys(), key=int)
+        slice_ids = sorted(self.entities['slices'].keys(), key=int)
+        pairs = [(s, n) for s in slice_ids for n in node_ids]
+        rnd.shuffle(pairs)
+        for slice_id, node_id in pairs[:n_slivers]:
+            self.create('slivers', {'slice': self.ref('slices', slice_id), 'node': self.ref('nodes', node_id),
+                                    'properties': {}})
+
+    def create(self, collection, data):
+        '''
+        Create an entity of the collection filling the fields set by the controller
+        '''
+        with self.lock:
+            entity = dict(data)
+            entity.pop('uri', None)
+            if collection == 'slivers':
+                slice_id = entity['slice']['uri'].rstrip('/').split('/')[-1]
+                node_id = entity['node']['uri'].rstrip('/').split('/')[-1]
+                entity['id'] = '%s@%s'%(slice_id, node_id)
+                if unicode(entity['id']) in self.entities['slivers']:
+                    raise ValueError('sliver %s already exists'%entity['id'])
+                entity.setdefault('set_state', None)
+                entity.setdefault('template', None)
+                entity.setdefault('description', '')
+                entity.setdefault('properties', {})
+                interfaces = entity.get('interfaces') or [{'name': 'priv', 'type': 'private'},
+                                                          {'name': 'mgmt0', 'type': 'management'}]
+                entity['interfaces'] = [dict(iface, nr=nr) for nr, iface in enumerate(interfaces)]
+                entity['instance_sn'] = 0
+                self.add('slivers', entity)
+                self.entities['slices'][slice_id]['slivers'].append(self.ref('slivers', entity['id']))
+                self.entities['nodes'][node_id]['slivers'].append(self.ref('slivers', entity['id']))
+                return entity
+            entity['id'] = self.new_id(collection)
+            if collection == 'nodes':
+                entity.setdefault('set_state', 'production')
+                entity.setdefault('local_iface', 'eth0')
+                entity.setdefault('direct_ifaces', [])
+                entity['slivers'] = []
+                entity['mgmt_net'] = {'addr': 'fdf5:5351:1dfd:%x::2'%entity['id'], 'backend': 'tinc'}
+            elif collection == 'slices':
+                entity.setdefault('set_state', 'register')
+                entity['expires_on'] = time.strftime('%Y-%m-%d', time.gmtime(time.time()+30*24*3600))
+                entity['slivers'] = []
+                entity['template'] = entity.get('template') or \
+                    (entity.get('sliver_defaults') or {}).get('template') or self.ref('templates', 1)
+                entity['instance_sn'] = 0
+            self.add(collection, entity)
+            return entity
+
+    def delete(self, collection, id):
+        with self.lock:
+            entity = self.entities[collection].pop(unicode(id))
+            if collection == 'slivers':
+                for parent in ['slice', 'node']:
+                    parent_id = entity[parent]['uri'].rstrip('/').split('/')[-1]
+                    parent_entity = self.entities[parent+'s'].get(parent_id)
+                    if parent_entity:
+                        parent_entity['slivers'] = [s for s in parent_entity['slivers'] if s['uri'] != entity['uri']]
+            elif collection in ['slices', 'nodes']:
+                for sliver in list(entity['slivers']):
+                    self.delete('slivers', sliver['uri'].rstrip('/').split('/')[-1])
+
+
+class MockControllerHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler of the mock controller.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    # Helpers
+    def links(self, collection=None, id=None):
+        base = self.server.testbed.base_uri
+        links = [('%s/'%base, 'server/base')]
+        if collection is None:
+            links += [('%s/%s/'%(base, c), COLLECTION_RELATIONS[c]) for c in COLLECTIONS]
+            links.append(('%s/get-auth-token/'%base, 'controller/do-get-auth-token'))
+        else:
+            entity_uri = '%s/%s/%s'%(base, collection, id)
+            links.append(('%s/state'%entity_uri, 'controller/state'))
+            if collection == 'nodes':
+                links += [('%s/ctl/reboot'%entity_uri, 'server/do-reboot'),
+                          ('%s/firmware'%entity_uri, 'controller/firmware'),
+                          ('%s/vm'%entity_uri, 'controller/vm')]
+            if collection in ['slices', 'slivers']:
+                links += [('%s/ctl/renew'%entity_uri, 'server/do-renew'),
+                          ('%s/ctl/upload-exp-data'%entity_uri, 'controller/do-upload-exp-data')]
+        return ', '.join(['<%s>; rel="%s%s"'%(uri, REL_PREFIX, relation) for uri, relation in links])
+
+    def reply(self, code, content=None, link=None):
+        body = json.dumps(content) if content is not None else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if link:
+            self.send_header('link', link)
+        self.end_headers()
+        if self.command == 'HEAD':
+            # same headers as GET (Content-Length included) but no body
+            body = ''
+        self.wfile.write(body)
+        self.server.count(self.command, code, len(body))
+
+    def read_body(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if 'multipart/form-data' in (self.headers.getheader('content-type') or ''):
+            return {}
+        return json.loads(body) if body else {}
+
+    def route(self):
+        path = urlparse.urlparse(self.path)
+        parts = [part for part in path.path.split('/') if part]
+        query = dict(urlparse.parse_qsl(path.query))
+        # drop the 'api' prefix
+        if parts and parts[0] == 'api':
+            parts = parts[1:]
+        return parts, query
+
+    def handle_request(self, method):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency + random.random()*server.jitter)
+        if server.error_rate and random.random() < server.error_rate and \
+                (server.error_pattern is None or server.error_pattern.search(self.path)):
+            return self.reply(500, {'detail': 'Injected error'})
+        try:
+            parts, query = self.route()
+            return getattr(self, 'do_request_%d'%min(len(parts), 3))(method, parts, query)
+        except (KeyError, ValueError) as e:
+            return self.reply(404, {'detail': 'Not found (%s)'%e})
+
+    # Base resource
+    def do_request_0(self, method, parts, query):
+        return self.reply(200, {'uri': '%s/'%self.server.testbed.base_uri}, self.links())
+
+    # Collections and login
+    def do_request_1(self, method, parts, query):
+        testbed = self.server.testbed
+        if parts[0] == 'get-auth-token':
+            return self.reply(200, {'token': 'mock-token'})
+        collection = parts[0]
+        entities = testbed.entities[collection]
+        if method == 'GET':
+            with testbed.lock:
+                result = [entity for id, entity in sorted(entities.items())
+                          if all(unicode(entity.get(field)) == value for field, value in query.items())]
+            return self.reply(200, result)
+        elif method == 'POST':
+            entity = testbed.create(collection, self.read_body())
+            return self.reply(201, entity, self.links(collection, entity['id']))
+        return self.reply(405, {'detail': 'Method not allowed'})
+
+    # Entities
+    def do_request_2(self, method, parts, query):
+        testbed = self.server.testbed
+        collection, id = parts
+        entity = testbed.entities[collection][id]
+        if method in ['GET', 'HEAD']:
+            return self.reply(200, entity, self.links(collection, id))
+        elif method in ['PUT', 'PATCH']:
+            with testbed.lock:
+                entity.update(dict((key, value) for key, value in self.read_body().items()
+                                   if key not in ['uri', 'id', 'slivers']))
+            return self.reply(200, entity, self.links(collection, id))
+        elif method == 'DELETE':
+            testbed.delete(collection, id)
+            return self.reply(204)
+        return self.reply(405, {'detail': 'Method not allowed'})
+
+    # Entity links (state, renew, reboot, upload, firmware, vm)
+    def do_request_3(self, method, parts, query):
+        testbed = self.server.testbed
+        collection, id, action = parts[0], parts[1], '/'.join(parts[2:])
+        entity = testbed.entities[collection][id]
+        if action == 'state':
+            if collection == 'nodes':
+                current = entity.get('set_state') or 'production'
+            else:
+                set_state = entity.get('set_state')
+                if not set_state and collection == 'slivers':
+                    set_state = testbed.entities['slices'][entity['slice']['uri'].rstrip('/').split('/')[-1]]['set_state']
+                current = {'register': 'registered', 'deploy': 'deployed', 'start': 'started'}.get(set_state, 'registered')
+            return self.reply(200, {'current': current, 'uri': '%s/state'%entity['uri']})
+        if method == 'POST' and action == 'ctl/renew':
+            entity['expires_on'] = time.strftime('%Y-%m-%d', time.gmtime(time.time()+30*24*3600))
+            return self.reply(202, {'detail': 'Slice renewed'})
+        if method == 'POST' and action == 'ctl/reboot':
+            return self.reply(202, {'detail': 'Node instructed to reboot'})
+        if method == 'POST' and action == 'ctl/upload-exp-data':
+            testbed.uploads += 1
+            self.read_body()
+            return self.reply(200, {'exp_data_uri': '%s/exp-data.tgz'%entity['uri']})
+        if action in ['firmware', 'vm']:
+            return self.reply(202, {})
+        return self.reply(404, {'detail': 'Not found'})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_HEAD(self):
+        self.handle_request('HEAD')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+class MockController(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTP server implementing the mock CONFINE controller.
+
+    :param port: port to listen to (0 selects a free port)
+    :param nodes, slices, slivers: size of the synthetic testbed
+    :param latency: fixed latency added to every request (seconds)
+    :param jitter: maximum random latency added to every request (seconds)
+    :param error_rate: ratio of requests answered with an injected 500 error
+    :param error_pattern: regular expression of the paths where errors are injected (all by default)
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=0, nodes=10, slices=5, slivers=20, latency=0.0,
+                 jitter=0.0, error_rate=0.0, seed=0, verbose=False, error_pattern=None):
+        HTTPServer.__init__(self, (host, port), MockControllerHandler)
+        self.base_uri = 'http://%s:%d/api'%(host, self.server_address[1])
+        self.testbed = MockTestbed(self.base_uri, nodes, slices, slivers, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_pattern = re.compile(error_pattern) if error_pattern else None
+        self.verbose = verbose
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'requests': 0, 'bytes': 0, 'errors': 0, 'by_method': {}}
+
+    def count(self, method, code, size):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+            self.stats['by_method'][method] = self.stats['by_method'].get(method, 0) + 1
+            if code >= 400:
+                self.stats['errors'] += 1
+
+    def start(self):
+        '''
+        Serve the requests in a background (daemon) thread
+        '''
+        self.thread = threading.Thread(target=self.serve_forever, name='mock-controller')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=8000)
+    parser.add_option('--nodes', type='int', default=10, help='number of nodes of the synthetic testbed')
+    parser.add_option('--slices', type='int', default=5, help='number of slices of the synthetic testbed')
+    parser.add_option('--slivers', type='int', default=20, help='number of slivers of the synthetic testbed')
+    parser.add_option('--latency', type='float', default=0.0, help='latency added to every request (seconds)')
+    parser.add_option('--jitter', type='float', default=0.0, help='max random latency added to every request (seconds)')
+    parser.add_option('--error-rate', type='float', default=0.0, help='ratio of requests failing with error 500')
+    parser.add_option('--error-pattern', default=None, help='regular expression of the paths where errors are injected')
+    parser.add_option('--seed', type='int', default=0, help='seed of the synthetic generator')
+    parser.add_option('-v', '--verbose', action='store_true', default=False)
+    options, args = parser.parse_args()
+    server = MockController(options.host, options.port, options.nodes, options.slices, options.slivers,
+                            options.latency, options.jitter, options.error_rate, options.seed, options.verbose,
+                            options.error_pattern)
+    print "Mock CONFINE controller listening at %s/"%server.base_uri
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Created on 20/10/2014
+
+@author: gerard
+'''
+
+# Replay of a recorded AM call against the traffic of the C-Lab controller captured in its trace.
+# The traces are written by the wrapper in record mode (controller_traffic_mode = record), one per AM call.
+# The ClabDriver is driven directly with the AM method and the arguments of the recorded call and the
+# responses of the controller are served from the trace, with the recorded latencies (scaled with
+# --latency-scale, 0 to replay without latency). It prints the wall time of the replayed call and the
+# requests sent to the controller, so a slow call reported in production can be reproduced and
+# profiled offline, without access to the testbed.
+#
+# Usage (from the root of the package, with SFA and CONFINE-ORM installed):
+#     python benchmark/replay_am.py /var/lib/sfa/clab_traffic/trace-20141020101500-42-Describe.json.gz
+#     python benchmark/replay_am.py trace.json.gz --latency-scale 0 --repeat 10
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from bench_am import BenchmarkConfig, BenchmarkApi, PACKAGE_DIR
+
+# AM method --> ClabDriver method
+DRIVER_METHODS = {
+    'GetVersion': 'aggregate_version',
+    'ListResources': 'list_resources',
+    'Describe': 'describe',
+    'Allocate': 'allocate',
+    'Renew': 'renew',
+    'Provision': 'provision',
+    'Status': 'status',
+    'PerformOperationalAction': 'perform_operational_action',
+    'Delete': 'delete',
+    'Shutdown': 'shutdown',
+}
+
+
+def replay(trace_path, options):
+    '''
+    Replay the AM call of a trace file
+
+    :returns wall time of each replay and requests sent to the controller
+    :rtype dict
+    '''
+    from sfa.clab.clab_driver import ClabDriver
+    from sfa.clab.clab_traffic import controller_traffic
+
+    trace = controller_traffic.load(trace_path)
+    exp_data_dir = tempfile.mkdtemp(prefix='clab_replay')
+    try:
+        config = BenchmarkConfig(options.config, SFA_CLAB_URL=trace['base_uri'], SFA_CLAB_WARM_START=False,
+                                 SFA_AGGREGATE_CACHING=False, SFA_CLAB_TEMP_DIR_EXP_DATA=exp_data_dir + '/',
+                                 SFA_CLAB_CONTROLLER_TRAFFIC_MODE='replay',
+                                 SFA_CLAB_CONTROLLER_TRAFFIC_FILE=trace_path,
+                                 SFA_CLAB_CONTROLLER_TRAFFIC_LATENCY_SCALE=options.latency_scale)
+        if options.group:
+            # group of the wrapper that recorded the trace (if not the one of the sfa_config file)
+            config.SFA_CLAB_GROUP = options.group
+        driver = ClabDriver(BenchmarkApi(config))
+        method = getattr(driver, DRIVER_METHODS[trace['am_method']])
+        times = []
+        error = None
+        for i in range(options.repeat):
+            # every replay is served from the beginning of the trace
+            controller_traffic.load(trace_path)
+            args = [dict(arg) if isinstance(arg, dict) else arg for arg in trace['args']]
+            start = time.time()
+            try:
+                method(*args, **dict([(str(key), value) for (key, value) in trace['kwargs'].items()]))
+            except Exception as e:
+                error = '%s: %s'%(e.__class__.__name__, e)
+            times.append(time.time() - start)
+        return {'am_method': trace['am_method'], 'recorded_duration': trace['duration'],
+                'recorded_error': trace['error'], 'requests': len(trace['requests']),
+                'times': times, 'error': error}
+    finally:
+        shutil.rmtree(exp_data_dir, ignore_errors=True)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] TRACE_FILE')
+    parser.add_option('--latency-scale', type='float', default=1.0,
+                      help='factor applied to the recorded latencies, 0 for no latency (default %default)')
+    parser.add_option('--repeat', type='int', default=1, help='number of replays of the call (default %default)')
+    parser.add_option('--group', default=None, help='C-Lab group of the recorded wrapper (default: the one of the sfa_config file)')
+    parser.add_option('--config', default=os.path.join(PACKAGE_DIR, 'sfa_config'), help='sfa_config file (default %default)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('a trace file is required')
+
+    result = replay(args[0], options)
+    times = sorted(result['times'])
+    print "%s: %d controller requests, recorded in %.3fs%s"%(result['am_method'], result['requests'], result['recorded_duration'],
+                                                             ' (%s)'%result['recorded_error'] if result['recorded_error'] else '')
+    print "Replayed %d times: min %.3fs  median %.3fs  max %.3fs"%(len(times), times[0], times[len(times)/2], times[-1])
+    if result['error']:
+        print "ERROR %s"%result['error']
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
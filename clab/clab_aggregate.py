@@ -27,7 +27,8 @@ from sfa.clab.clab_xrn import type_of_urn, urn_to_slicename, slicename_to_urn,\
     hostname_to_urn, urn_to_nodename, urn_to_slivername, slivername_to_urn, unicode_normalize
 from sfa.clab.clab_xrn import urn_to_uri, get_node_by_urn, get_slice_by_urn, get_sliver_by_urn, get_slice_by_sliver_urn
 from sfa.clab.clab_slices import ClabSlices
-from sfa.clab.clab_exceptions import ResourceNotFound
+from sfa.clab.clab_exceptions import ResourceNotFound, DeadlineExceeded
+from sfa.clab.clab_api import deadline_grace
 
 class ClabAggregate:
     """
@@ -408,25 +409,31 @@ class ClabAggregate:
         # Check that urn argument is a list (not a string)
         if isinstance(urns, str): urns = [urns]
         
-        # SLIVERS
-        if type_of_urn(urns[0])=='sliver':    
-            # Get uris of slivers from the urns list
-            uris = [urn_to_uri(self.driver, urn) for urn in urns]
-            for uri in uris:
-                ok=self.driver.testbed_shell.renew_sliver(uri)
-                if not geni_best_effort and not ok: break
-        
-        # SLICES
-        elif type_of_urn(urns[0])=='slice':
-            # Get uris of slivers from the urns list
-            uris = [urn_to_uri(self.driver, urn) for urn in urns]
-            for uri in uris:
-                ok=self.driver.testbed_shell.renew_slice(uri)
-                if not geni_best_effort and not ok: break
-       
-        # Return struct (geni_slivers field of Describe method)
-        description = self.describe(urns, 'GENI 3')
-        return description['geni_slivers']
+        # URNs processed before the deadline of the AM call
+        done_urns = []
+        try:
+            # SLIVERS
+            if type_of_urn(urns[0])=='sliver':    
+                for urn in urns:
+                    ok=self.driver.testbed_shell.renew_sliver(urn_to_uri(self.driver, urn))
+                    done_urns.append(urn)
+                    if not geni_best_effort and not ok: break
+            
+            # SLICES
+            elif type_of_urn(urns[0])=='slice':
+                for urn in urns:
+                    ok=self.driver.testbed_shell.renew_slice(urn_to_uri(self.driver, urn))
+                    done_urns.append(urn)
+                    if not geni_best_effort and not ok: break
+           
+            # Return struct (geni_slivers field of Describe method)
+            description = self.describe(urns, 'GENI 3')
+            return description['geni_slivers']
+        
+        except DeadlineExceeded as e:
+            # Best effort: return the renewed slivers and an error for the rest
+            if not geni_best_effort: raise
+            return self.get_partial_geni_slivers(urns, done_urns, e)
 
     
     def provision(self, urns, credentials={}, options={}):
@@ -485,55 +492,7 @@ class ClabAggregate:
         # Check that urn argument is a list (not a string)
         if isinstance(urns, str): urns = [urns]
         
-        # SLIVER
-        if type_of_urn(urns[0])=='sliver':    
-            # Get sliver_uris of slivers from the urns list
-            sliver_uris = [urn_to_uri(self.driver, urn) for urn in urns]
-            slivers = []
-            for sliver_uri in sliver_uris:
-                # Upload the exp-data file to push the public keys of the SFA user
-                s = self.driver.testbed_shell.upload_exp_data_to_sliver(exp_data_file, sliver_uri)
-                # Set the sliver state to Deploy 
-                sliver = self.driver.testbed_shell.update_sliver_state(sliver_uri, 'deploy')
-                slivers.append(sliver)
-                
-            # Update the slice state for the changes in the sliver to have effect
-            # Will not affect other slivers since they will have a lower set_state   
-            # Get the slice uri of the slivers
-            slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=sliver_uris[0])['slice']['uri']
-            # Get slice dict
-            slice = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)
-            # Change state of the slice if needed (lower than deploy)
-            if slice['set_state'] == 'register':
-                # Set slice state to 'deploy'
-                self.driver.testbed_shell.update_slice_state(slice_uri, 'deploy')  
-                    
-        
-        # SLICE
-        elif type_of_urn(urns[0])=='slice':
-            # Get sliver_uris of slices from the urns list
-            slice_uris = [urn_to_uri(self.driver, urn) for urn in urns]
-            for slice_uri in slice_uris:
-                # Upload the exp-data file to push the public keys of the SFA user
-                self.driver.testbed_shell.upload_exp_data_to_slice(exp_data_file, slice_uri)
-                # Set the slice state to Deploy
-                self.driver.testbed_shell.update_slice_state(slice_uri, 'deploy')
-                
-                # Update the state of all the slivers contained in the slice
-                # If the set_state of the sliver was lower, the changes in the slice would not affect its slivers 
-                slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=slice_uri)
-                slivers = [self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'deploy') for sliver in slivers]
-
-                for sliver in slivers:
-                    self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'deploy')
-
-                    
-        # Clean the directory structure and files of the exp-data file
-        self.clean_exp_data(self.EXP_DATA_DIR)
-        
-        # Prepare and return the struct (use describe function)   
-       
-         # Options field (from jFed) contains: {'geni_rspec_version': {'version': '3', 'type': 'geni'}, 'geni_compressed': True}
+        # Options field (from jFed) contains: {'geni_rspec_version': {'version': '3', 'type': 'geni'}, 'geni_compressed': True}
         rspec_version = options.get('geni_rspec_version').get('version', '3')
         rspec_type = options.get('geni_rspec_version').get('type', 'geni')
         
@@ -543,20 +502,83 @@ class ClabAggregate:
         rspec_version = version_manager._get_version(rspec_type, rspec_version, 'manifest')
         rspec = RSpec(version=rspec_version, user_options=options)   
         
-        # Prepare Return struct
-        rspec_nodes = []
-        geni_slivers = []
-        for sliver in slivers:
-            rspec_nodes.append(self.clab_sliver_to_rspec_node(sliver, 'manifest'))
-            # Force allocated state (to avoid error in automatic test Allocate)
-            #geni_sliver = self.clab_sliver_to_geni_sliver(sliver)
-            #geni_sliver['geni_allocation_status'] = 'geni_provisioned'
-            #geni_slivers.append(geni_sliver)
-            geni_slivers.append(self.clab_sliver_to_geni_sliver(sliver))
-        rspec.version.add_nodes(rspec_nodes)
+        # URNs processed before the deadline of the AM call
+        done_urns = []
+        try:
+            # SLIVER
+            if type_of_urn(urns[0])=='sliver':    
+                sliver_uris = []
+                slivers = []
+                for urn in urns:
+                    sliver_uri = urn_to_uri(self.driver, urn)
+                    # Upload the exp-data file to push the public keys of the SFA user
+                    s = self.driver.testbed_shell.upload_exp_data_to_sliver(exp_data_file, sliver_uri)
+                    # Set the sliver state to Deploy 
+                    sliver = self.driver.testbed_shell.update_sliver_state(sliver_uri, 'deploy')
+                    slivers.append(sliver)
+                    sliver_uris.append(sliver_uri)
+                    done_urns.append(urn)
+                
+                # Update the slice state for the changes in the sliver to have effect
+                # Will not affect other slivers since they will have a lower set_state   
+                # Get the slice uri of the slivers
+                slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=sliver_uris[0])['slice']['uri']
+                # Get slice dict
+                slice = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)
+                # Change state of the slice if needed (lower than deploy)
+                if slice['set_state'] == 'register':
+                    # Set slice state to 'deploy'
+                    self.driver.testbed_shell.update_slice_state(slice_uri, 'deploy')  
+                    
         
-        return {'geni_rspec': rspec.toxml(),
-                'geni_slivers': geni_slivers}
+            # SLICE
+            elif type_of_urn(urns[0])=='slice':
+                # Get the slice uri of each urn of the list
+                for slice_urn in urns:
+                    slice_uri = urn_to_uri(self.driver, slice_urn)
+                    # Upload the exp-data file to push the public keys of the SFA user
+                    self.driver.testbed_shell.upload_exp_data_to_slice(exp_data_file, slice_uri)
+                    # Set the slice state to Deploy
+                    self.driver.testbed_shell.update_slice_state(slice_uri, 'deploy')
+                
+                    # Update the state of all the slivers contained in the slice
+                    # If the set_state of the sliver was lower, the changes in the slice would not affect its slivers 
+                    slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=slice_uri)
+                    slivers = [self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'deploy') for sliver in slivers]
+
+                    for sliver in slivers:
+                        self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'deploy')
+                    done_urns.append(slice_urn)
+
+                    
+            # Prepare and return the struct (use describe function)   
+        
+            # Prepare Return struct
+            rspec_nodes = []
+            geni_slivers = []
+            for sliver in slivers:
+                rspec_nodes.append(self.clab_sliver_to_rspec_node(sliver, 'manifest'))
+                # Force allocated state (to avoid error in automatic test Allocate)
+                #geni_sliver = self.clab_sliver_to_geni_sliver(sliver)
+                #geni_sliver['geni_allocation_status'] = 'geni_provisioned'
+                #geni_slivers.append(geni_sliver)
+                geni_slivers.append(self.clab_sliver_to_geni_sliver(sliver))
+            rspec.version.add_nodes(rspec_nodes)
+        
+            return {'geni_rspec': rspec.toxml(),
+                    'geni_slivers': geni_slivers}
+        
+        except DeadlineExceeded as e:
+            # Best effort: return the provisioned slivers and an error for the rest
+            if not geni_best_effort: raise
+            # (the manifest of the provisioned slivers can not be retrieved after the deadline)
+            return {'geni_rspec': rspec.toxml(),
+                    'geni_slivers': self.get_partial_geni_slivers(urns, done_urns, e, 'geni_provisioned', 'geni_allocated')}
+        
+        finally:
+            # Clean the directory structure and files of the exp-data file
+            self.clean_exp_data(self.EXP_DATA_DIR)
+    
     
     def status (self, urns, credentials={}, options={}):
         '''
@@ -644,73 +666,87 @@ class ClabAggregate:
         if type_of_urn(urns[0])=='sliver': is_sliver_list=1 # urns is a sliver list
         else: is_sliver_list=0 # urns is a slice list
         
-        # Get uris of slivers/slices from the urns list
-        uris = [urn_to_uri(self.driver, urn) for urn in urns]
+        # URNs processed before the deadline of the AM call
+        done_urns = []
+        try:
+            # Get uris of slivers/slices from the urns list
+            uris = [urn_to_uri(self.driver, urn) for urn in urns]
         
-        if action in ['geni_start', 'start']:
-            # Start sliver or slice
-            # SLIVER
-            if is_sliver_list:    
-                for uri in uris:
-                    self.driver.testbed_shell.update_sliver_state(uri, 'start')
+            if action in ['geni_start', 'start']:
+                # Start sliver or slice
+                # SLIVER
+                if is_sliver_list:    
+                    for urn, uri in zip(urns, uris):
+                        self.driver.testbed_shell.update_sliver_state(uri, 'start')
+                        done_urns.append(urn)
                 
-                # Get slice uri of the sliver
-                slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=uris[0])['slice']['uri']
-                # Get slice dict
-                slice = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)
-                # Change state of the slice if needed (lower than deploy)
-                if slice['set_state'] in ['register','deploy']:
-                    # Set slice state to 'deploy'
-                    self.driver.testbed_shell.update_slice_state(slice_uri, 'start')  
+                    # Get slice uri of the sliver
+                    slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=uris[0])['slice']['uri']
+                    # Get slice dict
+                    slice = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)
+                    # Change state of the slice if needed (lower than deploy)
+                    if slice['set_state'] in ['register','deploy']:
+                        # Set slice state to 'deploy'
+                        self.driver.testbed_shell.update_slice_state(slice_uri, 'start')  
                     
-            # SLICE
-            else:
-                for uri in uris:
-                    self.driver.testbed_shell.update_slice_state(uri, 'start')
-                    # Update the state of all the slivers contained in the slice
-                    # If the set_state of the sliver was lower, the changes in the slice would not affect its slivers 
-                    slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=uri)
-                    for sliver in slivers:
-                        self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'start')
-        
-        elif action in ['geni_restart', 'restart']:
-            # Restart node that contains the slivers
-            # SLIVER
-            if is_sliver_list: 
-                for uri in uris:
-                    # Reboot node containing each sliver
-                    node_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=uri)['node']['uri']
-                    self.driver.testbed_shell.reboot_node(node_uri)
-            # SLICE
-            else:
-                for uri in uris:
-                    # Get nodes of the slice
-                    nodes_of_slice = self.driver.testbed_shell.get_nodes_by_slice(slice_uri=uri)
-                    # Reboot all the nodes of the slice
-                    for node in nodes_of_slice:
-                        self.driver.testbed_shell.reboot_node(node['uri'])
-        
-        elif action in ['geni_stop', 'stop']:
-            # Not supported
-            # Delete slivers/slices or set them to deploy?
-            # SLIVER
-            if is_sliver_list: 
-                for uri in uris:
-                    # Delete slivers in the list
-                    #self.driver.testbed_shell.delete_sliver(uri)
-                    # Set sliver state to deploy: 
-                    self.driver.testbed_shell.update_sliver_state(uri, 'deploy')
-            # SLICE
-            else:
-                for uri in uris:
-                    # Delete slices in the list
-                    #self.driver.testbed_shell.delete_slice(uri)
-                    # Set sliver state to deploy: 
-                    self.driver.testbed_shell.update_slice_state(uri, 'deploy')
+                # SLICE
+                else:
+                    for urn, uri in zip(urns, uris):
+                        self.driver.testbed_shell.update_slice_state(uri, 'start')
+                        # Update the state of all the slivers contained in the slice
+                        # If the set_state of the sliver was lower, the changes in the slice would not affect its slivers 
+                        slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=uri)
+                        for sliver in slivers:
+                            self.driver.testbed_shell.update_sliver_state(sliver['uri'], 'start')
+                        done_urns.append(urn)
+        
+            elif action in ['geni_restart', 'restart']:
+                # Restart node that contains the slivers
+                # SLIVER
+                if is_sliver_list: 
+                    for urn, uri in zip(urns, uris):
+                        # Reboot node containing each sliver
+                        node_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=uri)['node']['uri']
+                        self.driver.testbed_shell.reboot_node(node_uri)
+                        done_urns.append(urn)
+                # SLICE
+                else:
+                    for urn, uri in zip(urns, uris):
+                        # Get nodes of the slice
+                        nodes_of_slice = self.driver.testbed_shell.get_nodes_by_slice(slice_uri=uri)
+                        # Reboot all the nodes of the slice
+                        for node in nodes_of_slice:
+                            self.driver.testbed_shell.reboot_node(node['uri'])
+                        done_urns.append(urn)
+        
+            elif action in ['geni_stop', 'stop']:
+                # Not supported
+                # Delete slivers/slices or set them to deploy?
+                # SLIVER
+                if is_sliver_list: 
+                    for urn, uri in zip(urns, uris):
+                        # Delete slivers in the list
+                        #self.driver.testbed_shell.delete_sliver(uri)
+                        # Set sliver state to deploy: 
+                        self.driver.testbed_shell.update_sliver_state(uri, 'deploy')
+                        done_urns.append(urn)
+                # SLICE
+                else:
+                    for urn, uri in zip(urns, uris):
+                        # Delete slices in the list
+                        #self.driver.testbed_shell.delete_slice(uri)
+                        # Set sliver state to deploy: 
+                        self.driver.testbed_shell.update_slice_state(uri, 'deploy')
+                        done_urns.append(urn)
                     
-        # Return struct (geni_slivers field of Describe method)
-        description = self.describe(urns, credentials, options)
-        return description['geni_slivers']    
+            # Return struct (geni_slivers field of Describe method)
+            description = self.describe(urns, credentials, options)
+            return description['geni_slivers']    
+        
+        except DeadlineExceeded as e:
+            # Best effort: return the slivers affected by the action and an error for the rest
+            if not geni_best_effort: raise
+            return self.get_partial_geni_slivers(urns, done_urns, e)
                 
         # Prepare and return the struct (use describe function)   
         #version_manager = VersionManager()
@@ -754,35 +790,47 @@ class ClabAggregate:
         # Return list
         deleted_slivers = []
                 
-        # Discover if urns is a list of sliver urns or slice urns
-        # SLIVER
-        if type_of_urn(urns[0])=='sliver':
-            # For each urn of the list
-            for urn in urns:
-                # Obtain sliver uri and complete return struct
-                sliver_uri = urn_to_uri(self.driver, urn)
-                slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=sliver_uri)['slice']['uri']
-                expires_on = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)['expires_on']
-                deleted_sliver = dict([('geni_sliver_urn', urn), ('geni_allocation_status', 'geni_unallocated'), ('geni_expires', expires_on)])
-                deleted_slivers.append(deleted_sliver)
-                # Delete the sliver
-                self.driver.testbed_shell.delete(sliver_uri)
-        # SLICE
-        elif type_of_urn(urns[0])=='slice':
-            # For each slice urn of the list
-            for urn in urns:
-                slice_uri = urn_to_uri(self.driver, urn)
-                expires_on = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)['expires_on']
-                slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=slice_uri)
-                # For each sliver of the slice
-                for sliver in slivers:
-                    # Complete return struct
-                    sliver_urn = slivername_to_urn(self.AUTHORITY, sliver['id'])
-                    sliver_uri = urn_to_uri(self.driver, sliver_urn)
-                    deleted_sliver = dict([('geni_sliver_urn', sliver_urn), ('geni_allocation_status', 'geni_unallocated'), ('geni_expires', expires_on)])
-                    deleted_slivers.append(deleted_sliver)
+        # URNs processed before the deadline of the AM call
+        done_urns = []
+        try:
+            # Discover if urns is a list of sliver urns or slice urns
+            # SLIVER
+            if type_of_urn(urns[0])=='sliver':
+                # For each urn of the list
+                for urn in urns:
+                    # Obtain sliver uri and complete return struct
+                    sliver_uri = urn_to_uri(self.driver, urn)
+                    slice_uri = self.driver.testbed_shell.get_sliver_by(sliver_uri=sliver_uri)['slice']['uri']
+                    expires_on = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)['expires_on']
+                    deleted_sliver = dict([('geni_sliver_urn', urn), ('geni_allocation_status', 'geni_unallocated'), ('geni_expires', expires_on)])
                     # Delete the sliver
                     self.driver.testbed_shell.delete(sliver_uri)
+                    deleted_slivers.append(deleted_sliver)
+                    done_urns.append(urn)
+            # SLICE
+            elif type_of_urn(urns[0])=='slice':
+                # For each slice urn of the list
+                for urn in urns:
+                    slice_uri = urn_to_uri(self.driver, urn)
+                    expires_on = self.driver.testbed_shell.get_slice_by(slice_uri=slice_uri)['expires_on']
+                    slivers = self.driver.testbed_shell.get_slivers_by_slice(slice_uri=slice_uri)
+                    # For each sliver of the slice
+                    for sliver in slivers:
+                        # Complete return struct
+                        sliver_urn = slivername_to_urn(self.AUTHORITY, sliver['id'])
+                        sliver_uri = urn_to_uri(self.driver, sliver_urn)
+                        deleted_sliver = dict([('geni_sliver_urn', sliver_urn), ('geni_allocation_status', 'geni_unallocated'), ('geni_expires', expires_on)])
+                        # Delete the sliver
+                        self.driver.testbed_shell.delete(sliver_uri)
+                        deleted_slivers.append(deleted_sliver)
+                    done_urns.append(urn)
+        
+        except DeadlineExceeded as e:
+            # Best effort: return the deleted slivers and an error for the rest
+            if not geni_best_effort: raise
+            pending_urns = [urn for urn in urns if urn not in done_urns]
+            with deadline_grace():
+                deleted_slivers.extend(self.deadline_error_slivers(pending_urns, e))
         
         return deleted_slivers
           
@@ -983,6 +1031,102 @@ mkdir -p /root/.ssh  \n\
         return geni_sliver 
     
     
+    def deadline_error_slivers(self, urns, error, allocation_status=None):
+        '''
+        Method that returns the geni_slivers entries of the slivers/slices that could not 
+        be processed before the deadline of the AM call (geni_best_effort).
+        The slice URNs are expanded to the URNs of their slivers (call it in a grace period, deadline_grace).
+        
+        :param urns: list of sliver or slice URNs not processed
+        :type list
+        
+        :param error: exception raised when the deadline was exceeded
+        :type DeadlineExceeded
+        
+        :param allocation_status: (optional) GENI allocation status of the slivers, if known
+        :type string
+        
+        :returns list of GENI sliver dictionaries with the geni_error field
+        :rtype list
+        '''
+        geni_slivers = []
+        for urn in self.get_sliver_urns(urns):
+            geni_sliver = {'geni_sliver_urn':urn, 'geni_error':error.clab_message}
+            if allocation_status:
+                geni_sliver['geni_allocation_status'] = allocation_status
+            geni_slivers.append(geni_sliver)
+        return geni_slivers
+    
+    
+    def get_partial_geni_slivers(self, urns, done_urns, error, done_status=None, pending_status=None):
+        '''
+        Method that returns the geni_slivers result of an AM call whose deadline was exceeded 
+        (geni_best_effort): the description of the slivers/slices processed and 
+        an entry with geni_error for the rest.
+        The controller requests needed are sent in a grace period after the deadline (deadline_grace).
+        If the grace period is also exceeded, only the URN of the processed slivers 
+        (and allocation status, if known) is returned.
+        
+        :param urns: list of sliver or slice URNs of the AM call
+        :type list
+        
+        :param done_urns: list of sliver or slice URNs processed before the deadline
+        :type list
+        
+        :param error: exception raised when the deadline was exceeded
+        :type DeadlineExceeded
+        
+        :param done_status: (optional) GENI allocation status of the processed slivers
+        :type string
+        
+        :param pending_status: (optional) GENI allocation status of the slivers not processed
+        :type string
+        
+        :returns list of GENI sliver dictionaries
+        :rtype list
+        '''
+        geni_slivers = []
+        with deadline_grace():
+            if done_urns:
+                try:
+                    geni_slivers = self.describe(done_urns)['geni_slivers']
+                except DeadlineExceeded:
+                    for urn in self.get_sliver_urns(done_urns):
+                        geni_sliver = {'geni_sliver_urn':urn}
+                        if done_status:
+                            geni_sliver['geni_allocation_status'] = done_status
+                        geni_slivers.append(geni_sliver)
+            pending_urns = [urn for urn in urns if urn not in done_urns]
+            return geni_slivers + self.deadline_error_slivers(pending_urns, error, pending_status)
+    
+    
+    def get_sliver_urns(self, urns):
+        '''
+        Method that expands the slice URNs of a list to the URNs of their slivers 
+        (the sliver URNs are kept). Used to build the best effort results after the deadline
+        of the AM call (in a grace period): if the slivers of a slice can not be obtained, its URN is kept.
+        
+        :param urns: list of sliver or slice URNs
+        :type list
+        
+        :returns list of sliver URNs
+        :rtype list
+        '''
+        sliver_urns = []
+        for urn in urns:
+            if type_of_urn(urn) != 'slice':
+                sliver_urns.append(urn)
+                continue
+            try:
+                slice = self.driver.testbed_shell.get_slice_by(slice_uri=urn_to_uri(self.driver, urn))
+                # Sliver id (slice_id@node_id) from the sliver uri of the slice (no request per sliver)
+                sliver_urns.extend([slivername_to_urn(self.AUTHORITY, sliver['uri'].rstrip('/').split('/')[-1]) 
+                                    for sliver in slice['slivers']])
+            except (DeadlineExceeded, ResourceNotFound):
+                sliver_urns.append(urn)
+        return sliver_urns
+    
+    
     def get_datetime_from_clab_expires(self, sliver_expires_on):
         '''
         Function to get a datetime object from the string parameter sliver_expires_on.
@@ -0,0 +1,428 @@
+'''
+Created on 16/10/2014
+
+@author: gerard
+'''
+
+# Module that defines the access of the SFAWrap to the C-Lab controller.
+# ClabApi is the CONFINE-ORM Api used by the ClabShell. Every HTTP request sent to the
+# controller (by the shell or by the ORM resources it retrieves) goes through ClabApi.request,
+# where the process-wide ControllerLimiter is applied.
+# The AM call being processed by each thread (set by the ClabDriver for every AM method)
+# is kept in a thread-local context, so the controller requests can be related to it.
+# The context holds the deadline of the AM call: once exceeded, the pending requests to the
+# controller are not sent (DeadlineExceeded), so the wrapper stops working for a client that has gone.
+# Every request is measured in a ControllerCallSpan (clab_metrics), added to the timeline of the AM call.
+
+from __future__ import with_statement
+import time
+import threading
+import itertools
+from functools import wraps
+from contextlib import contextmanager
+
+import gevent
+import requests
+from orm.api import Api
+
+from sfa.util.sfalogging import logger
+
+from sfa.clab.clab_exceptions import DeadlineExceeded
+from sfa.clab.clab_metrics import metrics, call_budget, ControllerCallSpan, current_shell_method
+from sfa.clab.clab_traffic import controller_traffic
+from sfa.clab.clab_profiler import am_profiler
+
+
+###################
+# AM CALL CONTEXT #
+###################
+
+class AMCallContext:
+    '''
+    Context of the AM call (ListResources, Describe, Allocate...) being processed by a thread
+    '''
+    ids = itertools.count(1)
+
+    def __init__(self, method, timeout=None):
+        self.id = next(AMCallContext.ids)
+        self.method = method
+        self.start = time.time()
+        # absolute deadline of the call (None = no deadline)
+        self.deadline = self.start + timeout if timeout else None
+        # timeline of the controller requests sent by the call
+        self.spans = []
+        # requests and responses recorded for the call (controller traffic record mode)
+        self.traffic = []
+
+    @property
+    def controller_calls(self):
+        return len(self.spans)
+
+    def remaining(self):
+        '''
+        Get the time left until the deadline of the call
+
+        :returns seconds until the deadline (negative if exceeded) or None if the call has no deadline
+        :rtype float
+        '''
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def check_deadline(self):
+        '''
+        Raise DeadlineExceeded if the deadline of the call has been exceeded
+        '''
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise DeadlineExceeded(self.method)
+
+
+# Time given to an AM call after its deadline to build its best effort result (seconds)
+DEFAULT_DEADLINE_GRACE = 2.0
+
+# AM call being processed by the current thread
+am_call_local = threading.local()
+
+
+def current_am_call():
+    '''
+    Get the context of the AM call being processed by the current thread
+
+    :returns context of the AM call or None if the thread is not processing an AM call
+    :rtype AMCallContext
+    '''
+    return getattr(am_call_local, 'context', None)
+
+
+@contextmanager
+def deadline_grace(seconds=DEFAULT_DEADLINE_GRACE):
+    '''
+    Context manager that gives the AM call of the current thread a grace period
+    after its deadline (from now), e.g. to describe the slivers processed before
+    the deadline in a best effort result. The deadline of the call is restored at the end.
+
+    :param seconds: duration of the grace period
+    :type float
+    '''
+    context = current_am_call()
+    deadline = context.deadline if context else None
+    if deadline is not None:
+        context.deadline = time.time() + seconds
+    try:
+        yield
+    finally:
+        if deadline is not None:
+            context.deadline = deadline
+
+def am_call_timeout(config, options):
+    '''
+    Get the timeout of an AM call: the clab_timeout option of the call or,
+    if not given, the SFA_CLAB_AM_CALL_TIMEOUT configuration value
+
+    :param config: SFA configuration (None if not available)
+    :type Config
+
+    :param options: options of the AM call (None if not available)
+    :type dict
+
+    :returns timeout in seconds or None if the call has no deadline
+    :rtype float
+    '''
+    timeout = (options or {}).get('clab_timeout')
+    if timeout is None:
+        timeout = getattr(config, 'SFA_CLAB_AM_CALL_TIMEOUT', 0)
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        return None
+    return timeout if timeout > 0 else None
+
+
+def am_call(method):
+    '''
+    Decorator of the ClabDriver AM methods. It sets the context of the AM call
+    for the current thread while the method is executed, with the deadline of the call
+    (from the options of the call or the driver configuration).
+    A nested AM call keeps the deadline of the outer one if it is earlier.
+    In record mode of the controller traffic, the trace of the (outer) call is written when it finishes.
+    The (outer) call is profiled if its method is profiled or it exceeds the slow call threshold (clab_profiler).
+
+    :param method: name of the AM method (e.g. 'ListResources')
+    :type string
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            previous = current_am_call()
+            config = getattr(args[0], 'config', None) if args else None
+            options = kwargs.get('options')
+            if options is None and args and isinstance(args[-1], dict):
+                options = args[-1]
+            context = AMCallContext(method, am_call_timeout(config, options))
+            if previous and previous.deadline is not None:
+                context.deadline = min(context.deadline or previous.deadline, previous.deadline)
+            if previous:
+                # the requests of a nested call belong to the trace of the outer one
+                context.traffic = previous.traffic
+            am_call_local.context = context
+            recording = controller_traffic.mode == 'record' and not previous
+            if recording:
+                # arguments of the call before the driver modifies the options
+                recorded = ([dict(arg) if isinstance(arg, dict) else arg for arg in args[1:]], dict(kwargs))
+            # opt-in profile of the call (profiled methods and slow calls)
+            profile = am_profiler.start(context, args[1:], kwargs) if am_profiler.enabled and not previous else None
+            error = None
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                error = e.__class__.__name__
+                raise
+            finally:
+                am_call_local.context = previous
+                if profile:
+                    am_profiler.finish(profile, error)
+                metrics.record_am_call(method, time.time() - context.start, context.controller_calls)
+                metrics.maybe_dump()
+                if recording:
+                    save_traffic(context, recorded[0], recorded[1], error)
+            # debug/test mode: N+1 patterns and budget of controller requests
+            call_budget.check(method, context.spans)
+            return result
+        return wrapper
+    return decorator
+
+
+def save_traffic(context, args, kwargs, error=None):
+    '''
+    Write the controller traffic recorded for an AM call to its trace file.
+    A failure writing the trace is logged but does not affect the AM call.
+    '''
+    try:
+        controller_traffic.save(context, args, kwargs, error)
+    except Exception as e:
+        logger.warning('Could not save the controller traffic of %s: %s'%(context.method, e))
+
+
+###########
+# LIMITER #
+###########
+
+# Default maximum number of concurrent requests to the controller
+DEFAULT_MAX_INFLIGHT = 8
+
+# Operation classes of the controller requests
+OPERATION_CLASSES = ('read', 'write', 'reboot')
+
+
+def operation_class(method_name, url):
+    '''
+    Get the operation class of a controller request
+
+    :param method_name: HTTP method (get, head, post, put, patch, delete)
+    :type string
+
+    :param url: url of the request
+    :type string
+
+    :returns operation class ('read', 'write' or 'reboot')
+    :rtype string
+    '''
+    if method_name in ['get', 'head']:
+        return 'read'
+    if 'reboot' in (url or ''):
+        return 'reboot'
+    return 'write'
+
+
+class ControllerLimiter:
+    '''
+    Admission control of the requests sent to the controller.
+    It limits the number of concurrent requests (globally and, optionally, per operation
+    class: reads, writes and node reboots). Waiting requests are served fairly between
+    AM calls: the next request admitted is the oldest one of the AM call with the fewest
+    requests in progress, so a big AM call (e.g. Allocate of many slivers) does not starve
+    the rest. The time spent waiting in the queue is recorded.
+    '''
+
+    def __init__(self, max_inflight=DEFAULT_MAX_INFLIGHT, budgets=None):
+        self.condition = threading.Condition(threading.Lock())
+        self.max_inflight = max_inflight
+        # operation class -> maximum concurrent requests (0/None = only the global limit)
+        self.budgets = dict(budgets or {})
+        self.inflight = 0
+        self.inflight_by_class = dict([(op_class, 0) for op_class in OPERATION_CLASSES])
+        self.inflight_by_call = {}
+        self.waiting = []
+        self.tickets = itertools.count()
+        # queue wait metrics
+        self.admitted = 0
+        self.queued = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.expired = 0
+
+    def configure(self, max_inflight=None, budgets=None):
+        with self.condition:
+            if max_inflight is not None:
+                self.max_inflight = max_inflight
+            if budgets is not None:
+                self.budgets = dict(budgets)
+            self.condition.notify_all()
+
+    def has_room(self, op_class):
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            return False
+        budget = self.budgets.get(op_class)
+        if budget and self.inflight_by_class[op_class] >= budget:
+            return False
+        return True
+
+    def is_next(self, ticket):
+        # among the waiting requests that could be admitted, the oldest one of the AM call
+        # with fewest requests in progress
+        candidates = [(self.inflight_by_call.get(call_id, 0), number, call_id, op_class)
+                      for (number, call_id, op_class) in self.waiting if self.has_room(op_class)]
+        return candidates and min(candidates)[1] == ticket[0]
+
+    def acquire(self, op_class, call_id=None, sleep=None, deadline=None):
+        '''
+        Wait until the request can be sent to the controller
+
+        :param op_class: operation class of the request ('read', 'write', 'reboot')
+        :type string
+
+        :param call_id: id of the AM call that sends the request (None if not in an AM call)
+        :type int
+
+        :param sleep: (optional) cooperative sleep function used to wait instead of blocking
+            the thread (requests sent from greenlets spawned by the ORM, e.g. async retrieves)
+        :type function
+
+        :param deadline: (optional) deadline of the AM call (absolute time). If it is exceeded
+            while waiting, the request leaves the queue and DeadlineExceeded is raised
+        :type float
+
+        :returns time waited in the queue (in seconds)
+        :rtype float
+        '''
+        start = time.time()
+        with self.condition:
+            ticket = (next(self.tickets), call_id, op_class)
+            if not (self.has_room(op_class) and not self.waiting):
+                self.queued += 1
+                self.waiting.append(ticket)
+                while not self.is_next(ticket):
+                    if deadline is not None and time.time() >= deadline:
+                        self.waiting.remove(ticket)
+                        self.expired += 1
+                        self.condition.notify_all()
+                        raise DeadlineExceeded(op_class)
+                    if sleep:
+                        self.condition.release()
+                        try:
+                            sleep(0.005)
+                        finally:
+                            self.condition.acquire()
+                    elif deadline is not None:
+                        self.condition.wait(max(deadline - time.time(), 0.001))
+                    else:
+                        self.condition.wait()
+                self.waiting.remove(ticket)
+            self.inflight += 1
+            self.inflight_by_class[op_class] += 1
+            self.inflight_by_call[call_id] = self.inflight_by_call.get(call_id, 0) + 1
+            waited = time.time() - start
+            self.admitted += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            # other waiting requests may be admissible too (different class budget)
+            if self.waiting:
+                self.condition.notify_all()
+        return waited
+
+    def release(self, op_class, call_id=None):
+        with self.condition:
+            self.inflight -= 1
+            self.inflight_by_class[op_class] -= 1
+            self.inflight_by_call[call_id] -= 1
+            if not self.inflight_by_call[call_id]:
+                del self.inflight_by_call[call_id]
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {'max_inflight': self.max_inflight, 'budgets': dict(self.budgets),
+                    'inflight': self.inflight, 'inflight_by_class': dict(self.inflight_by_class),
+                    'waiting': len(self.waiting), 'admitted': self.admitted, 'queued': self.queued,
+                    'expired': self.expired,
+                    'wait_time_total': self.wait_time_total, 'wait_time_max': self.wait_time_max,
+                    'wait_time_avg': self.wait_time_total / self.admitted if self.admitted else 0.0}
+
+
+# Process-wide limiter shared by all the ClabShell instances
+controller_limiter = ControllerLimiter()
+
+
+#######
+# API #
+#######
+
+class ClabApi(Api):
+    '''
+    CONFINE-ORM Api to the C-Lab controller used by the ClabShell.
+    Every request goes through the process-wide ControllerLimiter.
+    Requests sent during an AM call with a deadline are not sent once the deadline
+    is exceeded, and the rest of them are sent with the remaining time as timeout.
+    '''
+
+    def request(self, method, *args, **kwargs):
+        url = args[0] if args else kwargs.get('url')
+        op_class = operation_class(method.__name__.lower(), url)
+        context = current_am_call()
+        call_id = context.id if context else None
+        deadline = context.deadline if context else None
+        if deadline is not None:
+            context.check_deadline()
+        # body of the request (positional argument of the ORM post/put/patch)
+        data = args[1] if len(args) > 1 else kwargs.get('data')
+        span = ControllerCallSpan(method.__name__.lower(), url, kwargs.get('data'), current_shell_method())
+        if context:
+            context.spans.append(span)
+        # greenlets spawned by the ORM must not block the thread running the rest of them
+        sleep = gevent.sleep if gevent.getcurrent().parent is not None else None
+        try:
+            span.admitted(controller_limiter.acquire(op_class, call_id, sleep, deadline))
+        except DeadlineExceeded:
+            span.finish('DeadlineExceeded')
+            metrics.record_span(span)
+            raise
+        status = None
+        response = None
+        error = None
+        try:
+            if deadline is not None:
+                remaining = max(context.remaining(), 0.001)
+                kwargs['timeout'] = min(kwargs.get('timeout') or remaining, remaining)
+            if controller_traffic.mode == 'replay':
+                method = controller_traffic.replay_method(method)
+            response = Api.request(self, method, *args, **kwargs)
+            status = response.status_code
+            return response
+        except requests.exceptions.Timeout as e:
+            error = e.__class__.__name__
+            if deadline is not None and time.time() >= deadline:
+                status = 'DeadlineExceeded'
+                raise DeadlineExceeded(url)
+            status = error
+            raise
+        except Exception as e:
+            status = error = e.__class__.__name__
+            raise
+        finally:
+            controller_limiter.release(op_class, call_id)
+            span.finish(status)
+            metrics.record_span(span)
+            # the requests that failed (e.g. timeouts of the slow calls) are also recorded
+            if controller_traffic.mode == 'record':
+                controller_traffic.record(context, span.method_name, url, data, response=response, error=error,
+                                          elapsed=time.time() - span.start)
@@ -4,11 +4,14 @@ Created on 06/02/2014
 
 @author: gerard
 '''
+import time
+import copy
+import threading
 
 from sfa.managers.driver import Driver
 from sfa.rspecs.rspec import RSpec
 from sfa.rspecs.version_manager import VersionManager
-from sfa.util.cache import Cache
+from sfa.util.cache import Cache, SqliteCache, CacheFlight
 from sfa.util.defaultdict import defaultdict
 from sfa.util.faults import MissingSfaInfo, UnknownSfaType, \
     RecordNotFound, SfaNotImplemented, SliverDoesNotExist, Forbidden
@@ -16,13 +19,68 @@ from sfa.util.sfalogging import logger
 from sfa.util.sfatime import utcparse, datetime_to_string, datetime_to_epoch
 from sfa.util.xrn import Xrn, hrn_to_urn, get_leaf, urn_to_hrn
 from sfa.storage.model import RegRecord, SliverAllocation
-from sfa.trust.credential import Credential
+from sfa.trust.auth import credential_context
 
 from sfa.clab.clab_aggregate import ClabAggregate
 from sfa.clab.clab_registry import ClabRegistry
-from sfa.clab.clab_shell import ClabShell
-from sfa.clab.clab_xrn import slicename_to_urn, hostname_to_hrn, ClabXrn, type_of_urn, get_slice_by_sliver_urn, urn_to_slicename
+from sfa.clab.clab_shell import ClabShell, add_cache_invalidation_listener
+from sfa.clab.clab_xrn import slicename_to_urn, hostname_to_hrn, type_of_urn, get_slicename_by_sliver_urn, urn_to_slicename
 from sfa.clab.clab_logging import clab_logger
+from sfa.clab.clab_api import am_call, current_am_call, controller_limiter
+from sfa.clab.clab_exceptions import DeadlineExceeded
+
+# Options that do not change the rspec returned by the driver 
+# (compression is applied by the aggregate manager)
+IGNORED_RSPEC_OPTIONS = ('creds', 'cached', 'geni_compressed')
+
+# Advertisement variants rendered during the warm start
+WARM_START_ADVERTISEMENTS = [
+    {'geni_rspec_version': {'type': 'geni', 'version': '3'}},
+    {'geni_rspec_version': {'type': 'geni', 'version': '3'}, 'geni_available': True},
+]
+
+
+def normalize_options(options):
+    '''
+    Build a hashable and canonical representation of the options of an AM call,
+    used as part of cache keys. The rspec version type is case insensitive and 
+    the options that do not change the returned rspec are ignored.
+    
+    :param options: options of the AM call
+    :type dict
+    
+    :returns canonical representation of the options
+    :rtype tuple
+    '''
+    normalized = []
+    for key, value in sorted(options.items()):
+        if key in IGNORED_RSPEC_OPTIONS:
+            continue
+        if key == 'geni_rspec_version' and isinstance(value, dict):
+            value = (str(value.get('type', '')).lower(), str(value.get('version', '')))
+        elif key == 'geni_available':
+            value = bool(value)
+        else:
+            value = hashable_value(value)
+        normalized.append((key, value))
+    return tuple(normalized)
+
+
+def hashable_value(value):
+    '''
+    Build a hashable representation of an option value, converting the nested
+    dicts and lists (e.g. geni_users with their keys) to tuples.
+    Other unhashable values are represented by their repr.
+    '''
+    if isinstance(value, dict):
+        return tuple(sorted([(key, hashable_value(item)) for (key, item) in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([hashable_value(item) for item in value])
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
 
 
 #
@@ -35,6 +93,13 @@ class ClabDriver (Driver):
     # the cache instance is a class member so it survives across incoming requests
     cache = None
     expiration_time = None   # in seconds
+    # the warm start is done only by the first driver instance of the process
+    warm_started = False
+    # in-flight read-only AM calls (method, normalized args, normalized options) -> CacheFlight
+    # identical concurrent calls wait for and share the result of the call in progress
+    inflight_calls = {}
+    inflight_lock = threading.Lock()
+    coalescing_counters = {'executed': 0, 'coalesced': 0}
 
     def __init__ (self, api):
         Driver.__init__ (self, api)
@@ -57,6 +122,12 @@ class ClabDriver (Driver):
         print "SFA_CLAB_TEMP_DIR_EXP_DATA: %s"%(self.config.SFA_CLAB_TEMP_DIR_EXP_DATA)
         print "SFA_CLAB_AGGREGATE_CACHING: %s"%(self.config.SFA_CLAB_AGGREGATE_CACHING)
         print "SFA_CLAB_AGGREGATE_CACHE_EXPIRATION_TIME: %s"%(self.config.SFA_CLAB_AGGREGATE_CACHE_EXPIRATION_TIME)
+        print "SFA_CLAB_AGGREGATE_CACHE_MAX_ENTRIES: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_MAX_ENTRIES', 10000))
+        print "SFA_CLAB_AGGREGATE_CACHE_MAX_SIZE: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_MAX_SIZE', 64))
+        print "SFA_CLAB_AGGREGATE_CACHE_SERVE_STALE: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_SERVE_STALE', False))
+        print "SFA_CLAB_AGGREGATE_CACHE_SWEEP_INTERVAL: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_SWEEP_INTERVAL', 60))
+        print "SFA_CLAB_AGGREGATE_CACHE_BACKEND: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_BACKEND', 'memory'))
+        print "SFA_CLAB_AGGREGATE_CACHE_FILE: %s"%(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_FILE', '/var/lib/sfa/clab_cache.sqlite'))
                
         # Get it from CONFIG
         #self.AUTHORITY = ".".join([self.config.SFA_INTERFACE_HRN,self.config.SFA_GENERIC_FLAVOUR])
@@ -69,9 +140,135 @@ class ClabDriver (Driver):
         # Create the Cache instance if CACHING is enabled
         if self.config.SFA_AGGREGATE_CACHING:
             if ClabDriver.cache is None:
-                ClabDriver.cache = Cache(exp_time=self.config.SFA_CLAB_AGGREGATE_CACHE_EXPIRATION_TIME)
+                max_entries = int(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_MAX_ENTRIES', 10000))
+                max_bytes = int(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_MAX_SIZE', 64)) * 1024 * 1024
+                serve_stale = getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_SERVE_STALE', False)
+                warm_start = getattr(self.config, 'SFA_CLAB_WARM_START', False)
+                snapshot_file = getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_SNAPSHOT_FILE', '') if warm_start else None
+                if getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_BACKEND', 'memory') == 'sqlite':
+                    # cache shared by all the SFA server processes of the host
+                    ClabDriver.cache = SqliteCache(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_FILE', '/var/lib/sfa/clab_cache.sqlite'),
+                                                   exp_time=self.config.SFA_CLAB_AGGREGATE_CACHE_EXPIRATION_TIME, 
+                                                   max_entries=max_entries, max_bytes=max_bytes, serve_stale=serve_stale)
+                else:
+                    # previous contents restored from the snapshot file (if any)
+                    ClabDriver.cache = Cache(exp_time=self.config.SFA_CLAB_AGGREGATE_CACHE_EXPIRATION_TIME, 
+                                             max_entries=max_entries, max_bytes=max_bytes, serve_stale=serve_stale,
+                                             snapshot_file=snapshot_file or None)
+                # entities modified through the shell invalidate the cached results where they appear
+                add_cache_invalidation_listener(ClabDriver.cache.invalidate_tags)
+                ClabDriver.cache.start_sweeper(int(getattr(self.config, 'SFA_CLAB_AGGREGATE_CACHE_SWEEP_INTERVAL', 60)))
             self.cache = ClabDriver.cache
+            # Debug print
+            print "CACHE CLAB_DRIVER stats: %s"%(self.cache.stats())
+        
+        # Debug print
+        print "CLAB_DRIVER coalescing stats: %s"%(self.coalescing_stats())
+        print "CLAB_DRIVER controller limiter stats: %s"%(controller_limiter.stats())
+        
+        # Warm start: prefetch the testbed data and prebuild the advertisements in background
+        if getattr(self.config, 'SFA_CLAB_WARM_START', False) and not ClabDriver.warm_started:
+            ClabDriver.warm_started = True
+            warm_up_thread = threading.Thread(target=self.warm_up, name='clab-warm-up')
+            warm_up_thread.daemon = True
+            warm_up_thread.start()
+    
+    
+    def coalesce(self, method, args, options, call):
+        '''
+        Execute a read-only AM call, or wait for the identical call in progress (same method,
+        arguments and options, including the rspec version) and share its result.
+        Errors of the call in progress are raised to all the callers, except DeadlineExceeded:
+        a caller with time left executes the call itself (or joins a new call in progress).
+        A caller waits for the call in progress until its own deadline, at most.
+        
+        :param method: name of the AM method
+        :type string
+        
+        :param args: hashable representation of the arguments of the call (e.g. sorted urns)
+        :type tuple
+        
+        :param options: options of the call
+        :type dict
+        
+        :param call: function without arguments that executes the call
+        :type function
         
+        :returns result of the call
+        '''
+        key = (method, args, normalize_options(options))
+        try:
+            hash(key)
+        except TypeError:
+            # arguments that can not be part of the key: the call is not coalesced
+            return call()
+        while True:
+            with ClabDriver.inflight_lock:
+                flight = ClabDriver.inflight_calls.get(key)
+                leader = flight is None
+                if leader:
+                    flight = ClabDriver.inflight_calls[key] = CacheFlight()
+                    ClabDriver.coalescing_counters['executed'] += 1
+                else:
+                    ClabDriver.coalescing_counters['coalesced'] += 1
+            if leader:
+                break
+            logger.debug("CLAB_DRIVER: %s %s coalesced with the call in progress"%(method, args))
+            context = current_am_call()
+            remaining = context.remaining() if context else None
+            if remaining is None:
+                flight.event.wait()
+            elif remaining <= 0 or not flight.event.wait(remaining):
+                raise DeadlineExceeded(method)
+            if isinstance(flight.error, DeadlineExceeded):
+                # The deadline of the call in progress is not the one of this caller:
+                # with time left, it executes the call (or waits for a new call in progress)
+                logger.debug("CLAB_DRIVER: %s %s call in progress exceeded its deadline, retrying"%(method, args))
+                continue
+            if flight.error is not None:
+                raise flight.error
+            # each caller gets its own copy (the aggregate manager may modify the result)
+            return copy.deepcopy(flight.result)
+        try:
+            flight.result = call()
+            return copy.deepcopy(flight.result)
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with ClabDriver.inflight_lock:
+                del ClabDriver.inflight_calls[key]
+            flight.event.set()
+    
+    
+    def coalescing_stats(self):
+        '''
+        Counters of the read-only AM calls executed and coalesced (work saved)
+        '''
+        with ClabDriver.inflight_lock:
+            stats = dict(ClabDriver.coalescing_counters)
+            stats['in_flight'] = len(ClabDriver.inflight_calls)
+        return stats
+    
+    
+    def warm_up(self):
+        '''
+        Warm start of the driver. Prefetch the node, slice and sliver collections 
+        (filling the index of the shell) and, if caching is enabled, render the default
+        advertisement variants (which computes the current state of the nodes).
+        Run in a background thread when the first driver instance is created.
+        '''
+        start = time.time()
+        try:
+            self.testbed_shell.get_nodes()
+            self.testbed_shell.get_slices()
+            self.testbed_shell.get_slivers()
+            if self.cache:
+                for options in WARM_START_ADVERTISEMENTS:
+                    self.get_advertisement(dict(options))
+            logger.info("CLAB_DRIVER: warm start done in %.2f seconds"%(time.time() - start))
+        except Exception, e:
+            logger.log_exc("CLAB_DRIVER: warm start failed: %s"%e)
 
 
     def check_sliver_credentials(self, creds, urns):
@@ -89,17 +286,9 @@ class ClabDriver (Driver):
         :return nothing
         :rtype void
         '''
-        # build list of cred object hrns, NOT NEEDED NOW
-        slice_cred_names = []
-        for cred in creds:
-            slice_cred_hrn = Credential(cred=cred).get_gid_object().get_hrn()
-            slice_cred_names.append(ClabXrn(xrn=slice_cred_hrn).get_slicename())
-
         # build list of urns of objects on which the credentials give rights
-        slice_cred_urns = []
-        for cred in creds:
-            slice_cred_urn = Credential(cred=cred).get_gid_object().get_urn()
-            slice_cred_urns.append(slice_cred_urn)
+        # (credentials are parsed once per request in the credential context)
+        slice_cred_urns = [credential_context.get(cred).target_urn for cred in creds]
         
         # Get the slice names of all the slices included in the urn
         slice_names = []
@@ -107,9 +296,10 @@ class ClabDriver (Driver):
         for urn in urns:
             if type_of_urn(urn)=='sliver':
                 # URN of a sliver. Get the slice where the sliver is contained
-                slice = get_slice_by_sliver_urn(self, urn)
-                slice_names.append(slice['name'])
-                slice_urns.append(slicename_to_urn(slice['name']))
+                # (resolved locally from the sliver name sliceid@nodeid)
+                slice_name = get_slicename_by_sliver_urn(self, urn)
+                slice_names.append(slice_name)
+                slice_urns.append(slicename_to_urn(slice_name))
             elif type_of_urn(urn)=='slice':
                 # URN of a slice
                 slice_names.append(urn_to_slicename(urn))
@@ -186,6 +376,7 @@ class ClabDriver (Driver):
         """ 
         return "C-Lab"
     
+    @am_call('GetVersion')
     def aggregate_version(self):
         """
         GENI AM API v3 GetVersion
@@ -202,6 +393,7 @@ class ClabDriver (Driver):
             }
     
     
+    @am_call('ListResources')
     def list_resources(self, version, options={}):
         '''
         GENI AM API v3 ListResources
@@ -211,26 +403,31 @@ class ClabDriver (Driver):
         clab_logger.log_am_action(creds, "ListResources", {}, options, self.config) # No parameters
         
         
-        # CACHE CLAB_DRIVERlist_resources operation is costly. Therefore, the result of list_resources is cached
-        
-        # Check the Cache for a valid (not expired) list_resources result        
-        #if self.cache:
-        #    list_resources_result = self.cache.get('list_resources')
-        #    if list_resources_result:
-        #        logger.debug("CACHE CLAB_DRIVER: list_resources result from cache")
-        #        return list_resources_result
-        
+        return self.coalesce('ListResources', (), options, lambda: self.get_advertisement(options))
+    
+    
+    def get_advertisement(self, options):
+        '''
+        Get the advertisement rspec of the given options, from the cache if enabled
+        '''
+        # CACHE CLAB_DRIVER list_resources operation is costly. Therefore, the result of list_resources is cached
+        # The result depends on the options (rspec version, geni_available...)
         aggregate = ClabAggregate(self)
-        list_resources_result = aggregate.list_resources(options=options)
-        
-        # Cache the result of list_resources operation for later requests
-        #if self.cache:
-        #    logger.debug ("CACHE CLAB_DRIVER: fresh result of list_resources stored in the cache with expiration time %s"%(self.expiration_time))
-        #    self.cache.add('list_resources', list_resources_result, ttl=self.expiration_time)
+        if not self.cache or not options.get('cached', True):
+            return aggregate.list_resources(options=options)
         
+        # Only one request rebuilds an expired result, concurrent requests wait for it (or get the stale one)
+        cache_key = 'list_resources:%s'%(normalize_options(options),)
+        def build_list_resources():
+            logger.debug("CACHE CLAB_DRIVER: fresh result of list_resources stored in the cache")
+            return aggregate.list_resources(options=options)
+        list_resources_result = self.cache.get_or_compute(cache_key, build_list_resources, namespace='advertisements', 
+                                                          tags=['advertisement'])
+        logger.debug("CACHE CLAB_DRIVER: stats %s"%(self.cache.stats()))
         return list_resources_result
     
     
+    @am_call('Describe')
     def describe(self, urns, version, options={}):
         '''
         GENI AM API v3 Describe
@@ -241,9 +438,11 @@ class ClabDriver (Driver):
         clab_logger.log_am_action(creds, "Describe", parameters, options, self.config)
         
         aggregate = ClabAggregate(self)
-        return aggregate.describe(urns, options=options)    
+        return self.coalesce('Describe', tuple(sorted(urns)), options, 
+                             lambda: aggregate.describe(urns, options=options))
     
     
+    @am_call('Allocate')
     def allocate(self, slice_urn, rspec_string, expiration, options={}):
         '''
         GENI AM API v3 Allocate
@@ -261,6 +460,7 @@ class ClabDriver (Driver):
         return aggregate.allocate(slice_urn, rspec_string, expiration, options=options)
     
     
+    @am_call('Renew')
     def renew(self, urns, expiration_time, options={}):
         '''
         GENI AM API v3 Renew
@@ -274,6 +474,7 @@ class ClabDriver (Driver):
         return aggregate.renew(urns, expiration_time, options=options)
     
     
+    @am_call('Provision')
     def provision(self, urns, options={}):
         '''
         GENI AM API v3 Provision
@@ -287,6 +488,7 @@ class ClabDriver (Driver):
         return aggregate.provision(urns, options=options)
     
     
+    @am_call('Status')
     def status (self, urns, options={}):
         '''
         GENI AM API v3 Status
@@ -297,9 +499,11 @@ class ClabDriver (Driver):
         clab_logger.log_am_action(creds, "Status", parameters, options, self.config)
         
         aggregate = ClabAggregate(self)
-        return aggregate.status(urns, options=options)
+        return self.coalesce('Status', tuple(sorted(urns)), options, 
+                             lambda: aggregate.status(urns, options=options))
 
 
+    @am_call('PerformOperationalAction')
     def perform_operational_action(self, urns, action, options={}):
         '''
         GENI AM API v3 PerformOperationalAction
@@ -313,6 +517,7 @@ class ClabDriver (Driver):
         return aggregate.perform_operational_action(urns, action, options=options)
         
      
+    @am_call('Delete')
     def delete(self, urns, options={}):
         '''
         GENI AM API v3 Delete
@@ -326,6 +531,7 @@ class ClabDriver (Driver):
         return aggregate.delete(urns, options=options)
    
    
+    @am_call('Shutdown')
     def shutdown(self, slice_urn, options={}):
         '''
         GENI AM API v3 Shutdown
@@ -348,7 +554,7 @@ class ClabDriver (Driver):
         user_urns = []
         if creds: 
             for credential in creds:
-                user_urn = credential['geni_value'].split('<owner_urn>')[1].split('</owner_urn>')[0]
+                user_urn = credential_context.get(credential).owner_urn
                 user_urns.append(user_urn)
         return user_urns
     
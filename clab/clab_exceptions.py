@@ -81,6 +81,49 @@ class OperationFailed (Exception):
         return repr(self.clab_message)
 
 
+class DeadlineExceeded (Exception):
+    '''
+    Exception indicating that the deadline of the AM call was exceeded before the operation
+    could be completed. The pending requests to the controller are not sent.
+    Encapsulates requests.exceptions.Timeout from ORM
+    '''
+    def __init__(self, op, message=None):
+        Exception.__init__(self, message)
+        self.op = op
+        self.clab_message = 'The deadline of the AM call was exceeded: (%s)'%(op)
+    def __str__(self):
+        return repr(self.clab_message)
+
+
+class CallBudgetExceeded (Exception):
+    '''
+    Exception indicating that an AM call sent more requests to the controller than its budget.
+    Only raised in the strict mode of the call budget check (debug/test)
+    '''
+    def __init__(self, method, calls, budget, message=None):
+        Exception.__init__(self, message)
+        self.method = method
+        self.calls = calls
+        self.budget = budget
+        self.clab_message = 'The AM call sent %s requests to the controller, over its budget of %s: (%s) # DETAILS: %s'%(calls, budget, method, message)
+    def __str__(self):
+        return repr(self.clab_message)
+
+
+class ReplayMismatch (Exception):
+    '''
+    Exception indicating that a request sent to the controller in replay mode
+    was not found in the replayed trace
+    '''
+    def __init__(self, method, url, message=None):
+        Exception.__init__(self, message)
+        self.method = method
+        self.url = url
+        self.clab_message = 'Request not found in the replayed trace: (%s %s)'%(method.upper(), url)
+    def __str__(self):
+        return repr(self.clab_message)
+
+
 class UnexistingResource (Exception):
     '''
     Exception indicating that the resource requested does not exist
@@ -0,0 +1,207 @@
+'''
+Created on 15/10/2014
+
+@author: gerard
+'''
+
+# Module that defines the index used by the ClabShell to resolve C-Lab entities to their uri.
+# The index maps (collection, name) and (collection, id) to the uri of the entity, and the uri
+# back to its (collection, name, id). It is a process-wide structure, so it survives across
+# the incoming requests (a new ClabShell is created for every request).
+# The index is maintained by the ClabShell from the get/create/delete operations and it is
+# refreshed every time a full collection is retrieved from the controller in this process.
+# The index is kept in memory only (it is not shared with other processes, e.g. the ClabImporter).
+# Entities may be deleted, renamed or recreated in the controller by others (web portal, other
+# processes), so the entries expire after a time to live and are then resolved again.
+
+from __future__ import with_statement
+import time
+import threading
+
+from sfa.clab.clab_records import collection_of_uri
+
+
+# Time to live of the entries of the index (seconds, 0 = no expiration)
+DEFAULT_INDEX_TTL = 300
+
+
+def index_key(collection, value):
+    '''
+    Build the key of a name/id entry. Ids may come as int (controller JSON)
+    or as string (SFA pointers, sliver names), so non-string values are converted.
+    '''
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return (collection, value)
+
+
+class ClabIndex:
+    '''
+    Bidirectional index (collection, name) <--> uri and (collection, id) <--> uri
+    of the C-Lab entities. Collections are the names of the controller collections
+    ('nodes', 'slices', 'slivers', 'users', 'groups', 'islands', 'templates').
+    Slivers are indexed by their id (slice_id@node_id), which is also their name.
+    '''
+
+    def __init__(self, ttl=DEFAULT_INDEX_TTL):
+        self.lock = threading.RLock()
+        self.ttl = ttl
+        self.by_name = {}
+        self.by_id = {}
+        self.by_uri = {}
+        # uri -> time the entry was added
+        self.added = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def configure(self, ttl=None):
+        '''
+        Configure the index
+
+        :param ttl: time to live of the entries (seconds, 0 = no expiration)
+        :type int
+        '''
+        with self.lock:
+            if ttl is not None:
+                self.ttl = ttl
+
+    def add(self, record, collection=None):
+        '''
+        Add (or update) the entry of the given entity record
+
+        :param record: C-Lab record (or dict) of the entity
+        :type ClabRecord
+
+        :param collection: (optional) collection of the entity. Obtained from the uri if not specified
+        :type string
+        '''
+        uri = record.get('uri')
+        if not uri:
+            return
+        collection = collection or collection_of_uri(uri)
+        if not collection:
+            return
+        id = record.get('id')
+        name = record.get('name', id) if collection != 'slivers' else id
+        with self.lock:
+            self.remove(uri)
+            if name is not None:
+                self.by_name[index_key(collection, name)] = uri
+            if id is not None:
+                self.by_id[index_key(collection, id)] = uri
+            self.by_uri[uri] = (collection, name, id)
+            self.added[uri] = time.time()
+
+    def remove(self, uri):
+        '''
+        Remove the entry of the entity with the given uri
+
+        :param uri: uri of the entity
+        :type string
+        '''
+        with self.lock:
+            entry = self.by_uri.pop(uri, None)
+            self.added.pop(uri, None)
+            if not entry:
+                return
+            collection, name, id = entry
+            if name is not None and self.by_name.get(index_key(collection, name)) == uri:
+                del self.by_name[index_key(collection, name)]
+            if id is not None and self.by_id.get(index_key(collection, id)) == uri:
+                del self.by_id[index_key(collection, id)]
+
+    def remove_cascade(self, uri):
+        '''
+        Remove the entry of the entity with the given uri and, for slices and nodes,
+        the entries of the slivers they contain (deleted together in the controller).
+        Sliver ids have the format slice_id@node_id.
+
+        :param uri: uri of the entity
+        :type string
+        '''
+        with self.lock:
+            entry = self.by_uri.get(uri)
+            self.remove(uri)
+            if not entry or entry[0] not in ['slices', 'nodes'] or entry[2] is None:
+                return
+            collection, id = entry[0], unicode(entry[2])
+            for sliver_uri, (sliver_collection, sliver_name, sliver_id) in self.by_uri.items():
+                if sliver_collection != 'slivers' or sliver_id is None:
+                    continue
+                slice_id, _, node_id = unicode(sliver_id).partition('@')
+                if (collection == 'slices' and slice_id == id) or (collection == 'nodes' and node_id == id):
+                    self.remove(sliver_uri)
+
+    def refresh(self, collection, records):
+        '''
+        Replace all the entries of a collection by the given records.
+        Used when the full collection has been retrieved from the controller.
+
+        :param collection: name of the collection
+        :type string
+
+        :param records: list of records of the full collection
+        :type list
+        '''
+        with self.lock:
+            for uri in [uri for uri, entry in self.by_uri.items() if entry[0] == collection]:
+                self.remove(uri)
+            for record in records:
+                self.add(record, collection)
+
+    def lookup(self, collection, name=None, id=None):
+        '''
+        Get the uri of the entity with the given name or id
+
+        :param collection: name of the collection
+        :type string
+
+        :param name: (optional) name of the entity
+        :type string
+
+        :param id: (optional) id of the entity
+        :type string/int
+
+        :returns uri of the entity or None if not indexed (or the entry expired)
+        :rtype string
+        '''
+        with self.lock:
+            if name is not None:
+                uri = self.by_name.get(index_key(collection, name))
+            else:
+                uri = self.by_id.get(index_key(collection, id))
+            if uri and self.ttl and time.time() - self.added.get(uri, 0) > self.ttl:
+                # the entity may have changed in the controller: resolved again
+                self.remove(uri)
+                self.expired += 1
+                uri = None
+            if uri:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return uri
+
+    def lookup_uri(self, uri):
+        '''
+        Get the (collection, name, id) entry of the entity with the given uri
+
+        :returns tuple (collection, name, id) or None if not indexed
+        :rtype tuple
+        '''
+        return self.by_uri.get(uri)
+
+    def clear(self):
+        with self.lock:
+            self.by_name.clear()
+            self.by_id.clear()
+            self.by_uri.clear()
+            self.added.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.by_uri), 'hits': self.hits, 'misses': self.misses, 'expired': self.expired}
+
+
+# Process-wide index shared by all the ClabShell instances
+clab_index = ClabIndex()
@@ -6,6 +6,8 @@ Created on Mar 20, 2014
 
 import logging
 
+from sfa.trust.auth import credential_context
+
      
 class ClabSfawrapLogger:
     def __init__ (self,logfile='/var/log/clab_sfawrap.log',loggername='clab_sfawrap',level=logging.DEBUG):
@@ -43,8 +45,11 @@ class ClabSfawrapLogger:
         if options: log_msg += "\tOPTIONS: " + str(options) + "\n"
         if creds: 
             for credential in creds:
-                user_urn = credential['geni_value'].split('<owner_urn>')[1].split('</owner_urn>')[0]
-                log_msg += "\tBY USER: " + user_urn + "\n"
+                try:
+                    user_urn = credential_context.get(credential).owner_urn
+                except Exception:
+                    user_urn = 'unknown (unparseable credential)'
+                log_msg += "\tBY USER: " + str(user_urn) + "\n"
                 log_msg += "\tAS C-LAB USER: " + config.SFA_CLAB_USER + "  IN GROUP: " + config.SFA_CLAB_GROUP + "\n\n"        
         self.info(log_msg)
 
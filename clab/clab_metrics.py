@@ -0,0 +1,537 @@
+'''
+Created on 17/10/2014
+
+@author: gerard
+'''
+
+# Module that defines the instrumentation of the SFAWrap.
+# Every HTTP request sent to the controller (ClabApi.request) is measured in a timing span tagged
+# with the operation (retrieve, get_state, patch_state, destroy, upload...), the entity type
+# (nodes, slices, slivers...) and the status of the response.
+# The latency of the AM methods (ClabDriver), of the ClabShell methods and of the controller
+# operations is kept in histograms (p50/p95/p99), together with the number of controller
+# requests of each AM call. The metrics are periodically dumped to a JSON stats file.
+# In debug/test mode, the controller requests of each AM call are analyzed (CallBudget) to detect
+# N+1 patterns (repeated GETs of the same uri, one request per entity in a loop) and checked
+# against a per-AM-method budget.
+
+from __future__ import with_statement
+import os
+import json
+import time
+import threading
+import tempfile
+from collections import deque
+from functools import wraps
+
+from sfa.util.sfalogging import logger
+from sfa.clab.clab_records import RECORD_CLASSES
+from sfa.clab.clab_exceptions import CallBudgetExceeded
+
+
+# Number of recent samples kept by each histogram to compute the percentiles
+DEFAULT_HISTOGRAM_SAMPLES = 1000
+
+# Number of recent controller call spans kept (included in the stats file)
+DEFAULT_RECENT_SPANS = 100
+
+# Percentiles reported by the histograms
+PERCENTILES = (50, 95, 99)
+
+# Minimum number of requests of the same shell method, operation and entity type to different
+# uris in an AM call to be reported as a loop (N+1 pattern)
+DEFAULT_LOOP_THRESHOLD = 5
+
+# Number of recent AM call reports kept by the call budget check
+DEFAULT_RECENT_REPORTS = 100
+
+
+#########
+# SPANS #
+#########
+
+def request_operation(method_name, url, data=None):
+    '''
+    Get the operation of a controller request from its HTTP method and url
+
+    :param method_name: HTTP method (get, head, post, put, patch, delete)
+    :type string
+
+    :param url: url of the request
+    :type string
+
+    :param data: (optional) serialized body of the request
+    :type string
+
+    :returns operation (retrieve, get_state, create, update, patch_state, partial_update,
+        destroy, upload, reboot, renew, ctl, login)
+    :rtype string
+    '''
+    url = url or ''
+    if '/ctl/' in url:
+        if 'reboot' in url:
+            return 'reboot'
+        if 'upload' in url:
+            return 'upload'
+        if 'renew' in url:
+            return 'renew'
+        return 'ctl'
+    if method_name in ['get', 'head']:
+        return 'get_state' if url.rstrip('/').endswith('/state') else 'retrieve'
+    if method_name == 'delete':
+        return 'destroy'
+    if method_name == 'post':
+        return 'login' if 'auth-token' in url else 'create'
+    if method_name == 'put':
+        return 'update'
+    if 'set_state' in (data if isinstance(data, basestring) else str(data or '')):
+        return 'patch_state'
+    return 'partial_update'
+
+
+def entity_type_of_url(url):
+    '''
+    Get the entity type (controller collection) of a request url
+    e.g. 'http://172.24.42.141/api/nodes/4/ctl/reboot' --> 'nodes'
+
+    :param url: url of the request
+    :type string
+
+    :returns entity type or 'api' if the url does not belong to a known collection
+    :rtype string
+    '''
+    for part in (url or '').split('/'):
+        if part in RECORD_CLASSES:
+            return part
+    return 'api'
+
+
+class ControllerCallSpan:
+    '''
+    Timing span of a request sent to the controller
+    '''
+
+    def __init__(self, method_name, url, data=None, shell_method=None):
+        self.operation = request_operation(method_name, url, data)
+        self.entity_type = entity_type_of_url(url)
+        self.method_name = method_name
+        self.url = url
+        self.shell_method = shell_method
+        self.start = time.time()
+        self.wait = 0.0
+        self.duration = None
+        self.status = None
+
+    def admitted(self, wait):
+        '''
+        Start the span when the request is admitted by the limiter, after waiting in the queue
+        '''
+        self.wait = wait
+        self.start = time.time()
+
+    def finish(self, status):
+        '''
+        Close the span with the status of the request (HTTP status code or exception name)
+        '''
+        self.duration = time.time() - self.start
+        self.status = status
+
+    def as_dict(self):
+        return {'operation': self.operation, 'entity_type': self.entity_type, 'method': self.method_name,
+                'url': self.url, 'shell_method': self.shell_method, 'start': self.start,
+                'wait': self.wait, 'duration': self.duration, 'status': self.status}
+
+
+##############
+# HISTOGRAMS #
+##############
+
+class LatencyHistogram:
+    '''
+    Distribution of the latencies (or counts) of an operation.
+    Keeps the totals and the most recent samples to compute the percentiles.
+    '''
+
+    def __init__(self, max_samples=DEFAULT_HISTOGRAM_SAMPLES):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p, ordered=None):
+        '''
+        Get the p-th percentile (nearest rank) of the recent samples
+
+        :param p: percentile (0-100)
+        :type int
+
+        :returns value of the percentile (0 if there are no samples)
+        :rtype float
+        '''
+        ordered = ordered or sorted(self.samples)
+        if not ordered:
+            return 0.0
+        rank = int(round(p / 100.0 * len(ordered) + 0.5)) - 1
+        return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        summary = {'count': self.count, 'total': self.total, 'max': self.max,
+                   'avg': self.total / self.count if self.count else 0.0}
+        for p in PERCENTILES:
+            summary['p%s' % p] = self.percentile(p, ordered)
+        return summary
+
+
+###########
+# METRICS #
+###########
+
+class Metrics:
+    '''
+    Process-wide metrics of the SFAWrap: latency histograms of the AM methods, ClabShell methods
+    and controller operations, number of controller requests per AM call, status of the
+    controller responses and the most recent controller call spans.
+    '''
+
+    # Groups of histograms
+    AM_METHODS = 'am_methods'
+    AM_CONTROLLER_CALLS = 'am_controller_calls'
+    SHELL_METHODS = 'shell_methods'
+    CONTROLLER_OPERATIONS = 'controller_operations'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {self.AM_METHODS: {}, self.AM_CONTROLLER_CALLS: {},
+                           self.SHELL_METHODS: {}, self.CONTROLLER_OPERATIONS: {}}
+        self.status_counts = {}
+        self.recent_spans = deque(maxlen=DEFAULT_RECENT_SPANS)
+        self.started = time.time()
+        self.stats_file = None
+        self.dump_interval = 60
+        self.last_dump = 0
+        # the failures of the dump are logged once (until a dump succeeds)
+        self.dump_failed = False
+
+    def configure(self, stats_file=None, dump_interval=None):
+        '''
+        Configure the dump of the metrics
+
+        :param stats_file: path of the JSON stats file ('' or None to disable the dump)
+        :type string
+
+        :param dump_interval: minimum interval between dumps (in seconds)
+        :type int
+        '''
+        with self.lock:
+            self.stats_file = stats_file or None
+            if dump_interval is not None:
+                self.dump_interval = dump_interval
+
+    def observe(self, group, name, value):
+        '''
+        Add a sample to a histogram
+
+        :param group: group of the histogram (AM_METHODS, SHELL_METHODS...)
+        :type string
+
+        :param name: name of the histogram inside the group
+        :type string
+
+        :param value: latency (in seconds) or count
+        :type float
+        '''
+        with self.lock:
+            histogram = self.histograms[group].get(name)
+            if histogram is None:
+                histogram = self.histograms[group][name] = LatencyHistogram()
+            histogram.add(value)
+
+    def record_span(self, span):
+        '''
+        Record a finished controller call span
+        '''
+        name = '%s %s' % (span.operation, span.entity_type)
+        self.observe(self.CONTROLLER_OPERATIONS, name, span.duration)
+        with self.lock:
+            key = '%s %s' % (name, span.status)
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+            self.recent_spans.append(span)
+
+    def record_am_call(self, method, duration, controller_calls):
+        '''
+        Record a finished AM call: its latency and the number of controller requests it sent
+        '''
+        self.observe(self.AM_METHODS, method, duration)
+        self.observe(self.AM_CONTROLLER_CALLS, method, controller_calls)
+
+    def snapshot(self):
+        '''
+        Get the current metrics
+
+        :returns dictionary with the summaries of all the histograms, the status counts
+            and the recent controller call spans
+        :rtype dict
+        '''
+        with self.lock:
+            snapshot = dict([(group, dict([(name, histogram.summary()) for (name, histogram) in histograms.items()]))
+                             for (group, histograms) in self.histograms.items()])
+            snapshot['controller_status'] = dict(self.status_counts)
+            snapshot['recent_controller_calls'] = [span.as_dict() for span in self.recent_spans]
+        snapshot['since'] = self.started
+        snapshot['time'] = time.time()
+        return snapshot
+
+    def dump(self, path=None):
+        '''
+        Write the current metrics to the stats file (JSON). The file is replaced atomically.
+
+        :param path: (optional) path of the file. The configured stats file by default
+        :type string
+        '''
+        path = path or self.stats_file
+        if not path:
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.clab_metrics')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(self.snapshot(), tmp_file, indent=1, sort_keys=True)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def maybe_dump(self):
+        '''
+        Dump the metrics to the stats file if enabled and the dump interval has elapsed.
+        Errors writing the file do not break the AM calls, they are logged once
+        until a dump succeeds again.
+        '''
+        if not self.stats_file:
+            return
+        now = time.time()
+        with self.lock:
+            if now - self.last_dump < self.dump_interval:
+                return
+            self.last_dump = now
+        try:
+            self.dump()
+        except Exception as e:
+            if not self.dump_failed:
+                logger.warning("CLAB_METRICS: could not dump the metrics to %s: %s"%(self.stats_file, e))
+            self.dump_failed = True
+        else:
+            self.dump_failed = False
+
+
+# Process-wide metrics shared by all the driver and shell instances
+metrics = Metrics()
+
+
+###############
+# CALL BUDGET #
+###############
+
+def analyze_spans(spans, loop_threshold=DEFAULT_LOOP_THRESHOLD):
+    '''
+    Analyze the controller requests of an AM call to detect N+1 patterns
+
+    :param spans: timeline of controller requests of the AM call
+    :type list of ControllerCallSpan
+
+    :param loop_threshold: minimum number of requests of the same shell method, operation
+        and entity type to different uris to be reported as a loop
+    :type int
+
+    :returns report of the call: {'calls': number of requests,
+                                  'repeated': {url: number of GETs of the url (more than one)},
+                                  'loops': {'shell_method operation entity_type': number of uris}}
+    :rtype dict
+    '''
+    gets = {}
+    patterns = {}
+    for span in spans:
+        if span.method_name in ['get', 'head']:
+            gets[span.url] = gets.get(span.url, 0) + 1
+        pattern = '%s %s %s' % (span.shell_method, span.operation, span.entity_type)
+        patterns.setdefault(pattern, set()).add(span.url)
+    return {'calls': len(spans),
+            'repeated': dict([(url, count) for (url, count) in gets.items() if count > 1]),
+            'loops': dict([(pattern, len(urls)) for (pattern, urls) in patterns.items() if len(urls) >= loop_threshold])}
+
+
+def parse_budgets(budgets):
+    '''
+    Parse the per-AM-method budgets of controller requests
+    e.g. 'ListResources:10, Describe:25' --> {'ListResources': 10, 'Describe': 25}
+
+    :param budgets: budgets as a string 'Method:calls, ...' or as a dict
+    :type string
+
+    :returns budget of each AM method
+    :rtype dict
+    '''
+    if isinstance(budgets, dict):
+        return dict(budgets)
+    parsed = {}
+    for item in (budgets or '').split(','):
+        if ':' in item:
+            method, budget = item.split(':', 1)
+            parsed[method.strip()] = int(budget)
+    return parsed
+
+
+class CallBudget:
+    '''
+    Debug/test check of the controller requests sent by each AM call. 
+    Modes:
+        'off': no check (default)
+        'warn': the N+1 patterns and exceeded budgets are logged
+        'strict': also CallBudgetExceeded is raised if an AM call exceeds its budget
+    The reports of the recent AM calls are kept, so tests and benchmarks can assert
+    calls <= budget for each AM method.
+    '''
+
+    MODES = ('off', 'warn', 'strict')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = 'off'
+        self.budgets = {}
+        self.loop_threshold = DEFAULT_LOOP_THRESHOLD
+        self.reports = deque(maxlen=DEFAULT_RECENT_REPORTS)
+        self.violations = 0
+
+    def configure(self, mode=None, budgets=None, loop_threshold=None):
+        '''
+        Configure the check
+
+        :param mode: 'off', 'warn' or 'strict'
+        :type string
+
+        :param budgets: maximum number of controller requests of each AM method 
+            (string 'Method:calls, ...' or dict)
+        :type string
+
+        :param loop_threshold: minimum number of requests to different uris to report a loop
+        :type int
+        '''
+        with self.lock:
+            if mode is not None:
+                self.mode = mode if mode in self.MODES else 'off'
+            if budgets is not None:
+                self.budgets = parse_budgets(budgets)
+            if loop_threshold is not None:
+                self.loop_threshold = loop_threshold
+
+    def check(self, method, spans):
+        '''
+        Check the controller requests of a finished AM call
+
+        :param method: name of the AM method
+        :type string
+
+        :param spans: timeline of controller requests of the AM call
+        :type list of ControllerCallSpan
+
+        :returns report of the call (None if the check is off)
+        :rtype dict
+        '''
+        if self.mode == 'off':
+            return None
+        report = analyze_spans(spans, self.loop_threshold)
+        report['method'] = method
+        report['budget'] = self.budgets.get(method)
+        with self.lock:
+            self.reports.append(report)
+        for (url, count) in report['repeated'].items():
+            logger.warning("CLAB_METRICS: %s retrieved %s %s times"%(method, url, count))
+        for (pattern, count) in report['loops'].items():
+            logger.warning("CLAB_METRICS: %s sent one request per entity in a loop (%s) for %s entities"%(method, pattern, count))
+        if report['budget'] is not None and report['calls'] > report['budget']:
+            with self.lock:
+                self.violations += 1
+            logger.warning("CLAB_METRICS: %s sent %s requests to the controller (budget %s)"%(method, report['calls'], report['budget']))
+            if self.mode == 'strict':
+                raise CallBudgetExceeded(method, report['calls'], report['budget'],
+                                         'repeated: %s loops: %s'%(report['repeated'], report['loops']))
+        return report
+
+    def last_report(self, method=None):
+        '''
+        Get the report of the last checked AM call (of the given AM method, if any)
+
+        :param method: (optional) name of the AM method
+        :type string
+
+        :returns report of the call or None
+        :rtype dict
+        '''
+        with self.lock:
+            for report in reversed(self.reports):
+                if method is None or report['method'] == method:
+                    return report
+        return None
+
+
+# Process-wide call budget check
+call_budget = CallBudget()
+
+
+#################
+# SHELL METHODS #
+#################
+
+# ClabShell method being executed by the current thread (outermost one)
+shell_call_local = threading.local()
+
+
+def current_shell_method():
+    '''
+    Get the name of the (outermost) ClabShell method being executed by the current thread
+
+    :returns name of the method or None
+    :rtype string
+    '''
+    return getattr(shell_call_local, 'method', None)
+
+
+def shell_method(name, function):
+    '''
+    Wrap a ClabShell method to measure its latency and to tag the controller
+    requests it sends with its name
+    '''
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        outermost = current_shell_method() is None
+        if outermost:
+            shell_call_local.method = name
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics.observe(Metrics.SHELL_METHODS, name, time.time() - start)
+            if outermost:
+                shell_call_local.method = None
+    return wrapper
+
+
+def instrument_shell_methods(cls):
+    '''
+    Instrument all the public methods of the ClabShell class
+
+    :param cls: class whose public methods are instrumented
+    :type class
+    '''
+    for name, attribute in cls.__dict__.items():
+        if not name.startswith('_') and callable(attribute):
+            setattr(cls, name, shell_method(name, attribute))
+    return cls
@@ -0,0 +1,280 @@
+'''
+Created on 20/10/2014
+
+@author: gerard
+'''
+
+# Module that defines the opt-in profiler of the AM calls (ClabDriver methods decorated with am_call).
+# Two capture modes, enabled in the configuration of the wrapper:
+#  - Profiled methods (profile_methods): every call of the given AM methods runs under cProfile.
+#    The profile is written as a .prof file (pstats) with the top functions in the JSON report.
+#  - Slow calls (profile_slow_threshold): a sampling profiler takes the stack of the threads running
+#    AM calls periodically (low overhead, only while there are AM calls in progress). The samples of a
+#    call are written (collapsed stacks, flame graph format) only if the call exceeds the threshold,
+#    otherwise they are discarded.
+# Each captured call also writes a JSON report with a summary of the arguments of the call (no credentials)
+# and the timeline of its controller requests, in a rotating directory.
+
+from __future__ import with_statement
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+
+from sfa.util.sfalogging import logger
+from sfa.clab.clab_traffic import rotate_directory
+
+
+# Interval between the stack samples of the slow call capture (seconds)
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# Maximum depth of the sampled stacks
+MAX_STACK_DEPTH = 64
+
+# Maximum number of captures (report and profile files) kept in the directory (the oldest ones are removed)
+DEFAULT_MAX_FILES = 200
+
+# Number of functions/stacks included in the JSON report
+TOP_ENTRIES = 30
+
+# Maximum length of the string arguments in the summary (e.g. rspecs)
+MAX_ARGUMENT_LENGTH = 200
+
+
+def parse_methods(methods):
+    '''
+    Parse the profiled AM methods, e.g. 'Allocate, Provision' --> set(['Allocate', 'Provision'])
+    '''
+    if isinstance(methods, (list, tuple, set)):
+        return set(methods)
+    return set([method.strip() for method in (methods or '').split(',') if method.strip()])
+
+
+def summarize_argument(value):
+    '''
+    Summary of an argument of an AM call: long strings and lists are truncated
+    and the credentials are removed
+    '''
+    if isinstance(value, basestring):
+        if len(value) > MAX_ARGUMENT_LENGTH:
+            return '%s... (%d chars)'%(value[:MAX_ARGUMENT_LENGTH], len(value))
+        return value
+    if isinstance(value, (list, tuple)):
+        summary = [summarize_argument(item) for item in value[:10]]
+        if len(value) > 10:
+            summary.append('... (%d items)'%len(value))
+        return summary
+    if isinstance(value, dict):
+        return dict([(key, summarize_argument(item)) for (key, item) in value.items()
+                     if key not in ['creds', 'credentials']])
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    return repr(value)[:MAX_ARGUMENT_LENGTH]
+
+
+class ProfiledCall:
+    '''
+    Profile being captured of an AM call
+    '''
+
+    def __init__(self, context, args, kwargs, profile=None):
+        self.context = context
+        self.args = args
+        self.kwargs = kwargs
+        self.profile = profile
+        # collapsed stack --> number of samples
+        self.samples = {}
+
+
+class AMCallProfiler:
+    '''
+    Process-wide profiler of the AM calls.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = set()
+        self.slow_threshold = 0
+        self.directory = None
+        self.max_files = DEFAULT_MAX_FILES
+        self.sample_interval = DEFAULT_SAMPLE_INTERVAL
+        # thread ident --> ProfiledCall sampled
+        self.sampled = {}
+        self.sampler = None
+        self.wakeup = threading.Event()
+        self.captured = 0
+
+    def configure(self, methods=None, slow_threshold=None, directory=None, max_files=None):
+        '''
+        Configure the profiler
+
+        :param methods: AM methods profiled in every call (comma separated list)
+        :type string
+
+        :param slow_threshold: duration of the AM calls (seconds) over which the sampled profile is written (0 = disabled)
+        :type float
+
+        :param directory: directory where the profiles are written
+        :type string
+
+        :param max_files: maximum number of captures kept in the directory (each one is a .json report
+            and its .prof or .stacks file)
+        :type int
+        '''
+        with self.lock:
+            if methods is not None:
+                self.methods = parse_methods(methods)
+            if slow_threshold is not None:
+                self.slow_threshold = float(slow_threshold or 0)
+            if directory is not None:
+                self.directory = directory
+            if max_files is not None:
+                self.max_files = max_files
+            if self.slow_threshold and self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample_loop, name='clab-am-profiler')
+                self.sampler.daemon = True
+                self.sampler.start()
+
+    @property
+    def enabled(self):
+        return bool(self.methods or self.slow_threshold)
+
+    def start(self, context, args, kwargs):
+        '''
+        Start the profile of an AM call (in the thread running it)
+
+        :param context: AM call
+        :type AMCallContext
+
+        :returns profile of the call or None if the call is not profiled
+        :rtype ProfiledCall
+        '''
+        if context.method in self.methods:
+            call = ProfiledCall(context, args, kwargs, cProfile.Profile())
+            call.profile.enable()
+            return call
+        if self.slow_threshold:
+            call = ProfiledCall(context, args, kwargs)
+            with self.lock:
+                self.sampled[threading.current_thread().ident] = call
+                self.wakeup.set()
+            return call
+        return None
+
+    def finish(self, call, error=None):
+        '''
+        Stop the profile of an AM call and write it if the method is profiled
+        or the call exceeded the threshold
+
+        :param call: profile of the call
+        :type ProfiledCall
+
+        :param error: name of the exception raised by the call (if any)
+        :type string
+        '''
+        duration = time.time() - call.context.start
+        if call.profile is not None:
+            call.profile.disable()
+            reason = 'method'
+        else:
+            with self.lock:
+                self.sampled.pop(threading.current_thread().ident, None)
+            if duration < self.slow_threshold:
+                return None
+            reason = 'slow'
+        try:
+            return self.write(call, reason, duration, error)
+        except Exception as e:
+            logger.warning('Could not write the profile of %s: %s'%(call.context.method, e))
+
+    ############
+    # SAMPLING #
+    ############
+
+    def sample_loop(self):
+        '''
+        Take the stacks of the threads running sampled AM calls periodically
+        (only while there are sampled calls in progress)
+        '''
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.sample_interval)
+            frames = sys._current_frames()
+            with self.lock:
+                if not self.sampled:
+                    self.wakeup.clear()
+                    continue
+                for (ident, call) in self.sampled.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                        code = frame.f_code
+                        stack.append('%s (%s:%d)'%(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    call.samples[key] = call.samples.get(key, 0) + 1
+            del frames
+
+    ##########
+    # OUTPUT #
+    ##########
+
+    def write(self, call, reason, duration, error=None):
+        '''
+        Write the profile of an AM call: .prof (cProfile) or .stacks (sampled, collapsed stacks)
+        and the JSON report with the arguments and the timeline of controller requests
+
+        :returns path of the JSON report
+        :rtype string
+        '''
+        context = call.context
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = 'profile-%s-%d-%s'%(time.strftime('%Y%m%d%H%M%S', time.gmtime(context.start)), context.id, context.method)
+        report = {'am_method': context.method, 'call_id': context.id, 'reason': reason, 'start': context.start,
+                  'duration': duration, 'slow_threshold': self.slow_threshold, 'error': error,
+                  'args': summarize_argument(list(call.args)), 'kwargs': summarize_argument(call.kwargs),
+                  'controller_calls': context.controller_calls,
+                  'controller_time': sum([span.duration or 0 for span in context.spans]),
+                  'controller_wait': sum([span.wait for span in context.spans]),
+                  'timeline': [dict(span.as_dict(), start=span.start - context.start) for span in context.spans]}
+        if call.profile is not None:
+            report['profile_file'] = name + '.prof'
+            call.profile.dump_stats(os.path.join(self.directory, report['profile_file']))
+            stats = pstats.Stats(call.profile).stats
+            top = sorted(stats.items(), key=lambda item: -item[1][3])[:TOP_ENTRIES]
+            report['top_functions'] = [{'function': '%s (%s:%d)'%(function, os.path.basename(filename), line),
+                                        'calls': calls, 'own_time': own_time, 'cumulative_time': cumulative_time}
+                                       for ((filename, line, function), (primitive_calls, calls, own_time, cumulative_time, callers)) in top]
+        else:
+            report['samples'] = sum(call.samples.values())
+            report['sample_interval'] = self.sample_interval
+            report['stacks_file'] = name + '.stacks'
+            stacks_file = open(os.path.join(self.directory, report['stacks_file']), 'w')
+            try:
+                for (stack, count) in sorted(call.samples.items(), key=lambda item: -item[1]):
+                    stacks_file.write('%s %d\n'%(stack, count))
+            finally:
+                stacks_file.close()
+            top = sorted(call.samples.items(), key=lambda item: -item[1])[:TOP_ENTRIES]
+            report['top_stacks'] = [{'stack': stack.split(';')[-5:], 'samples': count} for (stack, count) in top]
+        path = os.path.join(self.directory, name + '.json')
+        report_file = open(path, 'w')
+        try:
+            json.dump(report, report_file, indent=1, default=repr)
+        finally:
+            report_file.close()
+        with self.lock:
+            self.captured += 1
+        logger.info('CLAB_PROFILER: %s (%s, %.3fs) profiled in %s'%(context.method, reason, duration, path))
+        rotate_directory(self.directory, self.max_files, prefix='profile-', by_stem=True)
+        return path
+
+
+# Process-wide profiler of the AM calls
+am_profiler = AMCallProfiler()
@@ -0,0 +1,223 @@
+'''
+Created on 14/10/2014
+
+@author: gerard
+'''
+
+# Module that defines compact record types for the C-Lab entities handled by the SFAWrap.
+# The serialized ORM dicts contain every field and link exposed by the controller, while
+# the SFAWrap only uses a small subset of them. The records defined here keep only those
+# fields (plus the uri), trim nested references to {'uri':...} and provide dict-style access
+# so they can be used wherever a serialized dict was used before.
+# Equality and hashing are based on the uri of the entity.
+
+# Fields of nested references that are reduced to {'uri':...}
+REFERENCE_FIELDS = ('group', 'island', 'node', 'slice', 'template', 'user')
+
+
+def trim_reference(value):
+    '''
+    Reduce a nested reference of a serialized entity to its uri.
+    Lists of references (e.g. 'slivers' of a node) are reduced element by element.
+
+    :param value: nested reference (dict, list of dicts or None)
+    :type dict/list
+
+    :returns trimmed reference
+    :rtype dict/list
+    '''
+    if isinstance(value, dict) and 'uri' in value:
+        return {'uri': value['uri']}
+    if isinstance(value, list):
+        return [trim_reference(item) for item in value]
+    return value
+
+
+class ClabRecord(object):
+    '''
+    Base class of the compact C-Lab entity records.
+    Subclasses define the fields they keep in __slots__.
+    '''
+    __slots__ = ('uri',)
+
+    # Fields of the record containing lists of nested references
+    reference_list_fields = ()
+
+    def __init__(self, data=None, **kwargs):
+        if data is None:
+            data = {}
+        data = dict(data, **kwargs)
+        for field in self.__slots__:
+            value = data.get(field)
+            if field in REFERENCE_FIELDS or field in self.reference_list_fields:
+                value = trim_reference(value)
+            object.__setattr__(self, field, value)
+
+    @classmethod
+    def from_json(cls, data):
+        '''
+        Build a record from the JSON (serialized dict) returned by the controller.
+
+        :param data: serialized entity
+        :type dict
+
+        :returns record of the entity
+        :rtype ClabRecord
+        '''
+        return cls(data)
+
+    # Dict-style access
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.__slots__]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # Equality and hashing by uri
+    def __eq__(self, other):
+        if isinstance(other, ClabRecord):
+            return self.uri == other.uri
+        if isinstance(other, dict):
+            return self.uri == other.get('uri')
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.uri)
+
+    # Pickling support (used by the aggregate cache)
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            object.__setattr__(self, field, value)
+
+    def __repr__(self):
+        return '%s(%r)'%(self.__class__.__name__, self.to_dict())
+
+
+class NodeRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description', 'arch', 'set_state', 'group', 'island',
+                 'slivers', 'mgmt_net', 'local_iface', 'direct_ifaces', 'properties')
+    reference_list_fields = ('slivers',)
+
+
+class SliceRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description', 'set_state', 'expires_on', 'group',
+                 'template', 'slivers', 'properties')
+    reference_list_fields = ('slivers',)
+
+
+class SliverRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'description', 'set_state', 'slice', 'node', 'template',
+                 'interfaces', 'properties')
+
+
+class UserRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description', 'is_active', 'auth_tokens', 'group_roles')
+
+
+class GroupRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description', 'user_roles', 'slices', 'nodes')
+    reference_list_fields = ('slices', 'nodes')
+
+
+class IslandRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description')
+
+
+class TemplateRecord(ClabRecord):
+    __slots__ = ('uri', 'id', 'name', 'description', 'type', 'is_active')
+
+
+# Record class corresponding to each controller collection
+RECORD_CLASSES = {
+    'nodes': NodeRecord,
+    'slices': SliceRecord,
+    'slivers': SliverRecord,
+    'users': UserRecord,
+    'groups': GroupRecord,
+    'islands': IslandRecord,
+    'templates': TemplateRecord,
+}
+
+
+def collection_of_uri(uri):
+    '''
+    Get the controller collection of an entity from its uri
+    e.g. 'http://172.24.42.141/api/nodes/4' --> 'nodes'
+
+    :param uri: uri of the entity
+    :type string
+
+    :returns name of the collection or None if the uri does not belong to a known collection
+    :rtype string
+    '''
+    parts = [part for part in (uri or '').split('/') if part]
+    if len(parts) >= 2 and parts[-2] in RECORD_CLASSES:
+        return parts[-2]
+    return None
+
+
+def to_record(data, collection=None):
+    '''
+    Adapter from the JSON (serialized dict) of a C-Lab entity to its compact record.
+    The record class is selected from the collection name or, if not given, from the uri
+    of the entity. Data that does not correspond to a known entity is returned unchanged.
+
+    :param data: serialized entity
+    :type dict
+
+    :param collection: (optional) name of the controller collection ('nodes', 'slices', ...)
+    :type string
+
+    :returns compact record of the entity
+    :rtype ClabRecord
+    '''
+    if not isinstance(data, dict):
+        return data
+    record_class = RECORD_CLASSES.get(collection or collection_of_uri(data.get('uri')))
+    if not record_class:
+        return data
+    return record_class.from_json(data)
+
+
+def to_records(data_list, collection=None):
+    '''
+    Adapter from a list of serialized entities to a list of compact records.
+    '''
+    return [to_record(data, collection) for data in data_list]
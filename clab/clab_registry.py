@@ -117,19 +117,19 @@ class ClabRegistry:
             node_id = sfa_record['pointer']
             if isinstance(node_id, str): 
                 node_id=int(node_id)
-            node_uri = self.driver.testbed_shell.get_nodes({'id' : node_id})[0]['uri']
+            node_uri = self.driver.testbed_shell.get_uri_by('nodes', id=node_id)
             ret = self.driver.testbed_shell.delete(node_uri)
             
         elif sfa_record['type'] == 'slice':
             slice_id = sfa_record['pointer']
             if isinstance(slice_id, str): 
                 slice_id=int(slice_id)
-            slice_uri = self.driver.testbed_shell.get_slices({'id' : slice_id})[0]['uri']
+            slice_uri = self.driver.testbed_shell.get_uri_by('slices', id=slice_id)
             ret = self.driver.testbed_shell.delete(slice_uri)
             
         elif sfa_record['type'] == 'user':
             user_id = sfa_record['pointer']
-            user_uri = self.driver.testbed_shell.get_users({'id' : user_id})[0]['uri']
+            user_uri = self.driver.testbed_shell.get_uri_by('users', id=user_id)
             ret = self.driver.testbed_shell.delete(user_uri)
         
         return ret
@@ -167,17 +167,15 @@ class ClabRegistry:
         #    raise UnknownSfaType(type)
 
         if type == "slice":
-            filtered_slices = self.driver.testbed_shell.get_slices({'id': pointer})
-            if not filtered_slices:
+            slice_uri = self.driver.testbed_shell.get_uri_by('slices', id=pointer)
+            if not slice_uri:
                 raise RecordNotFound('Slice with id %s'%pointer) # Slice not found 
-            slice_uri = filtered_slices[0]['uri']
             return self.driver.testbed_shell.update_slice(slice_uri, clab_updated_fields)
     
         elif type == "user":
-            filtered_users = self.driver.testbed_shell.get_users({'id': pointer})
-            if not filtered_slices:
+            user_uri = self.driver.testbed_shell.get_uri_by('users', id=pointer)
+            if not user_uri:
                 raise RecordNotFound('User with id %s'%pointer) # User not found 
-            user_uri = filtered_users[0]['uri']
             return self.driver.testbed_shell.update_user(user_uri, clab_updated_fields) 
     
             #if new_key:
@@ -185,10 +183,9 @@ class ClabRegistry:
                 #self.shell.addUserKey({'user_id': pointer, 'key': new_key}) 
     
         elif type == "node":
-            filtered_nodes = self.driver.testbed_shell.get_nodes({'id': pointer})
-            if not filtered_nodes:
+            node_uri = self.driver.testbed_shell.get_uri_by('nodes', id=pointer)
+            if not node_uri:
                 raise RecordNotFound('Node with id %s'%pointer) # Node not found 
-            node_uri = filtered_nodes[0]['uri']
             return self.driver.testbed_shell.update_node(node_uri, clab_updated_fields)
 
         return False
@@ -239,7 +236,7 @@ class ClabRegistry:
                 # Get the current group roles of the user
                 if isinstance(target_id, str):
                     target_id = int(target_id)
-                user = self.driver.testbed_shell.get_users({'id':target_id})[0]
+                user = self.driver.testbed_shell.get_entity_by('users', id=target_id)
                 group_roles = user['group_roles']
                 # Change the roles according to the relation_update for the user
                 # The roles of the group that the subject slice belogs to 
@@ -7,10 +7,35 @@ Created on 06/02/2014
 import requests
 import time
 
-from orm.api import Api
 from orm.resources import Resource
 
+from sfa.util.sfalogging import logger
 from sfa.clab.clab_exceptions import MalformedURI, UnexistingURI, InvalidURI, ResourceNotFound, OperationFailed
+from sfa.clab.clab_records import to_record, to_records, collection_of_uri
+from sfa.clab.clab_index import clab_index
+from sfa.clab.clab_api import ClabApi, controller_limiter
+from sfa.clab.clab_metrics import metrics, call_budget, instrument_shell_methods
+from sfa.clab.clab_traffic import controller_traffic
+from sfa.clab.clab_profiler import am_profiler
+
+# Functions called with the list of cache tags of the entities modified through the ClabShell
+# (e.g. ['slice:<uri>', 'node:<uri>', 'advertisement']). Registered by the owners of caches.
+cache_invalidation_listeners = []
+
+# Cache tag prefix of the entities of each controller collection
+CACHE_TAG_PREFIXES = {'nodes': 'node', 'slices': 'slice', 'slivers': 'sliver', 'users': 'user'}
+
+
+def add_cache_invalidation_listener(listener):
+    '''
+    Register a function to be called with the cache tags of the modified entities
+    
+    :param listener: function receiving a list of tags (e.g. Cache.invalidate_tags)
+    :type function
+    '''
+    if listener not in cache_invalidation_listeners:
+        cache_invalidation_listeners.append(listener)
+
 
 class ClabShell:
     '''
@@ -25,7 +50,33 @@ class ClabShell:
         #self.base_uri = 'http://172.24.42.141/api'
         self.base_uri = config.SFA_CLAB_URL
         
-        controller = Api(self.base_uri) #(config.CLAP_API_URL)
+        # Limits of the concurrent requests to the controller (shared by all the shell instances)
+        controller_limiter.configure(max_inflight=int(getattr(config, 'SFA_CLAB_CONTROLLER_MAX_INFLIGHT', 8)),
+                                     budgets={'read': int(getattr(config, 'SFA_CLAB_CONTROLLER_MAX_READS', 0)),
+                                              'write': int(getattr(config, 'SFA_CLAB_CONTROLLER_MAX_WRITES', 0)),
+                                              'reboot': int(getattr(config, 'SFA_CLAB_CONTROLLER_MAX_REBOOTS', 2))})
+        
+        # Dump of the metrics of the controller requests, shell methods and AM calls
+        metrics.configure(stats_file=getattr(config, 'SFA_CLAB_METRICS_FILE', ''),
+                          dump_interval=int(getattr(config, 'SFA_CLAB_METRICS_DUMP_INTERVAL', 60)))
+        # Detection of N+1 patterns and budget of controller requests per AM call (debug/test)
+        call_budget.configure(mode=getattr(config, 'SFA_CLAB_CALL_BUDGET_CHECK', 'off'),
+                              budgets=getattr(config, 'SFA_CLAB_CALL_BUDGETS', ''))
+        # Record/replay of the controller traffic (traces of the AM calls)
+        controller_traffic.configure(mode=getattr(config, 'SFA_CLAB_CONTROLLER_TRAFFIC_MODE', 'off'),
+                                     directory=getattr(config, 'SFA_CLAB_CONTROLLER_TRAFFIC_DIR', '/var/lib/sfa/clab_traffic/'),
+                                     trace_file=getattr(config, 'SFA_CLAB_CONTROLLER_TRAFFIC_FILE', ''),
+                                     latency_scale=getattr(config, 'SFA_CLAB_CONTROLLER_TRAFFIC_LATENCY_SCALE', 1.0),
+                                     base_uri=self.base_uri)
+        # Opt-in profile of the AM calls (profiled methods and slow calls)
+        am_profiler.configure(methods=getattr(config, 'SFA_CLAB_PROFILE_METHODS', ''),
+                              slow_threshold=getattr(config, 'SFA_CLAB_PROFILE_SLOW_THRESHOLD', 0),
+                              directory=getattr(config, 'SFA_CLAB_PROFILE_DIR', '/var/lib/sfa/clab_profiles/'),
+                              max_files=int(getattr(config, 'SFA_CLAB_PROFILE_MAX_FILES', 200)))
+        # Expiration of the entries of the index of uris (entities changed in the controller by others)
+        clab_index.configure(ttl=int(getattr(config, 'SFA_CLAB_INDEX_TTL', 300)))
+        
+        controller = ClabApi(self.base_uri) #(config.CLAP_API_URL)
         try:
             controller.retrieve()
         except requests.exceptions.MissingSchema as e:
@@ -46,6 +97,59 @@ class ClabShell:
         controller.login(self.username, self.password)
         self.default_template = config.SFA_CLAB_DEFAULT_TEMPLATE
     
+    #######################
+    # CACHE INVALIDATIONS #
+    #######################
+    
+    def entity_cache_tags(self, uri, deleted=False):
+        '''
+        Get the cache tags of the entity with the given uri. A sliver also tags its
+        slice and node (sliver id = slice_id@node_id). Changes of nodes and slivers
+        (and the deletion of slices, which deletes their slivers) modify the advertisement.
+        
+        :param uri: uri of the entity
+        :type string
+        
+        :param deleted: (optional) the entity is being deleted
+        :type boolean
+        
+        :returns list of cache tags
+        :rtype list
+        '''
+        collection = collection_of_uri(uri)
+        tags = ['%s:%s'%(CACHE_TAG_PREFIXES.get(collection, collection), uri)]
+        if collection == 'slivers':
+            entry = clab_index.lookup_uri(uri)
+            sliver_id = entry[2] if entry and entry[2] is not None else uri.rstrip('/').split('/')[-1]
+            slice_id, _, node_id = unicode(sliver_id).partition('@')
+            for related_collection, related_id in [('slices', slice_id), ('nodes', node_id)]:
+                if not related_id:
+                    continue
+                related_uri = clab_index.lookup(related_collection, id=related_id) or \
+                    '%s/%s'%(getattr(controller, related_collection).endpoint.rstrip('/'), related_id)
+                tags.append('%s:%s'%(CACHE_TAG_PREFIXES[related_collection], related_uri))
+        if collection in ['nodes', 'slivers'] or (deleted and collection == 'slices'):
+            tags.append('advertisement')
+        return tags
+    
+    
+    def invalidate_cache(self, tags):
+        '''
+        Notify the registered cache invalidation listeners that the entities 
+        with the given tags have been modified
+        
+        :param tags: list of cache tags
+        :type list
+        '''
+        for listener in cache_invalidation_listeners:
+            try:
+                listener(tags)
+            except Exception as e:
+                # the modification is already done in the controller: the cached entries
+                # of these tags may be stale until they expire
+                logger.warning("CACHE: invalidation of the tags %s failed: %s"%(tags, e))
+    
+    
     ###############
     # GET METHODS #
     ###############
@@ -65,12 +169,13 @@ class ClabShell:
         :param uri: uri of the entity being retrieved
         :type string
         
-        :returns C-Lab specific dictionary of the entity
-        :rtype dict
+        :returns C-Lab specific record of the entity (supports dict-style access)
+        :rtype ClabRecord
         '''
         try:
-            resource = controller.retrieve(uri).serialize()
+            resource = to_record(controller.retrieve(uri).serialize())
         except controller.ResponseStatusError as e:
+            clab_index.remove_cascade(uri)
             raise ResourceNotFound(uri, e.message)
         except requests.exceptions.MissingSchema as e:
             raise MalformedURI(uri, e.message)
@@ -78,6 +183,7 @@ class ClabShell:
             raise UnexistingURI(uri, e.message)
         except ValueError:
             raise InvalidURI(uri)
+        clab_index.add(resource)
         return resource
     
     def get_by_uri_no_serialized(self, uri):
@@ -120,7 +226,7 @@ class ClabShell:
         #filtered_nodes = controller.nodes.retrieve()
         #for key in filters:
         #    exec("filtered_nodes = filtered_nodes.filter("+key+"='"+filters[key]+"')")
-        return controller.nodes.retrieve().filter(**filters).serialize()
+        return self.index_records('nodes', to_records(controller.nodes.retrieve().filter(**filters).serialize(), 'nodes'), full=not filters)
     
     def get_slices(self, filters={}):
         '''
@@ -140,7 +246,7 @@ class ClabShell:
         #filtered_slices = controller.slices.retrieve()
         #for key in filters:
         #    exec("filtered_slices = filtered_slices.filter("+key+"='"+filters[key]+"')")
-        return controller.slices.retrieve().filter(**filters).serialize()        
+        return self.index_records('slices', to_records(controller.slices.retrieve().filter(**filters).serialize(), 'slices'), full=not filters)        
     
     
     def get_slivers(self, filters={}):
@@ -160,6 +266,7 @@ class ClabShell:
         '''
         # Get list of dicts (slivers)
         filtered_slivers = controller.slivers.retrieve()
+        full = not filters
         
         for key in filters:
             if key == 'node_uri':
@@ -171,7 +278,7 @@ class ClabShell:
             else:
                 #exec("filtered_slivers = filtered_slivers.filter("+key+"='"+filters[key]+"')")
                 filtered_slivers = filtered_slivers.filter(**filters)
-        return filtered_slivers.serialize()
+        return self.index_records('slivers', to_records(filtered_slivers.serialize(), 'slivers'), full=full)
       
     
     
@@ -192,7 +299,170 @@ class ClabShell:
         #filtered_users = controller.users.retrieve()
         #for key in filters:
         #    exec("filtered_users = filtered_users.filter("+key+"='"+filters[key]+"')")
-        return controller.users.retrieve().filter(**filters).serialize()
+        return self.index_records('users', to_records(controller.users.retrieve().filter(**filters).serialize(), 'users'), full=not filters)
+    
+    
+    def index_record(self, record, collection=None):
+        '''
+        Add the given record to the process-wide index (name/id <--> uri)
+        
+        :returns the same record
+        :rtype ClabRecord
+        '''
+        clab_index.add(record, collection)
+        return record
+    
+    
+    def index_records(self, collection, records, full=False):
+        '''
+        Add the given records to the process-wide index (name/id <--> uri)
+        If full is True, the records are the whole collection and replace the indexed entries.
+        
+        :returns the same list of records
+        :rtype list
+        '''
+        if full:
+            clab_index.refresh(collection, records)
+        else:
+            for record in records:
+                clab_index.add(record, collection)
+        return records
+    
+    
+    def record_matches(self, record, name=None, id=None):
+        '''
+        Check if the record has the given name or id (slivers are named by their id)
+        '''
+        if name is not None:
+            return record.get('name', record.get('id')) == name
+        return unicode(record.get('id')) == unicode(id)
+    
+    
+    def lookup_entity(self, collection, name=None, id=None):
+        '''
+        Targeted lookup of an entity of the given collection by name or id in the controller.
+        Entities looked up by id (and slivers, whose name is their id) are retrieved directly
+        from their uri (collection endpoint + id). Otherwise, the collection is requested
+        filtered by the server and the result is matched exactly on the client side.
+        The full collection is never scanned.
+        
+        :param collection: name of the controller collection ('nodes', 'slices', ...)
+        :type string
+        
+        :param name: (optional) name of the entity
+        :type string
+        
+        :param id: (optional) id of the entity
+        :type string/int
+        
+        :returns record of the entity or None if not found
+        :rtype ClabRecord
+        '''
+        endpoint = getattr(controller, collection).endpoint
+        if id is not None or collection == 'slivers':
+            key = id if id is not None else name
+            try:
+                record = self.get_by_uri('%s/%s'%(endpoint.rstrip('/'), key))
+                if self.record_matches(record, name=name, id=id):
+                    return record
+            except (ResourceNotFound, InvalidURI):
+                pass
+        if name is not None and collection != 'slivers':
+            params = {'name': name}
+        else:
+            params = {'id': id if id is not None else name}
+        try:
+            response = controller.get(endpoint, params=params)
+            controller.validate_response(response, [200])
+            resources = controller.serialize_response(response.content)
+        except controller.ResponseStatusError as e:
+            raise ResourceNotFound(endpoint, e.message)
+        matches = [record for record in to_records(resources, collection) if self.record_matches(record, name=name, id=id)]
+        self.index_records(collection, matches)
+        if len(matches) != 1:
+            return None
+        return matches[0]
+    
+    
+    def get_uri_by(self, collection, name=None, id=None):
+        '''
+        Resolve the uri of the entity of the given collection with the given name or id.
+        The process-wide index is checked first (no request to the controller).
+        On a miss or if the entry expired (see SFA_CLAB_INDEX_TTL), a targeted lookup is performed.
+        
+        :param collection: name of the controller collection ('nodes', 'slices', ...)
+        :type string
+        
+        :param name: (optional) name of the entity
+        :type string
+        
+        :param id: (optional) id of the entity
+        :type string/int
+        
+        :returns uri of the entity or None if not found
+        :rtype string
+        '''
+        uri = clab_index.lookup(collection, name=name, id=id)
+        if uri:
+            return uri
+        record = self.lookup_entity(collection, name=name, id=id)
+        if record:
+            return record['uri']
+        return None
+    
+    
+    def get_entity_by(self, collection, name=None, id=None):
+        '''
+        Return the record of the entity of the given collection with the given name or id.
+        The uri is resolved from the process-wide index and the entity is retrieved directly.
+        Stale index entries (entity deleted or renamed) are dropped and a targeted lookup is done.
+        
+        :param collection: name of the controller collection ('nodes', 'slices', ...)
+        :type string
+        
+        :param name: (optional) name of the entity
+        :type string
+        
+        :param id: (optional) id of the entity
+        :type string/int
+        
+        :returns record of the entity
+        :rtype ClabRecord
+        '''
+        uri = clab_index.lookup(collection, name=name, id=id)
+        if uri:
+            # get_by_uri updates (or drops) the index entry of the uri
+            try:
+                record = self.get_by_uri(uri)
+            except ResourceNotFound:
+                record = None
+            if record and self.record_matches(record, name=name, id=id):
+                return record
+        record = self.lookup_entity(collection, name=name, id=id)
+        if not record:
+            raise ResourceNotFound("%s name=%s id=%s"%(collection, name, id))
+        return record
+    
+    
+    def get_slice_name_by_id(self, slice_id):
+        '''
+        Return the name of the slice with the given id.
+        The name is taken from the process-wide index (no request to the controller).
+        On a miss, the slice is retrieved from the controller and indexed.
+        
+        :param slice_id: id of the slice
+        :type string/int
+        
+        :returns name of the slice
+        :rtype string
+        '''
+        uri = clab_index.lookup('slices', id=slice_id)
+        if uri:
+            entry = clab_index.lookup_uri(uri)
+            if entry and entry[1] is not None:
+                return entry[1]
+        slice = self.get_entity_by('slices', id=slice_id)
+        return slice['name']
     
     
     def get_node_by(self, node_uri=None, node_name=None, node_id=None):
@@ -217,9 +487,9 @@ class ClabShell:
             if node_uri:
                 node = self.get_by_uri(node_uri)
             elif node_name:
-                node = controller.nodes.retrieve().get(name=node_name).serialize()
+                node = self.get_entity_by('nodes', name=node_name)
             elif node_id:
-                node = controller.nodes.retrieve().get(id=node_id).serialize()
+                node = self.get_entity_by('nodes', id=node_id)
         except TypeError:
             raise ResourceNotFound("node_id=%s, node_name=%s, node_uri=%s"%(node_id,node_name,node_uri))
         return node
@@ -247,9 +517,9 @@ class ClabShell:
             if slice_uri:
                 slice = self.get_by_uri(slice_uri)
             elif slice_name:
-                slice = controller.slices.retrieve().get(name=slice_name).serialize()
+                slice = self.get_entity_by('slices', name=slice_name)
             elif slice_id:
-                slice = controller.slices.retrieve().get(id=slice_id).serialize()
+                slice = self.get_entity_by('slices', id=slice_id)
         except TypeError:
             raise ResourceNotFound("slice_id=%s, slice_name=%s, slice_uri=%s"%(slice_id,slice_name,slice_uri))
         return slice
@@ -278,9 +548,9 @@ class ClabShell:
             if sliver_uri:
                 sliver = self.get_by_uri(sliver_uri)
             elif sliver_name:
-                sliver = controller.slivers.retrieve().get(id=sliver_name).serialize()
+                sliver = self.get_entity_by('slivers', name=sliver_name)
             elif sliver_id:
-                sliver = controller.slivers.retrieve().get(id=sliver_id).serialize()
+                sliver = self.get_entity_by('slivers', id=sliver_id)
         except TypeError:
             raise ResourceNotFound("sliver_id=%s, sliver_name=%s, sliver_uri=%s"%(sliver_id,sliver_name,sliver_uri))
         return sliver
@@ -308,9 +578,9 @@ class ClabShell:
             if group_uri:
                 group = self.get_by_uri(group_uri)
             elif group_name:
-                group = controller.groups.retrieve().get(name=group_name).serialize()
+                group = self.get_entity_by('groups', name=group_name)
             elif group_id:
-                group = controller.groups.retrieve().get(id=group_id).serialize()
+                group = self.get_entity_by('groups', id=group_id)
         except TypeError:
             raise ResourceNotFound("group_id=%s, group_name=%s, group_uri=%s"%(group_id,group_name,group_uri))
         return group
@@ -338,9 +608,9 @@ class ClabShell:
             if island_uri:
                 island = self.get_by_uri(island_uri)
             elif island_name:
-                island = controller.islands.retrieve().get(name=island_name).serialize()
+                island = self.get_entity_by('islands', name=island_name)
             elif island_id:
-                island = controller.islands.retrieve().get(id=island_id).serialize()
+                island = self.get_entity_by('islands', id=island_id)
         except TypeError:
             raise ResourceNotFound("island_id=%s, island_name=%s, island_uri=%s"%(island_id,island_name,island_uri))
         return island
@@ -368,9 +638,9 @@ class ClabShell:
             if template_uri:
                 template = self.get_by_uri(template_uri)
             elif template_name:
-                template = controller.templates.retrieve().get(name=template_name).serialize()
+                template = self.get_entity_by('templates', name=template_name)
             elif template_id:
-                template = controller.templates.retrieve().get(id=template_id).serialize()
+                template = self.get_entity_by('templates', id=template_id)
         except TypeError:
             raise ResourceNotFound("template_id=%s, template_name=%s, template_uri=%s"%(template_id,template_name,template_uri))
         return template
@@ -450,7 +720,7 @@ class ClabShell:
         # Obtain nodes corresponding to the slivers
         nodes=[]
         for sliver in slivers:
-            nodes.append(controller.retrieve(sliver['node']['uri']).serialize())
+            nodes.append(to_record(controller.retrieve(sliver['node']['uri']).serialize(), 'nodes'))
         return nodes
     
     def filter_nodes_by_group(self, nodes=None, group_name=None, group_id=None, group_uri=None):
@@ -474,7 +744,7 @@ class ClabShell:
             group_uri= self.get_group_by(group_uri, group_name, group_id)['uri']
         filtered=[]
         if not nodes:
-            nodes = controller.nodes.retrieve().serialize()
+            nodes = self.index_records('nodes', to_records(controller.nodes.retrieve().serialize(), 'nodes'), full=True)
         for node in nodes:
             try:
                 if node['group']['uri'] == group_uri:
@@ -504,7 +774,7 @@ class ClabShell:
             island_uri= self.get_island_by(island_uri, island_name, island_id)['uri']
         filtered=[]
         if not nodes:
-            nodes = controller.nodes.retrieve().serialize()
+            nodes = self.index_records('nodes', to_records(controller.nodes.retrieve().serialize(), 'nodes'), full=True)
         for node in nodes:
             try: 
                 if node['island']['uri'] == island_uri:
@@ -719,11 +989,11 @@ class ClabShell:
             island = node_element['island']
             all_nodes = self.filter_nodes_by_island(nodes=all_nodes, island_name=island.get('name'), island_id=island.get('id'), island_uri=island.get('uri'))
             
-        # Get nodes of the slice        
-        nodes_of_slice = self.get_nodes_by_slice(slice_uri=slice_uri) 
+        # Get uris of the nodes of the slice (node records are compared by uri)
+        node_uris_of_slice = set(node['uri'] for node in self.get_nodes_by_slice(slice_uri=slice_uri))
         # Get available nodes (nodes in all_nodes and not in nodes_of_slice)
-        # avialable_nodes is a list of dictionaries
-        available_nodes = [node for node in all_nodes if node not in nodes_of_slice]
+        # avialable_nodes is a list of node records
+        available_nodes = [node for node in all_nodes if node['uri'] not in node_uris_of_slice]
         
         # Get available nodes in production state
         #available_production_nodes=[]
@@ -824,7 +1094,7 @@ class ClabShell:
         
         # Create node
         try:
-            created_node= controller.nodes.create(name=name, group=group, description=description, 
+            created_node= controller.nodes.create(name=name, group=Resource(uri=group['uri']), description=description, 
                                 direct_ifaces=direct_ifaces, properties=properties, sliver_pub_ipv6=sliver_pub_ipv6, 
                                 local_iface=local_iface, arch=arch, sliver_pub_ipv4=sliver_pub_ipv4, sliver_pub_ipv4_range=sliver_pub_ipv4_range)
             created_node.retrieve()
@@ -845,9 +1115,10 @@ class ClabShell:
         
         # Set Production State
         created_node.update(set_state='production')
+        self.invalidate_cache(self.entity_cache_tags(created_node.uri))
         
         # Return node dictionary
-        return created_node.serialize()
+        return self.index_record(to_record(created_node.serialize(), 'nodes'))
     
     
     def create_slice(self, name, group_uri=None, template_uri=None, fields={}, properties={}):
@@ -886,11 +1157,13 @@ class ClabShell:
             
         # Create slice
         try:
-            created_slice = controller.slices.create(name=name, group=group, sliver_defaults=sliver_defaults, properties=properties)
+            created_slice = controller.slices.create(name=name, group=Resource(uri=group['uri']), sliver_defaults=sliver_defaults, properties=properties)
         except controller.ResponseStatusError as e:
             raise OperationFailed('create slice', e.message)
         # Return slice dictionary
-        return created_slice.serialize()
+        created_slice = self.index_record(to_record(created_slice.serialize(), 'slices'))
+        self.invalidate_cache(self.entity_cache_tags(created_slice['uri']))
+        return created_slice
     
         
     def create_sliver(self, slice_uri, node_uri, interfaces_definition=None, template_definition=None, properties={}):
@@ -929,14 +1202,16 @@ class ClabShell:
             template_id=None
             if template_definition.get('id'): 
                 template_id=int(template_definition.get('id'))
-            template=self.get_template_by(template_name=template_definition.get('name'), template_id=template_id)
+            template=Resource(uri=self.get_template_by(template_name=template_definition.get('name'), template_id=template_id)['uri'])
         # Create sliver
         try:
-            created_sliver = slice.slivers.create(node=node, interfaces=interfaces, template=template, properties=properties)
+            created_sliver = slice.slivers.create(node=Resource(uri=node['uri']), interfaces=interfaces, template=template, properties=properties)
         except controller.ResponseStatusError as e:
             raise OperationFailed('create sliver', e.message)
         # Return sliver dict
-        return created_sliver.serialize()
+        created_sliver = self.index_record(to_record(created_sliver.serialize(), 'slivers'))
+        self.invalidate_cache(self.entity_cache_tags(created_sliver['uri']))
+        return created_sliver
     
     
     def create_user(self, username, email=None, description=None, groupname=None, auth_tokens=None):
@@ -981,8 +1256,9 @@ class ClabShell:
         group_roles=[{'is_admin': 'false', 'is_technician': 'false', 'group': {'uri': group_uri}, 'is_researcher': 'true'}]
         # Update user with the group_roles
         user.update(group_roles=group_roles)
+        self.invalidate_cache(self.entity_cache_tags(user_uri))
         # Return user dict
-        return user.serialize()
+        return self.index_record(to_record(user.serialize(), 'users'))
     
     
     
@@ -1006,6 +1282,7 @@ class ClabShell:
         slice = self.get_by_uri_no_serialized(slice_uri)
         renew_uri=slice.get_links()['http://confine-project.eu/rel/server/do-renew']
         response=controller.post(renew_uri, data='null')
+        self.invalidate_cache(self.entity_cache_tags(slice_uri))
         return True
     
     
@@ -1046,6 +1323,7 @@ class ClabShell:
             node.update(set_state=state)
         except controller.ResponseStatusError as e:
             raise OperationFailed('update node state', e.message)
+        self.invalidate_cache(self.entity_cache_tags(node_uri))
         return True
     
     
@@ -1068,6 +1346,7 @@ class ClabShell:
             slice.update(set_state=state)
         except controller.ResponseStatusError as e:
             raise OperationFailed('update slice state', e.message)
+        self.invalidate_cache(self.entity_cache_tags(slice_uri))
         return True
     
         
@@ -1090,7 +1369,8 @@ class ClabShell:
             sliver.update(set_state=state)
         except controller.ResponseStatusError as e:
             raise OperationFailed('update sliver state', e.message)
-        return sliver.serialize()
+        self.invalidate_cache(self.entity_cache_tags(sliver_uri))
+        return to_record(sliver.serialize(), 'slivers')
     
     
     def update_node(self, node_uri, fields):
@@ -1135,6 +1415,7 @@ class ClabShell:
                     node.update(set_state=fields[key])
         except controller.ResponseStatusError as e:
             raise OperationFailed('update node', e.message)
+        self.invalidate_cache(self.entity_cache_tags(node_uri))
         return True
 
     
@@ -1168,6 +1449,7 @@ class ClabShell:
                     slice.update(set_state=fields[key])
         except controller.ResponseStatusError as e:
             raise OperationFailed('update slice', e.message)
+        self.invalidate_cache(self.entity_cache_tags(slice_uri))
         return True
 
     
@@ -1203,6 +1485,7 @@ class ClabShell:
                     sliver.update(set_state=fields[key])
         except controller.ResponseStatusError as e:
             raise OperationFailed('update sliver', e.message)
+        self.invalidate_cache(self.entity_cache_tags(sliver_uri))
         return True
 
 
@@ -1234,6 +1517,7 @@ class ClabShell:
                     user.update(group_roles=fields[key])
         except controller.ResponseStatusError as e:
             raise OperationFailed('update user', e.message)
+        self.invalidate_cache(self.entity_cache_tags(user_uri))
         return True
     
     
@@ -1251,6 +1535,7 @@ class ClabShell:
         '''
         sliver = self.get_by_uri_no_serialized(sliver_uri)
         s = sliver.ctl_upload_data(open(exp_data_file))
+        self.invalidate_cache(self.entity_cache_tags(sliver_uri))
         return s
         # Force the sliver to use this exp-data file?
     
@@ -1268,6 +1553,7 @@ class ClabShell:
         '''
         slice = self.get_by_uri_no_serialized(slice_uri)
         slice.ctl_upload_data(open(exp_data_file,'r'))
+        self.invalidate_cache(self.entity_cache_tags(slice_uri))
         # Force the slice to use this exp-data file?    
 
     ##################
@@ -1285,10 +1571,14 @@ class ClabShell:
         :returns boolean indicating if the operation was successful
         :rtype boolean
         '''
+        # tags of the entity (resolved before its index entry is removed)
+        tags = self.entity_cache_tags(uri, deleted=True)
         try:
             controller.destroy(uri)
+            clab_index.remove_cascade(uri)
         except controller.ResponseStatusError as e:
             raise OperationFailed('delete', e.message)
+        self.invalidate_cache(tags)
         return True    
 
     
@@ -1303,10 +1593,14 @@ class ClabShell:
         :returns boolean indicating if the operation was successful
         :rtype boolean
         '''
+        # tags of the entity (resolved before its index entry is removed)
+        tags = self.entity_cache_tags(node_uri, deleted=True)
         try:
             controller.destroy(node_uri)
+            clab_index.remove_cascade(node_uri)
         except controller.ResponseStatusError as e:
             raise OperationFailed('delete node', e.message)
+        self.invalidate_cache(tags)
         return True    
         
         
@@ -1321,10 +1615,14 @@ class ClabShell:
         :returns boolean indicating if the operation was successful
         :rtype boolean
         '''
+        # tags of the entity (resolved before its index entry is removed)
+        tags = self.entity_cache_tags(slice_uri, deleted=True)
         try:
             controller.destroy(slice_uri)
+            clab_index.remove_cascade(slice_uri)
         except controller.ResponseStatusError as e:
             raise OperationFailed('delete slice', e.message)
+        self.invalidate_cache(tags)
         return True    
         
         
@@ -1338,10 +1636,14 @@ class ClabShell:
         :returns boolean indicating if the operation was successful
         :rtype boolean
         '''
+        # tags of the entity (resolved before its index entry is removed)
+        tags = self.entity_cache_tags(sliver_uri, deleted=True)
         try:
             controller.destroy(sliver_uri)
+            clab_index.remove_cascade(sliver_uri)
         except controller.ResponseStatusError as e:
             raise OperationFailed('delete sliver', e.message)
+        self.invalidate_cache(tags)
         return True    
     
   
@@ -1361,6 +1663,11 @@ class ClabShell:
         node = self.get_by_uri_no_serialized(node_uri)
         reboot_uri=node.get_links()['http://confine-project.eu/rel/server/do-reboot']
         response=controller.post(reboot_uri, data='null')
+        self.invalidate_cache(self.entity_cache_tags(node_uri))
         return response.ok           
     
        
+
+
+# Measure the latency of every ClabShell method (metrics)
+instrument_shell_methods(ClabShell)
@@ -0,0 +1,289 @@
+'''
+Created on 20/10/2014
+
+@author: gerard
+'''
+
+# Module that defines the record/replay of the traffic between the SFAWrap and the C-Lab controller.
+# In record mode, every request sent to the controller (ClabApi.request) and its response are captured
+# with their timings. The requests of each AM call are written to a compact trace file (gzipped JSON),
+# together with the requests sent before the call to set up the shell (base resource, login) so every
+# trace can be replayed on its own, and with the AM method and arguments of the call.
+# In replay mode, the responses are served from a trace file instead of the controller, with the
+# original latencies (optionally scaled), so real AM calls can be reproduced and profiled offline
+# and deterministically (see benchmark/replay_am.py).
+# Credentials and authentication tokens are not stored in the traces.
+
+from __future__ import with_statement
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from sfa.clab.clab_exceptions import ReplayMismatch
+
+
+# Record/replay modes
+TRAFFIC_MODES = ('off', 'record', 'replay')
+
+# Response headers kept in the traces (used by the ORM)
+RECORDED_HEADERS = ('content-type', 'link', 'etag', 'location')
+
+# Requests sent outside of the AM calls (shell set up) kept to be included in the traces
+DEFAULT_PREAMBLE_SIZE = 20
+
+# Maximum number of trace files kept in the directory (the oldest ones are removed)
+DEFAULT_MAX_TRACES = 500
+
+
+def rotate_directory(directory, max_files, prefix='', by_stem=False):
+    '''
+    Remove the oldest files of a directory so that at most max_files remain
+
+    :param directory: path of the directory
+    :type string
+
+    :param max_files: maximum number of files kept (0 = no limit), or of groups of files if by_stem
+    :type int
+
+    :param prefix: (optional) only the files starting with this prefix are considered
+    :type string
+
+    :param by_stem: (optional) the files with the same name before the extension
+        (e.g. profile-X.json and profile-X.prof) are kept or removed together
+    :type boolean
+    '''
+    if not max_files:
+        return
+    groups = {}
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            stem = name.split('.')[0] if by_stem else name
+            groups.setdefault(stem, []).append(os.path.join(directory, name))
+    def group_mtime(paths):
+        return max([os.path.getmtime(path) for path in paths])
+    groups = sorted(groups.values(), key=group_mtime)
+    for paths in groups[:max(len(groups) - max_files, 0)]:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def request_digest(data):
+    '''
+    Digest of the body of a request, used to match the requests in replay mode
+    '''
+    if data is None:
+        return None
+    if not isinstance(data, basestring):
+        data = repr(data)
+    return hashlib.sha1(data).hexdigest()
+
+
+class ControllerTraffic:
+    '''
+    Process-wide record/replay of the controller traffic.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = 'off'
+        self.directory = None
+        self.max_traces = DEFAULT_MAX_TRACES
+        self.latency_scale = 1.0
+        self.base_uri = None
+        self.preamble = deque(maxlen=DEFAULT_PREAMBLE_SIZE)
+        # replay: (method, url, digest) -> entries in the order they were recorded
+        self.replay_entries = {}
+        self.replay_trace = None
+
+    def configure(self, mode=None, directory=None, trace_file=None, latency_scale=None, base_uri=None, max_traces=None):
+        '''
+        Configure the record/replay of the controller traffic
+
+        :param mode: 'off', 'record' or 'replay'
+        :type string
+
+        :param directory: directory where the traces are recorded
+        :type string
+
+        :param trace_file: trace file served in replay mode
+        :type string
+
+        :param latency_scale: factor applied to the recorded latencies in replay mode (0 = no latency)
+        :type float
+
+        :param base_uri: base uri of the controller API (recorded in the traces)
+        :type string
+
+        :param max_traces: maximum number of trace files kept in the directory
+        :type int
+        '''
+        with self.lock:
+            if mode is not None:
+                self.mode = mode if mode in TRAFFIC_MODES else 'off'
+            if directory is not None:
+                self.directory = directory
+            if latency_scale is not None:
+                self.latency_scale = float(latency_scale)
+            if base_uri is not None:
+                self.base_uri = base_uri
+            if max_traces is not None:
+                self.max_traces = max_traces
+        if self.mode == 'replay' and trace_file and trace_file != self.replay_trace:
+            self.load(trace_file)
+
+    ##########
+    # RECORD #
+    ##########
+
+    def record(self, context, method_name, url, data, response=None, error=None, elapsed=0.0):
+        '''
+        Record a request sent to the controller and its response (or the exception raised)
+
+        :param context: AM call that sent the request (None if it was sent outside of an AM call)
+        :type AMCallContext
+        '''
+        login = 'auth-token' in (url or '')
+        # the login request (credentials) is not digested and its token is not stored
+        entry = {'method': method_name, 'url': url, 'digest': None if login else request_digest(data), 'elapsed': elapsed}
+        if response is not None:
+            content = json.dumps({'token': 'replayed-token'}) if login else response.content
+            entry['status'] = response.status_code
+            entry['reason'] = response.reason
+            entry['headers'] = dict([(header, response.headers[header]) for header in RECORDED_HEADERS
+                                     if header in response.headers])
+            entry['content'] = content.decode('utf-8', 'replace') if isinstance(content, str) else content
+        else:
+            entry['error'] = error
+        if context is None:
+            with self.lock:
+                self.preamble.append(entry)
+        else:
+            context.traffic.append(entry)
+
+    def save(self, context, args, kwargs, error=None):
+        '''
+        Write the trace of a finished AM call
+
+        :param context: finished AM call
+        :type AMCallContext
+
+        :param args: positional arguments of the AM method (without the driver)
+        :type tuple
+
+        :param kwargs: keyword arguments of the AM method
+        :type dict
+
+        :returns path of the trace file
+        :rtype string
+        '''
+        def strip_credentials(value):
+            if isinstance(value, dict):
+                return dict([(key, item) for (key, item) in value.items() if key not in ['creds', 'credentials']])
+            return value
+        with self.lock:
+            preamble = list(self.preamble)
+        trace = {'version': 1, 'base_uri': self.base_uri, 'am_method': context.method,
+                 'args': [strip_credentials(arg) for arg in args],
+                 'kwargs': dict([(key, strip_credentials(value)) for (key, value) in kwargs.items()]),
+                 'start': context.start, 'duration': time.time() - context.start, 'error': error,
+                 'preamble': preamble, 'requests': context.traffic}
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, 'trace-%s-%d-%s.json.gz'%(time.strftime('%Y%m%d%H%M%S', time.gmtime(context.start)),
+                                                                      context.id, context.method))
+        trace_file = gzip.open(path, 'wb')
+        try:
+            trace_file.write(json.dumps(trace, separators=(',', ':'), default=repr))
+        finally:
+            trace_file.close()
+        rotate_directory(self.directory, self.max_traces, prefix='trace-')
+        return path
+
+    ##########
+    # REPLAY #
+    ##########
+
+    def load(self, path):
+        '''
+        Load a trace file to be served in replay mode
+
+        :returns the trace
+        :rtype dict
+        '''
+        trace_file = gzip.open(path, 'rb')
+        try:
+            trace = json.loads(trace_file.read())
+        finally:
+            trace_file.close()
+        entries = {}
+        for entry in trace['preamble'] + trace['requests']:
+            entries.setdefault((entry['method'], entry['url'], entry['digest']), deque()).append(entry)
+        with self.lock:
+            self.replay_entries = entries
+            self.replay_trace = path
+        return trace
+
+    def replay_method(self, method):
+        '''
+        Get a replacement of a requests method (requests.get, requests.post...) that serves
+        the responses from the replayed trace, to be used by the ORM Api.request
+
+        :param method: requests method
+        :type function
+
+        :returns replay method with the same name
+        :rtype function
+        '''
+        def replay(url, data=None, **kwargs):
+            return self.replay(method.__name__.lower(), url, data)
+        replay.__name__ = method.__name__
+        return replay
+
+    def replay(self, method_name, url, data):
+        '''
+        Serve a request from the replayed trace, with the recorded latency (scaled)
+
+        :returns response of the request
+        :rtype requests.Response
+        '''
+        key = (method_name, url, request_digest(data))
+        with self.lock:
+            queue = self.replay_entries.get(key)
+            if not queue:
+                # the body may differ (e.g. order of the fields): match by method and url
+                queue = [entries for ((method, entry_url, digest), entries) in self.replay_entries.items()
+                         if method == method_name and entry_url == url and entries]
+                queue = queue[0] if queue else None
+            if not queue:
+                raise ReplayMismatch(method_name, url)
+            # the last response of each request is served again if it is repeated more times
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.latency_scale:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        if 'error' in entry:
+            # same exception class as the recorded one (e.g. Timeout, ConnectionError)
+            raise getattr(requests.exceptions, entry['error'], requests.exceptions.RequestException)(entry['error'])
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response._content = entry['content'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = url
+        # the ORM reads the request of the unexpected responses (ResponseStatusError)
+        response.request = requests.Request(method_name.upper(), url).prepare()
+        return response
+
+
+# Process-wide record/replay of the controller traffic
+controller_traffic = ControllerTraffic()
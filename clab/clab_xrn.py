@@ -6,12 +6,123 @@ Created on 06/02/2014
 
 
 from sfa.util.xrn import Xrn
+from sfa.clab.clab_exceptions import ResourceNotFound
 import unicodedata
+import threading
+from collections import OrderedDict
+from functools import wraps
 
 '''
 Methods and classes for XRN management in C-Lab
 '''
 
+###########################################
+# Memoization of the translation methods
+###########################################
+
+# Maximum number of entries kept by each translation cache
+TRANSLATION_CACHE_SIZE = 4096
+
+# Registry of the translation caches (function name --> cache)
+translation_caches = OrderedDict()
+
+
+class TranslationCache:
+    '''
+    Bounded LRU cache for the pure translation methods of this module.
+    The translation methods build Xrn objects and rerun the regex parsing and escaping 
+    of SFA for every call, while they are called several times per sliver per request
+    with the same arguments.
+    '''
+    
+    def __init__(self, maxsize=TRANSLATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        '''
+        Return the cached value for the key (moving it to the most recently used position)
+        Raises KeyError if the key is not cached
+        '''
+        with self.lock:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            self.hits += 1
+            return value
+    
+    def add(self, key, value):
+        with self.lock:
+            self.misses += 1
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                    'maxsize': self.maxsize, 'hit_rate': float(self.hits)/lookups if lookups else 0.0}
+
+
+def memoize_translation(function):
+    '''
+    Decorator that memoizes a pure translation method in a bounded LRU cache.
+    The type of the arguments is part of the key, so that str and unicode arguments
+    with the same value (which may translate differently) do not share an entry. 
+    Exceptions are not cached.
+    '''
+    cache = TranslationCache()
+    translation_caches[function.__name__] = cache
+    
+    @wraps(function)
+    def memoized(*args, **kwargs):
+        arguments = args + tuple(sorted(kwargs.items()))
+        key = arguments + tuple(type(arg) for arg in args + tuple(kwargs.values()))
+        try:
+            return cache.get(key)
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable argument, do not cache
+            return function(*args, **kwargs)
+        value = function(*args, **kwargs)
+        cache.add(key, value)
+        return value
+    
+    memoized.cache = cache
+    return memoized
+
+
+def get_translation_cache_stats():
+    '''
+    Return the hit-rate statistics of the translation caches
+    
+    :returns dictionary function name --> stats dict (hits, misses, size, maxsize, hit_rate)
+    :rtype dict
+    '''
+    return dict((name, cache.stats()) for name, cache in translation_caches.items())
+
+
+def clear_translation_caches():
+    '''
+    Clear all the translation caches and reset their statistics
+    '''
+    for cache in translation_caches.values():
+        cache.clear()
+
+###########################################
+
+@memoize_translation
 def type_of_urn(urn):
     """
     Returns the type of the given urn (node, slice, sliver)
@@ -42,6 +153,7 @@ def xrn_object(root_auth, hostname):
     return Xrn('.'.join([root_auth, Xrn.escape(escaped_hostname)]), type='node')
     
 
+@memoize_translation
 def xrn_to_hostname(xrn):
     """
     Returns a node's hostname from its xrn
@@ -57,6 +169,7 @@ def xrn_to_hostname(xrn):
     return Xrn.unescape(unescaped_hostname)
 
 
+@memoize_translation
 def hostname_to_hrn (auth, hostname):
     """
     Turns node hostname into hrn.
@@ -73,6 +186,7 @@ def hostname_to_hrn (auth, hostname):
     escaped_hostname = escape_testbed_obj_names(hostname)
     return ClabXrn(auth=auth, hostname=escaped_hostname).get_hrn()
 
+@memoize_translation
 def hostname_to_urn(auth, hostname):
     """
     Turns node hostname into urn.
@@ -90,6 +204,7 @@ def hostname_to_urn(auth, hostname):
     return ClabXrn(auth=auth, hostname=escaped_hostname).get_urn()
 
 
+@memoize_translation
 def slicename_to_hrn (slicename, auth=None):
     """
     Turns slice name into hrn.
@@ -111,6 +226,7 @@ def slicename_to_hrn (slicename, auth=None):
         return ClabXrn(xrn=slicename, type='slice').get_hrn() # URN of slice as slicename in CLab
 
 
+@memoize_translation
 def slicename_to_urn (slicename, auth=None):
     """
     Turns Slice name into urn.
@@ -147,6 +263,7 @@ def urn_to_slicename (urn):
     #return "wall2+"+ClabXrn(xrn=urn, type='slice').get_slicename()
     return urn # URN of slice as slicename in CLab
 
+@memoize_translation
 def hrn_to_slicename (hrn):
     """
     Turns HRN into a slice name (C-Lab specific)
@@ -160,6 +277,7 @@ def hrn_to_slicename (hrn):
     #return ClabXrn(xrn=hrn, type='slice').get_slicename()
     return ClabXrn(xrn=hrn, type='slice').get_urn() # URN of slice as slicename in CLab
 
+@memoize_translation
 def urn_to_nodename (urn):
     """
     Turns URN into a node name (C-Lab specific)
@@ -173,6 +291,7 @@ def urn_to_nodename (urn):
     return xrn_to_hostname(urn)
 
 
+@memoize_translation
 def hrn_to_nodename (hrn):
     """
     Turns HRN into a node name (C-Lab specific)
@@ -186,6 +305,7 @@ def hrn_to_nodename (hrn):
     return xrn_to_hostname(hrn)
 
 
+@memoize_translation
 def slivername_to_hrn (auth, slivername):
     """
     Turns Sliver name into hrn.
@@ -202,6 +322,7 @@ def slivername_to_hrn (auth, slivername):
     escaped_slivername = escape_testbed_obj_names(slivername)
     ClabXrn(auth=auth, slivername=escaped_slivername).get_hrn()
 
+@memoize_translation
 def slivername_to_urn (auth, slivername):
     """
     Turns Sliver name into urn.
@@ -218,6 +339,7 @@ def slivername_to_urn (auth, slivername):
     escaped_slivername = escape_testbed_obj_names(slivername)
     return ClabXrn(auth=auth, slivername=escaped_slivername).get_urn()
 
+@memoize_translation
 def urn_to_slivername (urn):
     """
     Turns URN into a sliver name (C-Lab specific)
@@ -231,6 +353,7 @@ def urn_to_slivername (urn):
     escaped_slivername = ClabXrn(xrn=urn, type='sliver').get_slivername()
     return unescape_testbed_obj_names(escaped_slivername)
 
+@memoize_translation
 def hrn_to_slivername (hrn):
     """
     Turns HRN into a sliver name (C-Lab specific)
@@ -245,6 +368,7 @@ def hrn_to_slivername (hrn):
     return unescape_testbed_obj_names(escaped_slivername)
 
 
+@memoize_translation
 def xrn_slivername_to_clab_slivername(slivername):
     """
     Helper method to replace the character '@' from C-Lab sliver name
@@ -260,6 +384,7 @@ def xrn_slivername_to_clab_slivername(slivername):
     return slivername.replace('a', '@')
 
 
+@memoize_translation
 def clab_slivername_to_xrn_slivername(slivername):
     """
     Helper method to replace the character 'a' from GENI xrn sliver name
@@ -275,6 +400,7 @@ def clab_slivername_to_xrn_slivername(slivername):
     return slivername.replace('@', 'a')
 
 
+@memoize_translation
 def hrn_to_authname (hrn):
     """
     Gets the authority name from an HRN
@@ -287,6 +413,7 @@ def hrn_to_authname (hrn):
     """
     return Xrn(xrn=hrn).get_authority_hrn()
 
+@memoize_translation
 def username_to_hrn (auth, username):
     """
     Turns user name into hrn.
@@ -303,6 +430,7 @@ def username_to_hrn (auth, username):
     escaped_username = escape_testbed_obj_names(username)
     return ClabXrn(auth=auth, username=escaped_username).get_hrn()
 
+@memoize_translation
 def username_to_urn(auth, username):
     """
     Turns user name into urn.
@@ -319,6 +447,7 @@ def username_to_urn(auth, username):
     escaped_username = escape_testbed_obj_names(username)
     return ClabXrn(auth=auth, username=escaped_username).get_urn()
 
+@memoize_translation
 def escape_testbed_obj_names(object_name):
     """
     Escape names of objects from the testbed (nodes, users, slices, slivers...) 
@@ -343,6 +472,7 @@ def escape_testbed_obj_names(object_name):
     return escaped_name
 
 
+@memoize_translation
 def unescape_testbed_obj_names(object_name):
     """
     Unescape names of objects from the testbed (nodes, users, slices, slivers...) 
@@ -362,6 +492,7 @@ def unescape_testbed_obj_names(object_name):
     return unescaped_name
     
     
+@memoize_translation
 def unicode_normalize(name):
     """
     Converts the Unicode string 'name' to a ASCII string, ignoring the special non-ascii characters
@@ -394,15 +525,18 @@ def urn_to_uri(driver, urn):
     :returns: C-Lab URI of the object
     :rtype: string
     '''
-    if type_of_urn(urn) == 'node':
-        node = get_node_by_urn(driver, urn)
-        uri = node['uri']
-    elif type_of_urn(urn) == 'slice':
-        slice = get_slice_by_urn(driver, urn)
-        uri = slice['uri'] 
-    elif type_of_urn(urn) == 'sliver':
-        sliver = get_sliver_by_urn(driver, urn)
-        uri = sliver['uri'] 
+    # The uri is resolved from the index of the ClabShell (no request to the controller)
+    # or by a targeted lookup if the object is not indexed
+    uri = None
+    urn_type = type_of_urn(urn)
+    if urn_type == 'node':
+        uri = driver.testbed_shell.get_uri_by('nodes', name=urn_to_nodename(urn))
+    elif urn_type == 'slice':
+        uri = driver.testbed_shell.get_uri_by('slices', name=urn_to_slicename(urn))
+    elif urn_type == 'sliver':
+        uri = driver.testbed_shell.get_uri_by('slivers', name=urn_to_slivername(urn))
+    if not uri:
+        raise ResourceNotFound(urn)
     return uri
 
 
@@ -440,11 +574,37 @@ def get_slice_by_sliver_urn(driver, urn):
     '''
     slivername = urn_to_slivername(urn)
     # slivername = sliceid @ nodeid
+    slice_id, sep, node_id = slivername.partition('@')
+    if sep and slice_id:
+        return driver.testbed_shell.get_slice_by(slice_id=slice_id)
     sliver = driver.testbed_shell.get_sliver_by(sliver_name=slivername)
     slice_uri = sliver['slice']['uri']
     return driver.testbed_shell.get_slice_by(slice_uri=slice_uri)
 
 
+def get_slicename_by_sliver_urn(driver, urn):
+    '''
+    Return the name of the slice where the sliver identified by the given urn 
+    is contained. The slice id is obtained from the sliver name (sliceid@nodeid)
+    and its name from the index of the shell, so in the common case no request
+    is sent to the controller.
+        
+    :param driver: reference to a ClabDriver instance
+    :type ClabDriver
+    
+    :param urn: URN of the sliver
+    :type string
+
+    :returns: name of the slice
+    :rtype: string
+    '''
+    slivername = urn_to_slivername(urn)
+    slice_id, sep, node_id = slivername.partition('@')
+    if sep and slice_id:
+        return driver.testbed_shell.get_slice_name_by_id(slice_id)
+    return get_slice_by_sliver_urn(driver, urn)['name']
+
+
 def get_node_by_urn(driver, urn):
     '''
     Return the node clab-specific dictionary that corresponds to the 
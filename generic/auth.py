@@ -1,7 +1,14 @@
 #
 # SfaAPI authentication 
 #
+from __future__ import with_statement
+import os
 import sys
+import time
+import calendar
+import hashlib
+import threading
+from collections import OrderedDict
 
 from sfa.util.faults import InsufficientRights, MissingCallerGID, MissingTrustedRoots, PermissionError, \
     BadRequestHash, ConnectionKeyGIDMismatch, SfaPermissionDenied, CredentialNotVerifiable, Forbidden, \
@@ -18,6 +25,214 @@ from sfa.trust.trustedroots import TrustedRoots
 from sfa.trust.hierarchy import Hierarchy
 from sfa.trust.sfaticket import SfaTicket
 
+# maximum number of verified credentials kept in the cache
+DEFAULT_CREDENTIAL_CACHE_SIZE = 1000
+
+
+def credential_digest(credential):
+    """
+    Digest identifying a credential as received in the API call.
+    The credential may be the XML string or a dict (geni_type, geni_version, geni_value)
+    """
+    if isinstance(credential, dict):
+        credential = "%s|%s|%s" % (credential.get('geni_type'), credential.get('geni_version'),
+                                   credential.get('geni_value'))
+    if isinstance(credential, unicode):
+        credential = credential.encode('utf-8')
+    return hashlib.sha1(credential).hexdigest()
+
+
+class VerifiedCredentialCache:
+    """
+    Thread-safe LRU cache of successfully verified credentials.
+    Experimenter tools send the same credential on every call, so the signature 
+    chain verification (xmlsec) is done only the first time the credential is seen.
+    Entries are keyed by the digest of the credential plus the fingerprint of the
+    peer certificate, and they expire with the credential itself.
+    """
+
+    def __init__(self, max_size=DEFAULT_CREDENTIAL_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the verified Credential object cached for the key, or None
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or time.time() > entry[0]:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def add(self, key, cred):
+        """
+        Add a verified Credential object. The entry expires with the credential.
+        """
+        expiration = cred.get_expiration()
+        if not expiration:
+            return
+        expires = calendar.timegm(expiration.utctimetuple())
+        if expires <= time.time():
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, cred)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+# process-wide cache (a new Auth instance is created for each incoming request)
+verified_credentials = VerifiedCredentialCache()
+
+
+class CredentialInfo:
+    """
+    Credential parsed once, exposing the information used by the
+    authentication, the driver and the logging of the wrapper
+    """
+
+    def __init__(self, credential):
+        self.credential = credential
+        self.cred = Credential(cred=credential)
+        self.caller_gid = self.cred.get_gid_caller()
+        self.object_gid = self.cred.get_gid_object()
+        self.caller_hrn = self.caller_gid.get_hrn() if self.caller_gid else None
+        self.owner_urn = self.caller_gid.get_urn() if self.caller_gid else None
+        self.target_hrn = self.object_gid.get_hrn() if self.object_gid else None
+        self.target_urn = self.object_gid.get_urn() if self.object_gid else None
+        self.expiration = self.cred.get_expiration()
+        self.privileges = [right.kind for right in self.cred.get_privileges().rights]
+
+
+class CredentialContext(threading.local):
+    """
+    Per-request (per-thread) context where each credential of the request is
+    parsed only once. It is reset when the Auth of a new request is created.
+    """
+
+    # safety bound in case the context is not reset
+    max_size = 64
+
+    def __init__(self):
+        self.infos = {}
+
+    def get(self, credential):
+        """
+        Returns the CredentialInfo of the credential (string or geni dict),
+        parsing it if it was not yet parsed in this request
+        """
+        key = credential_digest(credential)
+        info = self.infos.get(key)
+        if info is None:
+            if len(self.infos) >= self.max_size:
+                self.infos = {}
+            info = CredentialInfo(credential)
+            self.infos[key] = info
+        return info
+
+    def reset(self):
+        self.infos = {}
+
+
+# credential context of the request being processed by the current thread
+credential_context = CredentialContext()
+
+
+class TrustStore:
+    """
+    Process-wide store of the trusted roots and the authority Hierarchy.
+    The trusted roots directory is read (and its certificates parsed) only 
+    the first time and then again only when the mtime of the directory changes
+    (a certificate is added, removed or replaced). When the trusted roots are 
+    reloaded the cache of verified credentials is cleared.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trustedroots_dir = None
+        self.mtime = None
+        self.hierarchy = None
+        self.trusted_cert_list = []
+        self.trusted_cert_file_list = []
+        self.trusted_peer_hrns = set()
+        self.loads = 0
+
+    def get_mtime(self, trustedroots_dir):
+        try:
+            return os.stat(trustedroots_dir).st_mtime
+        except OSError:
+            return None
+
+    def load(self, trustedroots_dir):
+        """
+        Returns the store, (re)loading the trusted roots if the directory
+        is a different one or it has changed since the last load
+        """
+        mtime = self.get_mtime(trustedroots_dir)
+        if self.loads and trustedroots_dir == self.trustedroots_dir and mtime == self.mtime:
+            return self
+        with self.lock:
+            if self.loads and trustedroots_dir == self.trustedroots_dir and mtime == self.mtime:
+                return self
+            trusted_roots = TrustedRoots(trustedroots_dir)
+            trusted_cert_list = trusted_roots.get_list()
+            self.trusted_cert_file_list = trusted_roots.get_file_list()
+            self.trusted_peer_hrns = set([gid.get_hrn() for gid in trusted_cert_list])
+            self.trusted_cert_list = trusted_cert_list
+            if self.hierarchy is None:
+                self.hierarchy = Hierarchy()
+            if self.loads:
+                logger.info("TrustStore: trusted roots in %s changed, reloading"%trustedroots_dir)
+                verified_credentials.clear()
+            self.trustedroots_dir = trustedroots_dir
+            self.mtime = mtime
+            self.loads += 1
+        return self
+
+    def reload(self):
+        """
+        Force the reload of the trusted roots in the next access
+        """
+        with self.lock:
+            self.mtime = None
+
+
+# process-wide trust store shared by all the Auth instances
+trust_store = TrustStore()
+
+# process-wide configuration of the Auth instances created without one
+# (parsed once, not on every incoming request)
+default_config = None
+default_config_lock = threading.Lock()
+
+
+def get_default_config():
+    """
+    Returns the process-wide Config, parsing it the first time
+    """
+    global default_config
+    if default_config is None:
+        with default_config_lock:
+            if default_config is None:
+                default_config = Config()
+    return default_config
+
 
 class Auth:
     """
@@ -26,14 +241,21 @@ class Auth:
 
     def __init__(self, peer_cert = None, config = None ):
         self.peer_cert = peer_cert
-        self.hierarchy = Hierarchy()
-        if not config:
-            self.config = Config()
+        # new incoming request: start a new credential context
+        credential_context.reset()
+        if config:
+            self.config = config
+        else:
+            self.config = get_default_config()
         self.load_trusted_certs()
 
     def load_trusted_certs(self):
-        self.trusted_cert_list = TrustedRoots(self.config.get_trustedroots_dir()).get_list()
-        self.trusted_cert_file_list = TrustedRoots(self.config.get_trustedroots_dir()).get_file_list()
+        # trusted roots and hierarchy are loaded once per process (see TrustStore)
+        store = trust_store.load(self.config.get_trustedroots_dir())
+        self.hierarchy = store.hierarchy
+        self.trusted_cert_list = store.trusted_cert_list
+        self.trusted_cert_file_list = store.trusted_cert_file_list
+        self.trusted_peer_hrns = store.trusted_peer_hrns
 
     def checkCredentials(self, creds, operation, xrns=[], check_sliver_callback=None, speaking_for_hrn=None):
 
@@ -68,14 +290,21 @@ class Auth:
         if not creds: raise BadArgs("no credential provided")  #Forbidden("no credential provided")
         if not hrns: hrns = [None]
         for cred in creds:
+            # verify each credential once (signature chain), then check 
+            # each target hrn (and the speaking for hrn) against it
+            try:
+                cred_obj = self.verify_credential(cred)
+            except:
+                error = log_invalid_cred(cred)
+                continue
             for hrn in hrns:
                 try:
-                    self.check(cred, operation, hrn)
+                    self.check_target(cred_obj, operation, hrn)
                     valid.append(cred)
                 except:
                     if speaking_for_hrn:
                        try:
-                          self.check(cred, operation, speaking_for_hrn)
+                          self.check_target(cred_obj, operation, speaking_for_hrn)
                           speaks_for_cred = cred
                           valid.append(cred)
                        except:
@@ -109,44 +338,87 @@ class Auth:
         trusted cert and check if the credential is allowed to perform 
         the specified operation.    
         """
-        cred = Credential(cred=credential)    
-        self.client_cred = cred
-        logger.debug("Auth.check: handling hrn=%s and credential=%s"%\
-                         (hrn,cred.get_summary_tostring()))
+        cred = self.verify_credential(credential)
+        return self.check_target(cred, operation, hrn)
+
+    def verify_credential(self, credential):
+        """
+        Parse the credential and verify it: type, caller gid, peer cert and 
+        signature chain against the trusted roots. This is the expensive stage
+        of the check, run once per credential regardless of the number of targets.
+        Credentials already verified (with the same peer cert) are taken from 
+        the verified credentials cache.
+
+        @return the verified Credential object
+        """
+        cache_key = self.verified_credential_key(credential)
+        cred = verified_credentials.get(cache_key)
+        if cred is not None:
+            return cred
+
+        cred = credential_context.get(credential).cred
+        logger.debug("Auth.verify_credential: handling credential=%s"%\
+                         (cred.get_summary_tostring()))
 
         if cred.type not in ['geni_sfa']:
             raise CredentialNotVerifiable(cred.type, "%s not supported" % cred.type)
-        self.client_gid = self.client_cred.get_gid_caller()
-        self.object_gid = self.client_cred.get_gid_object()
+        client_gid = cred.get_gid_caller()
         
         # make sure the client_gid is not blank
-        if not self.client_gid:
-            raise MissingCallerGID(self.client_cred.get_subject())
+        if not client_gid:
+            raise MissingCallerGID(cred.get_subject())
        
         # validate the client cert if it exists
         if self.peer_cert:
-            self.verifyPeerCert(self.peer_cert, self.client_gid)                   
+            self.verifyPeerCert(self.peer_cert, client_gid)                   
+
+        if self.trusted_cert_list:
+            cred.verify(self.trusted_cert_file_list, self.config.SFA_CREDENTIAL_SCHEMA)
+        else:
+           raise MissingTrustedRoots(self.config.get_trustedroots_dir())
+
+        verified_credentials.add(cache_key, cred)
+        return cred
+
+    def check_target(self, cred, operation, hrn = None):
+        """
+        Cheap per-target stage of the check for an already verified credential:
+        check that the credential is allowed to perform the operation and that 
+        its target matches the specified hrn.
+
+        @param cred verified Credential object (see verify_credential)
+        """
+        self.client_cred = cred
+        self.client_gid = cred.get_gid_caller()
+        self.object_gid = cred.get_gid_object()
+        logger.debug("Auth.check_target: handling hrn=%s and credential=%s"%\
+                         (hrn,cred.get_summary_tostring()))
 
         # make sure the client is allowed to perform the operation
         if operation:
             if not self.client_cred.can_perform(operation):
                 raise InsufficientRights(operation)
 
-        if self.trusted_cert_list:
-            self.client_cred.verify(self.trusted_cert_file_list, self.config.SFA_CREDENTIAL_SCHEMA)
-        else:
-           raise MissingTrustedRoots(self.config.get_trustedroots_dir())
-       
         # Make sure the credential's target matches the specified hrn. 
         # This check does not apply to trusted peers 
-        trusted_peers = [gid.get_hrn() for gid in self.trusted_cert_list]
-        if hrn and self.client_gid.get_hrn() not in trusted_peers:
+        if hrn and self.client_gid.get_hrn() not in self.trusted_peer_hrns:
             target_hrn = self.object_gid.get_hrn()
             if not hrn == target_hrn:
                 raise PermissionError("Target hrn: %s doesn't match specified hrn: %s " % \
                                        (target_hrn, hrn) )       
         return True
 
+    def verified_credential_key(self, credential):
+        """
+        Key of a credential in the verified credentials cache: digest of the 
+        credential plus the fingerprint of the peer certificate of the connection
+        """
+        if not hasattr(self, 'peer_cert_fingerprint'):
+            self.peer_cert_fingerprint = None
+            if self.peer_cert:
+                self.peer_cert_fingerprint = hashlib.sha1(self.peer_cert.save_to_string()).hexdigest()
+        return (credential_digest(credential), self.peer_cert_fingerprint)
+
     def check_ticket(self, ticket):
         """
         Check if the tickt was signed by a trusted cert
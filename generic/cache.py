@@ -2,24 +2,68 @@
 # This module implements general purpose caching system
 #
 from __future__ import with_statement
+import os
+import sys
 import time
 import threading
 import pickle
+import zlib
+import sqlite3
 from datetime import datetime
+from collections import OrderedDict
+
+from sfa.util.sfalogging import logger
 
 # maximum lifetime of cached data (in seconds) 
 DEFAULT_CACHE_TTL = 60 * 60
 
+# default limits of the cache (number of entries and size in bytes)
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# default interval of the background sweep of expired entries (in seconds)
+DEFAULT_SWEEP_INTERVAL = 60
+
+# values bigger than this size (in bytes) are compressed in the persistent backend
+COMPRESSION_THRESHOLD = 1024
+
+# namespace used when none is specified
+DEFAULT_NAMESPACE = 'default'
+
+# default limits (max entries, max bytes) of the well-known namespaces
+DEFAULT_NAMESPACE_LIMITS = {
+    'advertisements': (16, 32 * 1024 * 1024),
+    'manifests': (1000, 16 * 1024 * 1024),
+    'entities': (5000, 8 * 1024 * 1024),
+    'credentials': (1000, 4 * 1024 * 1024),
+}
+
+
+def estimate_size(value):
+    """
+    Approximate size in bytes of a cached value (size of its pickle)
+    """
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
 class CacheData:
 
     data = None
     created = None
     expires = None
     lock = None
+    size = 0
+    accessed = 0
+    tags = ()
 
-    def __init__(self, data, ttl = DEFAULT_CACHE_TTL):
+    def __init__(self, data, ttl = DEFAULT_CACHE_TTL, size = None, tags = None):
         self.lock = threading.RLock()
         self.data = data
+        self.size = size if size is not None else estimate_size(data)
+        self.tags = tuple(tags or ())
         self.renew(ttl)
 
     def is_expired(self):
@@ -33,15 +77,18 @@ class CacheData:
 
     def renew(self, ttl = DEFAULT_CACHE_TTL):
         self.created = time.time()
+        self.accessed = self.created
         self.expires = self.created + ttl   
        
     def set_data(self, data, renew=True, ttl = DEFAULT_CACHE_TTL):
         with self.lock: 
             self.data = data
+            self.size = estimate_size(data)
             if renew:
                 self.renew(ttl)
     
     def get_data(self):
+        self.accessed = time.time()
         return self.data
 
 
@@ -64,61 +111,617 @@ class CacheData:
         self.lock = threading.RLock()
         
 
+class CacheFlight:
+    """
+    Computation of the value of a key in progress (single-flight).
+    Threads waiting for the same key wait on the event and take 
+    the result (or the error) of the thread that computes it.
+    """
+
+    def __init__(self, tags = None):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        # tags of the value being computed, and whether they were invalidated meanwhile
+        self.tags = tuple(tags or ())
+        self.invalidated = False
+
+
 class Cache:
+    """
+    Bounded LRU cache. Entries are grouped in namespaces (e.g. advertisements, 
+    manifests, entities, credentials), each one with its own limits of entries 
+    and bytes, on top of the global limits of the cache. When a limit is exceeded
+    the least recently used entries are evicted (first from the namespace, then
+    from the whole cache). Each instance has its own storage.
+    get_or_compute provides single-flight (dogpile) protection for misses: 
+    only one thread computes the value of a key while the rest wait for it
+    or, if serve_stale is enabled, get the expired value meanwhile.
+    Expired entries are removed by a background sweeper thread (see start_sweeper)
+    and the usage counters of the cache are available through stats().
+    Entries may carry tags (e.g. 'slice:<uri>', 'node:<uri>', 'advertisement')
+    and invalidate_tags removes all the entries carrying any of the given tags.
+    If a snapshot file is given, the contents are restored from it when the cache 
+    is created and saved to it by the sweeper, so they survive restarts.
+    """
 
-    cache  = {}
-    lock = threading.RLock()
     expiration_time = DEFAULT_CACHE_TTL
     
-    def __init__(self, exp_time=None, filename=None):
+    def __init__(self, exp_time=None, filename=None, max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+                 max_bytes=DEFAULT_CACHE_MAX_BYTES, namespace_limits=None, serve_stale=False, snapshot_file=None):
+        # namespace -> OrderedDict(key -> CacheData), in LRU order (last is most recent)
+        self.cache = {}
+        self.lock = threading.RLock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.namespace_limits = dict(DEFAULT_NAMESPACE_LIMITS)
+        if namespace_limits:
+            self.namespace_limits.update(namespace_limits)
+        self.size = 0
+        # usage counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.sweeper = None
+        self.sweep_interval = None
+        # expired entries are kept (until replaced or evicted) to be served while recomputed
+        self.serve_stale = serve_stale
+        # (namespace, key) -> CacheFlight of the values being computed
+        self.flights = {}
+        # tag -> set of (namespace, key) of the entries carrying the tag
+        self.tags = {}
+        self.invalidations = 0
         if exp_time:
             self.expiration_time = exp_time
         if filename:
             self.load_from_file(filename)
+        self.snapshot_file = snapshot_file
+        if snapshot_file and os.path.exists(snapshot_file):
+            try:
+                self.load_from_file(snapshot_file)
+                self.sweep()
+            except Exception:
+                # unreadable snapshot (e.g. interrupted write), start empty
+                self.clear()
         
     def set_exp_time(self, exp_time):
         self.expiration_time = exp_time
+
+    def set_namespace_limits(self, namespace, max_entries=None, max_bytes=None):
+        with self.lock:
+            self.namespace_limits[namespace] = (max_entries, max_bytes)
+            self.evict(namespace)
+
+    def get_namespace(self, namespace):
+        namespace = namespace or DEFAULT_NAMESPACE
+        entries = self.cache.get(namespace)
+        if entries is None:
+            entries = self.cache[namespace] = OrderedDict()
+        return entries
+
+    def namespace_size(self, namespace):
+        return sum([data.size for data in self.cache.get(namespace, {}).values()])
     
-    def add(self, key, value, ttl = None):
+    def add(self, key, value, ttl = None, namespace = None, tags = None):
         if not ttl:
             ttl = self.expiration_time
+        namespace = namespace or DEFAULT_NAMESPACE
         with self.lock:
-            if self.cache.has_key(key):
-                self.cache[key].set_data(value, ttl=ttl)
+            entries = self.get_namespace(namespace)
+            data = entries.pop(key, None)
+            if data is not None:
+                self.size -= data.size
+                data.set_data(value, ttl=ttl)
+                data.tags = tuple(tags or ())
             else:
-                self.cache[key] = CacheData(value, ttl=ttl)
+                data = CacheData(value, ttl=ttl, tags=tags)
+            ns_max_bytes = self.namespace_limits.get(namespace, (None, None))[1]
+            if (self.max_bytes and data.size > self.max_bytes) or (ns_max_bytes and data.size > ns_max_bytes):
+                # the value does not fit in the cache
+                return
+            entries[key] = data
+            self.size += data.size
+            for tag in data.tags:
+                self.tags.setdefault(tag, set()).add((namespace, key))
+            self.evict(namespace)
            
-    def get(self, key):
-        data = self.cache.get(key)
-        if not data:  
-            data = None
-        elif data.is_expired():
-            self.pop(key)
-            data = None 
-        else:
-            data = data.get_data()
-        return data
+    def get_entry(self, key, namespace = None):
+        """
+        Returns the CacheData of the key (even if expired) or None.
+        Expired entries are removed unless stale values are served.
+        """
+        namespace = namespace or DEFAULT_NAMESPACE
+        with self.lock:
+            entries = self.cache.get(namespace)
+            if not entries:
+                return None
+            data = entries.pop(key, None)
+            if data is None:
+                return None
+            if data.is_expired() and not self.serve_stale:
+                self.size -= data.size
+                self.expirations += 1
+                return None
+            # most recently used
+            entries[key] = data
+            return data
+
+    def count_access(self, data):
+        with self.lock:
+            if data is None or data.is_expired():
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def get(self, key, namespace = None):
+        data = self.get_entry(key, namespace)
+        self.count_access(data)
+        if data is None or data.is_expired():
+            return None
+        return data.get_data()
+
+    def get_or_compute(self, key, fn, ttl = None, namespace = None, stale = None, tags = None):
+        """
+        Returns the cached value of the key or, on a miss, computes it with fn()
+        and caches it. Only one thread computes the value of a key at a time:
+        concurrent callers wait for its result (errors are raised to all of them),
+        or get the expired value if stale values are served.
+
+        @param key key of the value
+        @param fn function without arguments that computes the value
+        @param ttl (optional) time to live of the computed value
+        @param namespace (optional) namespace of the key
+        @param stale (optional) serve the expired value while it is recomputed 
+            (defaults to the serve_stale setting of the cache)
+        @param tags (optional) tags of the computed value. If they are invalidated
+            while the value is computed, the value is returned but not cached.
+        """
+        namespace = namespace or DEFAULT_NAMESPACE
+        if stale is None:
+            stale = self.serve_stale
+        data = self.get_entry(key, namespace)
+        self.count_access(data)
+        if data is not None and not data.is_expired():
+            return data.get_data()
+        with self.lock:
+            flight = self.flights.get((namespace, key))
+            leader = flight is None
+            if leader:
+                flight = self.flights[(namespace, key)] = CacheFlight(tags)
+        if not leader:
+            if stale and data is not None:
+                return data.get_data()
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            # the value may have been computed while this thread was not the leader
+            data = self.get_entry(key, namespace)
+            if data is not None and not data.is_expired():
+                flight.result = data.get_data()
+            else:
+                flight.result = fn()
+                with self.lock:
+                    if not flight.invalidated:
+                        self.add(key, flight.result, ttl=ttl, namespace=namespace, tags=tags)
+            return flight.result
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[(namespace, key)]
+            flight.event.set()
+
+    def pop(self, key, namespace = None):
+        namespace = namespace or DEFAULT_NAMESPACE
+        with self.lock:
+            entries = self.cache.get(namespace)
+            if entries and key in entries:
+                self.size -= entries.pop(key).size
+
+    def clear(self, namespace = None):
+        with self.lock:
+            if namespace:
+                for data in self.cache.pop(namespace, {}).values():
+                    self.size -= data.size
+            else:
+                self.cache = {}
+                self.size = 0
+                self.tags = {}
+
+    def invalidate_tags(self, tags):
+        """
+        Remove the entries carrying any of the given tags.
+        Values being computed with any of the tags will not be cached.
+        Returns the number of removed entries.
+        """
+        removed = 0
+        with self.lock:
+            for tag in tags:
+                for namespace, key in self.tags.pop(tag, ()):
+                    entries = self.cache.get(namespace)
+                    data = entries.get(key) if entries else None
+                    if data is not None and tag in data.tags:
+                        self.size -= entries.pop(key).size
+                        removed += 1
+            self.invalidate_flights(tags)
+            self.invalidations += removed
+        return removed
+
+    def invalidate_flights(self, tags):
+        with self.lock:
+            for flight in self.flights.values():
+                if set(flight.tags).intersection(tags):
+                    flight.invalidated = True
+
+    def prune_tags(self):
+        """
+        Remove from the tag index the entries that are no longer in the cache
+        """
+        with self.lock:
+            for tag, keys in self.tags.items():
+                for namespace, key in list(keys):
+                    data = self.cache.get(namespace, {}).get(key)
+                    if data is None or tag not in data.tags:
+                        keys.discard((namespace, key))
+                if not keys:
+                    del self.tags[tag]
+
+    def evict(self, namespace):
+        """
+        Evict least recently used entries until the limits of the namespace 
+        and the global limits of the cache are satisfied
+        """
+        with self.lock:
+            max_entries, max_bytes = self.namespace_limits.get(namespace, (None, None))
+            entries = self.cache.get(namespace)
+            if entries and (max_entries or max_bytes):
+                ns_size = self.namespace_size(namespace)
+                while entries and ((max_entries and len(entries) > max_entries) or \
+                                   (max_bytes and ns_size > max_bytes)):
+                    key, data = entries.popitem(last=False)
+                    ns_size -= data.size
+                    self.size -= data.size
+                    self.evictions += 1
+            while self.cache and ((self.max_entries and len(self) > self.max_entries) or \
+                                  (self.max_bytes and self.size > self.max_bytes)):
+                # oldest among the least recently used entry of each namespace
+                victims = [(next(entries.itervalues()).accessed, ns) for ns, entries in self.cache.items() if entries]
+                if not victims:
+                    break
+                ns = min(victims)[1]
+                key, data = self.cache[ns].popitem(last=False)
+                self.size -= data.size
+                self.evictions += 1
+
+    def sweep(self):
+        """
+        Remove the expired entries of the cache. If stale values are served, 
+        expired entries are kept during an additional expiration time.
+        Returns the number of removed entries.
+        """
+        now = time.time()
+        grace = self.expiration_time if self.serve_stale else 0
+        removed = 0
+        with self.lock:
+            for entries in self.cache.values():
+                for key in [key for key, data in entries.items() if now > data.expires + grace]:
+                    self.size -= entries.pop(key).size
+                    removed += 1
+            self.expirations += removed
+            self.prune_tags()
+        return removed
+
+    def start_sweeper(self, interval = DEFAULT_SWEEP_INTERVAL):
+        """
+        Start the background (daemon) thread that sweeps expired entries every interval seconds
+        """
+        with self.lock:
+            self.sweep_interval = interval
+            if self.sweeper and self.sweeper.is_alive():
+                return
+            self.sweeper = threading.Thread(target=self.run_sweeper, name='cache-sweeper')
+            self.sweeper.daemon = True
+            self.sweeper.start()
+
+    def stop_sweeper(self):
+        self.sweep_interval = None
+
+    def run_sweeper(self):
+        while self.sweep_interval:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+                if self.snapshot_file:
+                    self.save_to_file(self.snapshot_file)
+            except Exception, e:
+                # the sweeper keeps running, the next sweep may succeed
+                logger.warning("CACHE: sweep/snapshot of the cache failed: %s"%e)
 
-    def pop(self, key):
-        if key in self.cache:
-            self.cache.pop(key) 
+    def usage(self):
+        """
+        Returns a dict namespace -> (entries, bytes) with the usage of each namespace
+        """
+        with self.lock:
+            return dict([(namespace, (len(entries), self.namespace_size(namespace))) 
+                         for namespace, entries in self.cache.items()])
+
+    def stats(self):
+        """
+        Returns the usage counters of the cache, globally and per namespace
+        """
+        usage = self.usage()
+        with self.lock:
+            lookups = self.hits + self.misses
+            namespaces = {}
+            for namespace, (entries, size) in usage.items():
+                max_entries, max_bytes = self.namespace_limits.get(namespace, (None, None))
+                namespaces[namespace] = {'entries': entries, 'bytes': size,
+                                         'max_entries': max_entries, 'max_bytes': max_bytes}
+            return {'hits': self.hits, 'misses': self.misses, 
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'invalidations': self.invalidations,
+                    'entries': sum([entries for entries, size in usage.values()]), 
+                    'bytes': sum([size for entries, size in usage.values()]),
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                    'namespaces': namespaces}
+
+    def __len__(self):
+        return sum([len(entries) for entries in self.cache.values()])
 
     def dump(self):
         result = {}
-        for key in self.cache:
-            result[key] = self.cache[key].__getstate__()
+        for namespace, entries in self.cache.items():
+            for key in entries:
+                result[(namespace, key)] = entries[key].__getstate__()
         return result
 
     def __str__(self):
         return str(self.dump())     
  
     def tostring(self):
-        return self.__str()    
+        return self.__str__()    
+
+    def save_to_file(self, filename):
+        # written to a temporary file and renamed, so the file is never left half-written
+        # the entries are pickled out of the lock (a shallow copy is taken), so the gets and adds
+        # of the cache are not blocked while the snapshot is written
+        with self.lock:
+            cache = dict([(namespace, OrderedDict(entries)) for namespace, entries in self.cache.items()])
+        tmp_filename = '%s.tmp'%filename
+        f = open(tmp_filename, 'wb')
+        try:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_filename, filename)
+
+    def load_from_file(self, filename):
+        f = open(filename, 'rb')
+        cache = pickle.load(f)
+        f.close()
+        with self.lock:
+            self.cache = {}
+            self.tags = {}
+            self.size = 0
+            # files saved by previous versions contain a plain dict key -> CacheData
+            if cache and not isinstance(cache.values()[0], dict):
+                cache = {DEFAULT_NAMESPACE: cache}
+            for namespace, entries in cache.items():
+                self.cache[namespace] = OrderedDict(entries)
+                self.size += sum([data.size for data in entries.values()])
+                for key, data in entries.items():
+                    for tag in data.tags:
+                        self.tags.setdefault(tag, set()).add((namespace, key))
+                self.evict(namespace)
+
+
+class SqliteCache(Cache):
+    """
+    Cache stored in a local SQLite database (WAL mode) shared by all the 
+    processes (e.g. SFA server workers) of the host that use the same file.
+    Values are stored pickled (binary protocol) and compressed with zlib 
+    when they are big. Expiration, LRU eviction and limits are enforced 
+    by the database queries, so every process sees the same entries.
+    The usage counters (hits, misses...) are those of the current process.
+    """
+
+    def __init__(self, path, exp_time=None, max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+                 max_bytes=DEFAULT_CACHE_MAX_BYTES, namespace_limits=None, serve_stale=False):
+        Cache.__init__(self, exp_time=exp_time, max_entries=max_entries, max_bytes=max_bytes,
+                       namespace_limits=namespace_limits, serve_stale=serve_stale)
+        self.path = path
+        # one connection per thread
+        self.local = threading.local()
+        with self.connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                              namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,
+                              size INTEGER NOT NULL, created REAL NOT NULL, expires REAL NOT NULL, 
+                              accessed REAL NOT NULL, PRIMARY KEY (namespace, key))""")
+            db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed)")
+            db.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            db.execute("""CREATE TABLE IF NOT EXISTS cache_tags (
+                              tag TEXT NOT NULL, namespace TEXT NOT NULL, key TEXT NOT NULL,
+                              PRIMARY KEY (tag, namespace, key))""")
+
+    def connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.text_factory = str
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def encode_key(self, key):
+        if isinstance(key, unicode):
+            return key.encode('utf-8')
+        if isinstance(key, str):
+            return key
+        return repr(key)
+
+    def encode_value(self, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > COMPRESSION_THRESHOLD:
+            return 'z' + zlib.compress(data)
+        return 'p' + data
+
+    def decode_value(self, blob):
+        blob = str(blob)
+        if blob[0] == 'z':
+            return pickle.loads(zlib.decompress(blob[1:]))
+        return pickle.loads(blob[1:])
+
+    def add(self, key, value, ttl = None, namespace = None, tags = None):
+        if not ttl:
+            ttl = self.expiration_time
+        namespace = namespace or DEFAULT_NAMESPACE
+        blob = self.encode_value(value)
+        size = len(blob)
+        ns_max_bytes = self.namespace_limits.get(namespace, (None, None))[1]
+        if (self.max_bytes and size > self.max_bytes) or (ns_max_bytes and size > ns_max_bytes):
+            # the value does not fit in the cache
+            return
+        now = time.time()
+        key = self.encode_key(key)
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                       (namespace, key, sqlite3.Binary(blob), size, now, now + ttl, now))
+            db.execute("DELETE FROM cache_tags WHERE namespace=? AND key=?", (namespace, key))
+            db.executemany("INSERT OR IGNORE INTO cache_tags VALUES (?, ?, ?)", 
+                           [(tag, namespace, key) for tag in (tags or ())])
+        self.evict(namespace)
+
+    def get_entry(self, key, namespace = None):
+        namespace = namespace or DEFAULT_NAMESPACE
+        key = self.encode_key(key)
+        now = time.time()
+        with self.connect() as db:
+            row = db.execute("SELECT value, size, created, expires FROM cache WHERE namespace=? AND key=?",
+                             (namespace, key)).fetchone()
+            if row is None:
+                return None
+            blob, size, created, expires = row
+            if now > expires and not self.serve_stale:
+                db.execute("DELETE FROM cache WHERE namespace=? AND key=?", (namespace, key))
+                with self.lock:
+                    self.expirations += 1
+                return None
+            db.execute("UPDATE cache SET accessed=? WHERE namespace=? AND key=?", (now, namespace, key))
+        data = CacheData(self.decode_value(blob), size=size)
+        data.created, data.expires = created, expires
+        return data
+
+    def pop(self, key, namespace = None):
+        namespace = namespace or DEFAULT_NAMESPACE
+        with self.connect() as db:
+            db.execute("DELETE FROM cache WHERE namespace=? AND key=?", (namespace, self.encode_key(key)))
+
+    def clear(self, namespace = None):
+        with self.connect() as db:
+            if namespace:
+                db.execute("DELETE FROM cache WHERE namespace=?", (namespace,))
+                db.execute("DELETE FROM cache_tags WHERE namespace=?", (namespace,))
+            else:
+                db.execute("DELETE FROM cache")
+                db.execute("DELETE FROM cache_tags")
+
+    def invalidate_tags(self, tags):
+        tags = list(tags)
+        if not tags:
+            return 0
+        marks = ','.join(['?'] * len(tags))
+        with self.connect() as db:
+            removed = db.execute("""DELETE FROM cache WHERE EXISTS (SELECT 1 FROM cache_tags t WHERE t.tag IN (%s)
+                                    AND t.namespace=cache.namespace AND t.key=cache.key)"""%marks, tags).rowcount
+            db.execute("DELETE FROM cache_tags WHERE tag IN (%s)"%marks, tags)
+        self.invalidate_flights(tags)
+        with self.lock:
+            self.invalidations += removed
+        return removed
+
+    def prune_tags(self):
+        with self.connect() as db:
+            db.execute("""DELETE FROM cache_tags WHERE NOT EXISTS (SELECT 1 FROM cache c 
+                          WHERE c.namespace=cache_tags.namespace AND c.key=cache_tags.key)""")
+
+    def namespace_size(self, namespace):
+        row = self.connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE namespace=?", 
+                                     (namespace,)).fetchone()
+        return row[1]
+
+    def evict_lru(self, db, namespace, max_entries, max_bytes):
+        """
+        Delete the least recently used entries of the namespace (all namespaces 
+        if None) until the limits are satisfied. Returns the number of deleted entries.
+        """
+        where, args = ("WHERE namespace=?", (namespace,)) if namespace else ("", ())
+        count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache %s"%where, args).fetchone()
+        evicted = 0
+        if max_entries and count > max_entries:
+            evicted += db.execute("""DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache %s 
+                                     ORDER BY accessed LIMIT ?)"""%where, args + (count - max_entries,)).rowcount
+            count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache %s"%where, args).fetchone()
+        if max_bytes and size > max_bytes:
+            excess = size - max_bytes
+            victims = []
+            for rowid, entry_size in db.execute("SELECT rowid, size FROM cache %s ORDER BY accessed"%where, args):
+                victims.append((rowid,))
+                excess -= entry_size
+                if excess <= 0:
+                    break
+            db.executemany("DELETE FROM cache WHERE rowid=?", victims)
+            evicted += len(victims)
+        return evicted
+
+    def evict(self, namespace):
+        max_entries, max_bytes = self.namespace_limits.get(namespace, (None, None))
+        with self.connect() as db:
+            evicted = 0
+            if max_entries or max_bytes:
+                evicted += self.evict_lru(db, namespace, max_entries, max_bytes)
+            evicted += self.evict_lru(db, None, self.max_entries, self.max_bytes)
+        with self.lock:
+            self.evictions += evicted
+
+    def sweep(self):
+        grace = self.expiration_time if self.serve_stale else 0
+        with self.connect() as db:
+            removed = db.execute("DELETE FROM cache WHERE expires < ?", (time.time() - grace,)).rowcount
+        self.prune_tags()
+        with self.lock:
+            self.expirations += removed
+        return removed
+
+    def usage(self):
+        return dict([(namespace, (entries, size)) for namespace, entries, size in self.connect().execute(
+                     "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache GROUP BY namespace")])
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def dump(self):
+        result = {}
+        for namespace, key, created, expires, size in self.connect().execute(
+                "SELECT namespace, key, created, expires, size FROM cache"):
+            result[(namespace, key)] = {'created': created, 'expires': expires, 'size': size}
+        return result
 
     def save_to_file(self, filename):
-        f = open(filename, 'w')
-        pickle.dump(self.cache, f)
+        """
+        No-op: the entries are already persisted in the database file (self.path),
+        so a snapshot file (e.g. the one saved by the sweeper) is not needed
+        """
+        pass
 
     def load_from_file(self, filename):
-        f = open(filename, 'r')
-        self.cache = pickle.load(f)
+        """
+        No-op: the entries are already persisted in the database file (self.path)
+        and shared by the processes that use it
+        """
+        pass
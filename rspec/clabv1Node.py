@@ -3,9 +3,12 @@ Created on Jun 3, 2014
 
 @author: gerard
 '''
+import threading
+from collections import OrderedDict
+
 from sfa.util.xrn import Xrn, get_leaf
-from sfa.util.xml import XpathFilter
-from lxml.etree import XPathEvalError 
+from sfa.util.xml import XpathFilter, XmlElement
+from lxml import etree
 
 from sfa.rspecs.elements.node import NodeElement
 from sfa.rspecs.elements.sliver import Sliver
@@ -26,6 +29,60 @@ from sfa.rspecs.elements.versions.clabv1Sliver import Clabv1Sliver
 from sfa.rspecs.elements.versions.clabv1Interface import Clabv1Interface
 from sfa.rspecs.elements.versions.clabv1NodeParameters import Clabv1Group, Clabv1Island
 
+
+NODES_WITH_SLIVERS_XPATH = '//node[count(sliver_type)>0] | //default:node[count(default:sliver_type) > 0]'
+
+# Children of a node element handled by the parser
+NODE_TAGS = ('hardware_type', 'location', 'granularity', 'interface', 'services', 'sliver_type', 'available')
+CLAB_NODE_TAGS = ('group', 'island', 'sliver_parameters')
+
+# Compiled XPath objects, keyed by (expression, namespaces), in LRU order.
+# The namespaces maps come from the parsed (user provided) RSpecs, so the number of entries is bounded.
+COMPILED_XPATHS_SIZE = 64
+_compiled_xpaths = OrderedDict()
+_compiled_xpaths_lock = threading.Lock()
+
+
+def split_children(element, namespaces, tags_by_prefix):
+    '''
+    Group the children of an lxml element by tag in a single pass.
+    A child is kept if its tag is listed for the prefix of its namespace, 
+    or if it has no namespace and its tag is listed for any prefix.
+    
+    :param element: lxml element whose children are grouped
+    :type lxml.etree._Element
+    
+    :param namespaces: namespaces map (prefix -> uri) of the document
+    :type dict
+    
+    :param tags_by_prefix: accepted tags for each namespace prefix
+    :type dict
+    
+    :returns dictionary tag -> list of XmlElement children, in document order
+    :rtype dict
+    '''
+    tags_by_namespace = {}
+    no_namespace_tags = set()
+    for prefix, tags in tags_by_prefix.items():
+        if namespaces.get(prefix):
+            tags_by_namespace[namespaces[prefix]] = tags
+        no_namespace_tags.update(tags)
+    children = {}
+    for child in element.iterchildren():
+        tag = child.tag
+        if not isinstance(tag, basestring):
+            # comments and processing instructions
+            continue
+        if tag[0] == '{':
+            namespace, tag = tag[1:].split('}', 1)
+            if tag not in tags_by_namespace.get(namespace, ()):
+                continue
+        elif tag not in no_namespace_tags:
+            continue
+        children.setdefault(tag, []).append(XmlElement(child, namespaces))
+    return children
+
+
 class Clabv1Node:
     
     @staticmethod
@@ -104,10 +161,42 @@ class Clabv1Node:
 
     @staticmethod
     def get_nodes_with_slivers(xml, filter={}):
-        xpath = '//node[count(sliver_type)>0] | //default:node[count(default:sliver_type) > 0]' 
-        node_elems = xml.xpath(xpath)        
+        # Precompiled query, evaluated directly on the lxml root of the document
+        find_nodes = Clabv1Node.compiled_xpath(NODES_WITH_SLIVERS_XPATH, xml.namespaces)
+        root = getattr(xml.root, 'element', xml.root)
+        node_elems = [XmlElement(node_elem, xml.namespaces) for node_elem in find_nodes(root)]
         return Clabv1Node.get_node_objs(node_elems)
 
+    @staticmethod
+    def compiled_xpath(xpath, namespaces):
+        '''
+        Return the etree.XPath object for the given expression and namespaces map.
+        The namespaces map depends on the parsed document, so the compiled objects
+        are kept per (expression, namespaces) pair, the least recently used ones are dropped.
+        '''
+        key = (xpath, tuple(sorted(namespaces.items())))
+        with _compiled_xpaths_lock:
+            compiled = _compiled_xpaths.pop(key, None)
+            if compiled is None:
+                compiled = etree.XPath(xpath, namespaces=namespaces)
+            _compiled_xpaths[key] = compiled
+            if len(_compiled_xpaths) > COMPILED_XPATHS_SIZE:
+                _compiled_xpaths.popitem(last=False)
+        return compiled
+
+    @staticmethod
+    def get_node_children(node_elem):
+        '''
+        Walk the children of a node element once, dispatching them by tag and namespace.
+        Standard RSpec elements are accepted in the default namespace or without namespace,
+        C-Lab extension elements in the clab namespace or without namespace.
+        
+        :returns dictionary tag -> list of XmlElement children, in document order
+        :rtype dict
+        '''
+        return split_children(node_elem.element, node_elem.namespaces, 
+                              {'default': NODE_TAGS, 'clab': CLAB_NODE_TAGS})
+
     @staticmethod
     def get_node_objs(node_elems):
         nodes = []
@@ -117,34 +206,38 @@ class Clabv1Node:
             if 'component_id' in node_elem.attrib:
                 node['authority_id'] = Xrn(node_elem.attrib['component_id']).get_authority_urn()
             
+            children = Clabv1Node.get_node_children(node_elem)
+            
             # get hardware types
-            hardware_type_elems = node_elem.xpath('./default:hardware_type | ./hardware_type')
-            node['hardware_types'] = [dict(hw_type.get_instance(HardwareType)) for hw_type in hardware_type_elems]
+            node['hardware_types'] = [dict(hw_type.get_instance(HardwareType)) for hw_type in children.get('hardware_type', [])]
             
             # get location
-            location_elems = node_elem.xpath('./default:location | ./location')
-            locations = [dict(location_elem.get_instance(Location)) for location_elem in location_elems]
-            if len(locations) > 0:
-                node['location'] = locations[0]
+            location_elems = children.get('location')
+            if location_elems:
+                node['location'] = dict(location_elems[0].get_instance(Location))
 
             # get granularity
-            granularity_elems = node_elem.xpath('./default:granularity | ./granularity')
-            if len(granularity_elems) > 0:
+            granularity_elems = children.get('granularity')
+            if granularity_elems:
                 node['granularity'] = granularity_elems[0].get_instance(Granularity)
 
             # get interfaces
-            iface_elems = node_elem.xpath('./default:interface | ./interface')
-            node['interfaces'] = [dict(iface_elem.get_instance(Interface)) for iface_elem in iface_elems]
+            node['interfaces'] = [dict(iface_elem.get_instance(Interface)) for iface_elem in children.get('interface', [])]
 
             # get services
-            node['services'] = PGv2Services.get_services(node_elem)
+            if 'services' in children:
+                node['services'] = PGv2Services.get_services(node_elem)
+            else:
+                node['services'] = []
             
             # get slivers
-            node['slivers'] = Clabv1Sliver.get_slivers(node_elem)    
+            sliver_parameters_elems = children.get('sliver_parameters')
+            sliver_parameters_elem = sliver_parameters_elems[0] if sliver_parameters_elems else None
+            node['slivers'] = Clabv1Sliver.get_sliver_objs(node_elem, children.get('sliver_type', []), sliver_parameters_elem)
             
             # get boot state
-            available_elems = node_elem.xpath('./default:available | ./available')
-            if len(available_elems) > 0 and 'now' in available_elems[0].attrib:
+            available_elems = children.get('available')
+            if available_elems and 'now' in available_elems[0].attrib:
                 if available_elems[0].attrib.get('now', '').lower() == 'true': 
                     node['boot_state'] = 'boot'
                 else: 
@@ -152,25 +245,13 @@ class Clabv1Node:
 
             # EXTENSION FOR CLab v1 RSpec
             # get group
-            try:
-                group_elems = node_elem.xpath('./clab:group | ./group')
-                if len(group_elems) > 0:
-                    group_elem = group_elems[0]
-                    group = dict(group_elem.get_instance(Clabv1Group))
-                    node['group'] = group
-            except XPathEvalError:
-                # there is no group element in the xml
-                pass
+            group_elems = children.get('group')
+            if group_elems:
+                node['group'] = dict(group_elems[0].get_instance(Clabv1Group))
             # get island
-            try:
-                island_elems = node_elem.xpath('./clab:island | ./island')
-                if len(island_elems) > 0:
-                    island_elem = island_elems[0]
-                    island = dict(island_elem.get_instance(Clabv1Island))
-                    node['island'] = island
-            except XPathEvalError:
-                # there is no island element in the xml
-                pass
+            island_elems = children.get('island')
+            if island_elems:
+                node['island'] = dict(island_elems[0].get_instance(Clabv1Island))
                
         return nodes
 
@@ -3,6 +3,7 @@ Created on Jun 3, 2014
 
 @author: gerard
 '''
+from sfa.util.xml import XmlElement
 from sfa.rspecs.elements.element import Element
 from sfa.rspecs.elements.sliver import Sliver
 from sfa.rspecs.elements.versions.pgv2DiskImage import PGv2DiskImage
@@ -71,8 +72,52 @@ class Clabv1Sliver:
     def get_slivers(xml, filter={}):
         xpath = './default:sliver_type | ./sliver_type'
         sliver_elems = xml.xpath(xpath)
-        slivers = []
+        try:
+            # Obtain the Complex element sliver_parameters (only one element in the node)
+            sliver_parameters_elem = xml.xpath('./clab:sliver_parameters | ./sliver_parameters', namespaces=xml.namespaces)[0]
+        except Exception:
+            # there is no element sliver_parameters in the xml
+            sliver_parameters_elem = None
+        return Clabv1Sliver.get_sliver_objs(xml, sliver_elems, sliver_parameters_elem)
+
+    @staticmethod
+    def get_sliver_objs(xml, sliver_elems, sliver_parameters_elem=None):
+        '''
+        Build the Sliver objects of a node from its already located sliver_type elements
+        and its (optional) sliver_parameters element.
+        
+        :param xml: node element containing the slivers
+        :type XmlElement
+        
+        :param sliver_elems: sliver_type elements of the node
+        :type list
         
+        :param sliver_parameters_elem: sliver_parameters element of the node (C-Lab extension)
+        :type XmlElement
+        
+        :returns list of Sliver objects
+        :rtype list
+        '''
+        # EXTENSION FOR CLab v1 RSpec
+        # The sliver parameters are the same for all the slivers of the node. Walk them once.
+        template = None
+        sliver_network_ifaces = []
+        if sliver_parameters_elem is not None:
+            clab_namespace = xml.namespaces.get('clab')
+            for child in sliver_parameters_elem.element.iterchildren():
+                tag = child.tag
+                if not isinstance(tag, basestring):
+                    continue
+                if tag[0] == '{':
+                    namespace, tag = tag[1:].split('}', 1)
+                    if namespace != clab_namespace:
+                        continue
+                if tag == 'template' and template is None:
+                    template = dict(XmlElement(child, xml.namespaces).get_instance(Clabv1Template))
+                elif tag == 'network_interface':
+                    sliver_network_ifaces.append(dict(XmlElement(child, xml.namespaces).get_instance(Clabv1NetworkInterface)))
+        
+        slivers = []
         for sliver_elem in sliver_elems:
             sliver = Sliver(sliver_elem.attrib,sliver_elem)
             
@@ -80,40 +125,18 @@ class Clabv1Sliver:
                 sliver['component_id'] = xml.attrib['component_id']
             if 'name' in sliver_elem.attrib:
                 sliver['type'] = sliver_elem.attrib['name']
-            sliver['disk_image'] = PGv2DiskImage.get_images(sliver_elem)
-            sliver['fw_rules'] = PLOSv1FWRule.get_rules(sliver_elem)
+            if len(sliver_elem.element):
+                sliver['disk_image'] = PGv2DiskImage.get_images(sliver_elem)
+                sliver['fw_rules'] = PLOSv1FWRule.get_rules(sliver_elem)
+            else:
+                # no children, neither disk images nor firewall rules
+                sliver['disk_image'] = []
+                sliver['fw_rules'] = []
             
-            # EXTENSION FOR CLab v1 RSpec
-            from sfa.util.sfalogging import logger
-            try:
-                # Obtain the Complex element sliver_parameters
-                # xpath command returns a list. Use '[0]' to get the single element (only one element in the returned list)
-                xpath = './clab:sliver_parameters | ./sliver_parameters'
-                sliver_parameters_elem = xml.xpath(xpath, namespaces=xml.namespaces)[0]
-                sliver_parameters = Clabv1SliverParameters(sliver_parameters_elem.attrib, sliver_parameters_elem)
-           
-                # get the template element
-                template_elems = sliver_parameters_elem.xpath('./clab:template | ./template', namespaces=xml.namespaces)
-                if template_elems:
-                    template_elem = template_elems[0]  
-                    template = dict(template_elem.get_instance(Clabv1Template))
-                    sliver['template'] = template
-                # get the sliver interfaces element (list of SliverInterface elems)
-                #sliver_interfaces_elems = sliver_parameters_elem.xpath('./clab:sliver_interfaces | ./sliver_interfaces', namespaces=xml.namespaces)
-                #if sliver_interfaces_elems:
-                #    sliver_interfaces_elem = sliver_interfaces_elems[0]  
-                #    sliver_network_iface_elems = sliver_interfaces_elem.xpath('./clab:network_interface | ./network_interface', namespaces=xml.namespaces)
-                #    sliver_network_ifaces = [dict(sliver_network_iface_elem.get_instance(Clabv1NetworkInterface)) for sliver_network_iface_elem in sliver_network_iface_elems]
-                #    sliver['sliver_interfaces'] = sliver_network_ifaces
-                    
-                sliver_network_iface_elems = sliver_parameters_elem.xpath('./clab:network_interface | ./network_interface', namespaces=xml.namespaces)
-                if sliver_network_iface_elems:
-                    sliver_network_ifaces = [dict(sliver_network_iface_elem.get_instance(Clabv1NetworkInterface)) for sliver_network_iface_elem in sliver_network_iface_elems]
-                    sliver['sliver_interfaces'] = sliver_network_ifaces
-                
-            except Exception:
-                # there is no element sliver_parameters in the xml
-                pass
+            if template is not None:
+                sliver['template'] = dict(template)
+            if sliver_network_ifaces:
+                sliver['sliver_interfaces'] = [dict(iface) for iface in sliver_network_ifaces]
             slivers.append(sliver)
         return slivers
 